@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+import argparse
+import time
+import sys
+import os
+
+# the rendering policy is defined in the dashboard
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from utils.utils import scatterTrace, GL_THRESHOLD
+from utils.downsampling import downsample
+
+#===========================
+#    RENDERING BENCHMARK
+#===========================
+# Builds a time-series figure (hourly data, 'markers+lines') with an
+# increasing number of points and measures, for each way of drawing it,
+# the time to build the figure and serialize it to JSON (what Dash does
+# before sending it) and the size of the JSON payload:
+# - SVG: go.Scatter, as all the figures used to do;
+# - WebGL: go.Scattergl;
+# - policy: scatterTrace (WebGL above GL_THRESHOLD points);
+# - policy + downsampling: scatterTrace on the series downsampled
+#   to the plot width (see utils/downsampling.py).
+# Drawing time in the browser is not measured here: SVG needs one DOM
+# node per marker, WebGL draws all of them in one buffer.
+# Usage (from the repository root):
+#     python benchmarks/render_benchmark.py --points 1000 10000 100000 500000
+
+
+def series(n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-01', periods=n_points, freq='h')
+    return pd.Series(rng.normal(0, 1, n_points).cumsum(), index=index)
+
+
+def buildFigure(method, s):
+    """
+    Returns the time to build the figure of *s* with the trace
+    returned by *method* and serialize it, the size of the JSON
+    and the type of the trace.
+    """
+    start = time.perf_counter()
+    trace = method(s)
+    fig = go.Figure(trace, layout_template='plotly_white')
+    payload = fig.to_json()
+    return time.perf_counter() - start, len(payload), trace.type
+
+
+def svgTrace(s):
+    return go.Scatter(x=s.index, y=s.values, mode='markers+lines')
+
+def webglTrace(s):
+    return go.Scattergl(x=s.index, y=s.values, mode='markers+lines')
+
+def policyTrace(s):
+    return scatterTrace(x=s.index, y=s.values, mode='markers+lines')
+
+def downsampledTrace(s):
+    s = downsample(s)
+    return scatterTrace(x=s.index, y=s.values, mode='markers+lines')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks payload size and build time of the figures.')
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 10000, 100000, 500000])
+    args = parser.parse_args()
+
+    methods = {
+        'SVG': svgTrace,
+        'WebGL': webglTrace,
+        'policy': policyTrace,
+        'policy + downsampling': downsampledTrace,
+    }
+    # the first figure also loads the plotly template
+    buildFigure(svgTrace, series(10))
+
+    print('GL_THRESHOLD = {} points\n'.format(GL_THRESHOLD))
+    print('{:>8}  {:<24}{:<12}{:>10}{:>12}'.format('points', 'method', 'trace', 'seconds', 'MB'))
+    for n in args.points:
+        s = series(n)
+        for name, method in methods.items():
+            seconds, size, trace_type = buildFigure(method, s)
+            print('{:>8}  {:<24}{:<12}{:>10.3f}{:>12.2f}'.format(n, name, trace_type, seconds, size / 2**20))
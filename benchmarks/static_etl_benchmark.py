@@ -0,0 +1,123 @@
+import pandas as pd
+import numpy as np
+import importlib.util
+import argparse
+import time
+import os
+
+#================================
+#    TOWER STATIC ETL BENCHMARK
+#================================
+# Compares, on synthetic _csvreg records, the conversion of the
+# Yyyy/Mm/Dd/Hh/Mn/UI/TAG records to per-year hourly tables done by
+# the former tower_static_treatment.py (pd.to_datetime on a DataFrame,
+# then for each year and sensor: filter, deduplicate and outer join)
+# with the vectorized one (columnar datetime assembly, one
+# drop_duplicates on (TAG, datetime) and a single pivot).
+# Usage (from the repository root):
+#     python benchmarks/static_etl_benchmark.py --sensors 150 --years 3
+
+ETL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'data_treatment', 'tower', 'tower_static_treatment.py')
+spec = importlib.util.spec_from_file_location('tower_static_treatment', ETL_PATH)
+etl = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(etl)
+
+time_map = {'Yyyy':'year','Mm':'month','Dd':'day', 'Hh':'hour','Mn':'minute'}
+
+
+def syntheticRecords(n_sensors, n_years, first_year=2020, seed=0):
+    """
+    Returns _csvreg-like records: one hourly record per sensor,
+    with about 10% of the records missing and 1% duplicated.
+    """
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(str(first_year), str(first_year + n_years), freq='h', inclusive='left')
+    sensors = ['S{:03d}'.format(i) for i in range(n_sensors)]
+    dt = pd.DatetimeIndex(np.tile(hours, n_sensors))
+    df = pd.DataFrame({
+        'Yyyy': dt.year, 'Mm': dt.month, 'Dd': dt.day, 'Hh': dt.hour, 'Mn': dt.minute,
+        'UI': rng.normal(0, 1, len(dt)).round(4),
+        'TAG': np.repeat(sensors, len(hours)),
+    })
+    df = df[rng.random(len(df)) > 0.1]
+    df = pd.concat([df, df.sample(frac=0.01, random_state=seed)])
+    # records arrive in time order, as in the _csvreg files
+    return df.sort_values(['Yyyy', 'Mm', 'Dd', 'Hh']).reset_index(drop=True)
+
+
+def legacyYearTables(df):
+    """
+    The per-year, per-sensor join loop of the former static ETL.
+    """
+    df = df.rename(columns=time_map)
+    df['datetime'] = pd.to_datetime(df[list(time_map.values())])
+
+    tables = {}
+    for y in df['year'].unique():
+        yearly_df = pd.DataFrame()
+        tmp_df = df[df['year'] == y]
+        for s in df['TAG'].unique():
+            tmp_df_s = tmp_df[tmp_df['TAG'] == s]
+            tmp_df_s = tmp_df_s.set_index('datetime')
+            tmp_df_s = tmp_df_s[~tmp_df_s.index.duplicated(keep='first')]
+            sensor_df = pd.DataFrame({s: tmp_df_s['UI'].values}, index=tmp_df_s.index)
+            yearly_df = yearly_df.join(sensor_df, how='outer')
+        tables[y] = yearly_df
+    return tables
+
+
+def longRecords(df):
+    """
+    The conversion done by the static ETL: long-format records,
+    deduplicated on (TAG, datetime).
+    """
+    records = pd.DataFrame({
+        'datetime': etl.assembleDatetimes(df),
+        'TAG': df['TAG'].astype('category'),
+        'UI': df['UI'],
+    })
+    return records.drop_duplicates(['TAG', 'datetime'], keep='first')
+
+
+def vectorizedYearTables(df):
+    """
+    The long-format records pivoted once to wide, split by year.
+    """
+    wide = longRecords(df).pivot(index='datetime', columns='TAG', values='UI')
+    wide.columns = wide.columns.astype(str)
+    wide.columns.name = None
+    return {y: table for y, table in wide.groupby(wide.index.year)}
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the Tower static ETL conversion.')
+    parser.add_argument('--sensors', type=int, default=150)
+    parser.add_argument('--years', type=int, default=3)
+    args = parser.parse_args()
+
+    df = syntheticRecords(args.sensors, args.years)
+    print('{} sensors, {} years: {} records'.format(args.sensors, args.years, len(df)))
+
+    legacy, t_legacy = timed(legacyYearTables, df)
+    vectorized, t_vectorized = timed(vectorizedYearTables, df)
+    _, t_long = timed(longRecords, df)
+
+    # same tables, up to the order of the columns
+    assert list(legacy) == list(vectorized)
+    for y, table in legacy.items():
+        pd.testing.assert_frame_equal(
+            table[sorted(table.columns)], vectorized[y],
+            check_names=False, check_freq=False
+        )
+
+    print('{:<40}{:>10}{:>10}'.format('conversion', 'seconds', 'speedup'))
+    print('{:<40}{:>10.2f}{:>10}'.format('per-year, per-sensor join loop', t_legacy, '1.0x'))
+    print('{:<40}{:>10.2f}{:>9.1f}x'.format('vectorized, pivoted per year', t_vectorized, t_legacy / t_vectorized))
+    print('{:<40}{:>10.2f}{:>9.1f}x'.format('vectorized, long format (ETL)', t_long, t_legacy / t_long))
@@ -1,6 +1,12 @@
 # package imports
 import numpy as np
 import pandas as pd
+import os
+import sys
+
+# the prism reference frame is defined in the dashboard
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+from data.baptistery.prism_reference import PRISM_CENTRE_X, PRISM_CENTRE_Y, PRISM_ROTATION
 
 #===================
 #    SENSOR DATA
@@ -82,13 +88,85 @@ def readExtensimeterData():
 
     return extensimeter_data
 
-PRISMS = readPrismData()
-LEVELLING = readLevellingData()
-EXTENSIMETERS = readExtensimeterData()
+def writePrismData():
+    prism_data = readPrismData()
+    prism_data.to_parquet('parquet_data/prisms')
+    return prism_data
+
+def writeLevellingData():
+    readLevellingData().to_parquet('parquet_data/levelling')
+
+def writeExtensimeterData():
+    readExtensimeterData().to_parquet('parquet_data/extensimeters')
+
+
+#===========================
+#    PRISM DISPLACEMENTS
+#===========================
+# E/N/z coordinates of the prisms and the components of their
+# displacement, computed here once for all the prisms and dates so
+# that the dashboard only has to select columns.
+
+# rotation of the x axis of the prisms from East (see prism_reference)
+ROTATION = np.deg2rad(PRISM_ROTATION)
+
+COMPONENTS = ['Total', 'Radial', 'Tangential', 'Vertical']
+
+def prismComponents(prism_data):
+    """
+    Returns a DataFrame with the same index as *prism_data* and
+    columns (prism, reference, component):
+    - ('position', 'E' / 'N' / 'z'): coordinates in metres, with the
+      origin in the centre of the Baptistery and E towards East;
+    - ('first', COMPONENTS): displacement in mm from the first date;
+    - ('mean', COMPONENTS): displacement in mm from the mean position
+      (the tangential one is still measured from the first date).
+    """
+    prisms = prism_data.columns.get_level_values(0).unique()
+    # dates on rows, prisms on columns
+    x = prism_data.xs('x', axis=1, level=1)[prisms].to_numpy(dtype='float64')
+    y = prism_data.xs('y', axis=1, level=1)[prisms].to_numpy(dtype='float64')
+    z = prism_data.xs('z', axis=1, level=1)[prisms].to_numpy(dtype='float64')
+
+    e = (x - PRISM_CENTRE_X)*np.cos(ROTATION) - (y - PRISM_CENTRE_Y)*np.sin(ROTATION)
+    n = (x - PRISM_CENTRE_X)*np.sin(ROTATION) + (y - PRISM_CENTRE_Y)*np.cos(ROTATION)
+
+    e_mm, n_mm, z_mm = e*1000., n*1000., z*1000.
+    r = np.sqrt(e_mm**2 + n_mm**2)
+    alpha = np.arctan(n_mm/e_mm)
+    tangential = r*np.sin(alpha - alpha[0])
+
+    def components(reference):
+        de, dn, dz, dr = [v - reference(v) for v in (e_mm, n_mm, z_mm, r)]
+        return [np.sqrt(de**2 + dn**2 + dz**2), dr, tangential, dz]
+
+    blocks = {
+        'position': dict(zip(['E', 'N', 'z'], [e, n, z])),
+        'first': dict(zip(COMPONENTS, components(lambda v: v[0]))),
+        'mean': dict(zip(COMPONENTS, components(lambda v: v.mean(axis=0)))),
+    }
+    columns = []
+    values = []
+    for i, p in enumerate(prisms):
+        for reference, block in blocks.items():
+            for component, array in block.items():
+                columns.append((p, reference, component))
+                values.append(array[:, i])
+
+    return pd.DataFrame(
+        np.column_stack(values),
+        index=prism_data.index,
+        columns=pd.MultiIndex.from_tuples(columns, names=['prism', 'reference', 'component'])
+    )
 
-PRISMS.to_parquet('parquet_data/prisms')
-LEVELLING.to_parquet('parquet_data/levelling')
-EXTENSIMETERS.to_parquet('parquet_data/extensimeters')
+def writePrismComponents(prism_data=None):
+    """
+    Saves prismComponents of *prism_data* (read from
+    parquet_data/prisms if not given).
+    """
+    if prism_data is None:
+        prism_data = pd.read_parquet('parquet_data/prisms')
+    prismComponents(prism_data).to_parquet('parquet_data/prism_components')
 
 
 #=======================
@@ -124,19 +202,29 @@ def readSensorPositions():
 
     return prism_pos, levelling_pos, extensimeter_pos, positions
 
-PRISM_POS, LEVELLING_POS, EXTENSIMETER_POS, POSITIONS = readSensorPositions()
+def writeSensorPositions():
+    PRISM_POS, LEVELLING_POS, EXTENSIMETER_POS, POSITIONS = readSensorPositions()
+
+    PRISM_POS.to_parquet('parquet_data/positions/prism_angles')
+    LEVELLING_POS.to_parquet('parquet_data/positions/levelling_angles')
+    EXTENSIMETER_POS.to_parquet('parquet_data/positions/extensimeter_angles')
+    POSITIONS.to_parquet('parquet_data/positions/positions')
 
 #=======================
 #    3D PRISMS CONNECTIVITY MATRIX
 #=======================
-conn=pd.read_csv('csv_data/conn_matrix.csv',delimiter=';',header=None,dtype='str')
-conn.to_parquet('parquet_data/connmat')
-
-
-
-PRISM_POS.to_parquet('parquet_data/positions/prism_angles')
-LEVELLING_POS.to_parquet('parquet_data/positions/levelling_angles')
-EXTENSIMETER_POS.to_parquet('parquet_data/positions/extensimeter_angles')
-POSITIONS.to_parquet('parquet_data/positions/positions')
+def writeConnectivityMatrix():
+    conn=pd.read_csv('csv_data/conn_matrix.csv',delimiter=';',header=None,dtype='str')
+    conn.to_parquet('parquet_data/connmat')
+
+
+# each file can also be converted in parallel by data_treatment/run_etl.py
+if __name__ == '__main__':
+    prism_data = writePrismData()
+    writePrismComponents(prism_data)
+    writeLevellingData()
+    writeExtensimeterData()
+    writeSensorPositions()
+    writeConnectivityMatrix()
 
 
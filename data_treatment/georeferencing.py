@@ -0,0 +1,91 @@
+import pandas as pd
+import numpy as np
+import functools
+import hashlib
+import os
+from pyproj import CRS
+from pyproj import Transformer
+
+#======================
+#    GEOREFERENCING
+#======================
+# Conversion of projected coordinates (e.g. UTM 32N, used by the
+# levelling surveys) to longitude and latitude (EPSG:4326, required
+# by Scattermapbox), shared by all the data_treatment scripts.
+# Whole coordinate arrays are transformed at once, and the result is
+# cached in CACHE_DIR, keyed by the hash of the source file: re-running
+# a script on an unchanged file doesn't transform anything.
+# Usage, from a script in data_treatment/<place>/:
+#     sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+#     from georeferencing import addLatLon
+#     addLatLon(df, 'csv_data/file.csv', 'x_UTM32n', 'y_UTM32n')
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'georeferencing')
+
+UTM_32N = '+proj=utm +zone=32 +north'
+WGS84_EPSG = 4326
+
+
+@functools.cache
+def wgs84Transformer(origin):
+    """
+    Returns the transformer from the *origin* CRS (any string
+    accepted by pyproj, e.g. UTM_32N or 'EPSG:32632') to WGS84.
+    """
+    origin_crs = CRS.from_string(origin)
+    return Transformer.from_crs(origin_crs, CRS.from_epsg(WGS84_EPSG), always_xy=True)
+
+
+def toWgs84(x, y, origin=UTM_32N):
+    """
+    Transforms the coordinate arrays *x* (easting) and *y* (northing)
+    from *origin* to WGS84, all points at once.
+    Returns two arrays: longitudes and latitudes.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    return wgs84Transformer(origin).transform(x, y)
+
+
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cachedToWgs84(source_path, x, y, origin=UTM_32N, key=''):
+    """
+    Like toWgs84, for coordinates read from *source_path*: the result
+    is cached and reused as long as the file doesn't change.
+    *key* distinguishes different coordinate sets read from the
+    same file (e.g. the names of the columns).
+    """
+    name = hashlib.sha256('{}|{}|{}'.format(fileHash(source_path), origin, key).encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, name)
+    if os.path.exists(path):
+        cached = pd.read_parquet(path)
+        if len(cached) == len(x):
+            return cached['lon'].to_numpy(), cached['lat'].to_numpy()
+
+    lon, lat = toWgs84(x, y, origin)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    pd.DataFrame({'lon': lon, 'lat': lat}).to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return lon, lat
+
+
+def addLatLon(df, source_path, x_column, y_column, origin=UTM_32N):
+    """
+    Adds 'lat' and 'lon' columns to *df*, read from *source_path*,
+    converting its *x_column* and *y_column* from *origin*.
+    """
+    df['lon'], df['lat'] = cachedToWgs84(
+        source_path,
+        df[x_column].to_numpy(),
+        df[y_column].to_numpy(),
+        origin,
+        key='{},{}'.format(x_column, y_column)
+    )
+    return df
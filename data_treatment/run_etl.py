@@ -0,0 +1,192 @@
+import concurrent.futures
+import importlib.util
+import argparse
+import fnmatch
+import glob
+import time
+import os
+
+#=================
+#    ETL RUNNER
+#=================
+# Runs the conversions of the data_treatment scripts in a pool of
+# processes, so that independent files are converted at the same time.
+# Each task is a function of one of the scripts, run from the folder
+# of the script (paths in the scripts are relative to it).
+# A task starts when all its dependencies are done, and receives
+# their results after its own arguments.
+# Usage (from any folder):
+#     python data_treatment/run_etl.py                  # everything, on all cores
+#     python data_treatment/run_etl.py --jobs 4 'square*'
+#     python data_treatment/run_etl.py --full           # also rebuild the static archive
+
+ETL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BAPTISTERY = 'baptistery/baptistery_data_treatment.py'
+SQUARE = 'square/square_data_treatment.py'
+TOWER = 'tower/tower_data_treatment.py'
+TOWER_STATIC = 'tower/tower_static_treatment.py'
+
+_MODULES = {}
+
+
+def task(script, function, args=(), deps=()):
+    return dict(script=script, function=function, args=tuple(args), deps=list(deps))
+
+
+def etlTasks(full=False):
+    """
+    Returns the tasks of a complete run, as a dict name -> task.
+    With *full*, the Tower static archive is rebuilt from scratch
+    (parsing the _csvreg files in parallel) instead of updated
+    with the new records only.
+    """
+    tasks = {}
+
+    # BAPTISTERY
+    for function in ['writePrismData', 'writeLevellingData', 'writeExtensimeterData',
+                     'writeSensorPositions', 'writeConnectivityMatrix']:
+        tasks['baptistery.' + function] = task(BAPTISTERY, function)
+    tasks['baptistery.writePrismComponents'] = task(
+        BAPTISTERY, 'writePrismComponents', deps=['baptistery.writePrismData']
+    )
+
+    # SQUARE
+    tasks['square.levelling'] = task(SQUARE, 'convertLevelling')
+    for sat in ['ers', 'env', 'sen', 'csk']:
+        for datatype in ['asc', 'des']:
+            tasks['square.{}_{}'.format(sat, datatype)] = task(SQUARE, 'convertSatelliteLos', [sat, datatype])
+        tasks['square.{}_info'.format(sat)] = task(
+            SQUARE, 'writeSatelliteLosInfo', [sat],
+            deps=['square.{}_asc'.format(sat), 'square.{}_des'.format(sat)]
+        )
+        tasks['square.{}_ver'.format(sat)] = task(SQUARE, 'convertSatelliteVer', [sat])
+        for datatype in ['asc', 'des', 'ver']:
+            tasks['square.{}_{}_pyramid'.format(sat, datatype)] = task(
+                SQUARE, 'writeSatellitePyramid', [sat, datatype],
+                deps=['square.{}_{}'.format(sat, datatype)]
+            )
+
+    # TOWER
+    for function in ['convertCapraroLevelling', 'convertCapraroBenchmarks', 'convertStabilization']:
+        tasks['tower.' + function] = task(TOWER, function)
+
+    # TOWER STATIC
+    static_dir = os.path.join(ETL_DIR, os.path.dirname(TOWER_STATIC))
+    filelist = sorted(glob.glob('csv_data/static/*_csvreg', root_dir=static_dir))
+    if full:
+        for f in filelist:
+            tasks['tower_static.' + os.path.basename(f)] = task(TOWER_STATIC, 'readStaticRecords', [f])
+        tasks['tower_static.archive'] = task(
+            TOWER_STATIC, 'fullRebuild', [filelist],
+            deps=['tower_static.' + os.path.basename(f) for f in filelist]
+        )
+    else:
+        tasks['tower_static.archive'] = task(TOWER_STATIC, 'incrementalIngest', [filelist])
+
+    return tasks
+
+
+def selectTasks(tasks, patterns):
+    """
+    Returns the tasks whose name matches one of *patterns*
+    (e.g. 'square*'), together with their dependencies.
+    """
+    selected = set()
+    todo = [n for n in tasks if any(fnmatch.fnmatch(n, p) for p in patterns)]
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo += tasks[name]['deps']
+    return {n: t for n, t in tasks.items() if n in selected}
+
+
+def runTask(script, function, args):
+    """
+    Runs *function* of *script* (path relative to data_treatment)
+    from the folder of the script. Runs in the worker processes.
+    Returns the result of the function and the time it took.
+    """
+    path = os.path.join(ETL_DIR, script)
+    if path not in _MODULES:
+        spec = importlib.util.spec_from_file_location(os.path.basename(script)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _MODULES[path] = module
+    os.chdir(os.path.dirname(path))
+
+    start = time.perf_counter()
+    result = getattr(_MODULES[path], function)(*args)
+    return result, time.perf_counter() - start
+
+
+def runTasks(tasks, jobs):
+    """
+    Runs *tasks* on *jobs* processes, each one as soon as its
+    dependencies are done. Tasks depending on a failed task are skipped.
+    Returns a dict name -> seconds (None for failed or skipped tasks).
+    """
+    results = {}
+    timings = {}
+    pending = dict(tasks)
+    running = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name, t in list(pending.items()):
+                if any(timings.get(d, 0) is None for d in t['deps']):
+                    print('[skipped] {}: a dependency failed'.format(name))
+                    timings[name] = None
+                    del pending[name]
+                elif all(d in results for d in t['deps']):
+                    args = t['args'] + tuple(results[d] for d in t['deps'])
+                    running[pool.submit(runTask, t['script'], t['function'], args)] = name
+                    del pending[name]
+
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                    print('[done] {} ({:.2f} s)'.format(name, timings[name]))
+                except Exception as e:
+                    timings[name] = None
+                    print('[failed] {}: {!r}'.format(name, e))
+
+            # results are only kept until all dependent tasks have started
+            needed = set(d for t in pending.values() for d in t['deps'])
+            for name in list(results):
+                if name not in needed:
+                    results[name] = None
+
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the raw data of MoMir to parquet, in parallel.')
+    parser.add_argument('patterns', nargs='*', default=['*'], help='names of the tasks to run (e.g. "square*"), default: all')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='number of processes (default: all cores)')
+    parser.add_argument('--full', action='store_true', help='rebuild the Tower static archive from scratch')
+    parser.add_argument('--list', action='store_true', help='list the tasks and their dependencies, without running them')
+    args = parser.parse_args()
+
+    tasks = selectTasks(etlTasks(args.full), args.patterns)
+    if args.list:
+        for name, t in tasks.items():
+            print(name, '<-', ', '.join(t['deps']) if t['deps'] else '')
+        raise SystemExit
+
+    start = time.perf_counter()
+    timings = runTasks(tasks, args.jobs)
+    wall = time.perf_counter() - start
+
+    print('\n{:<45}{:>10}'.format('task', 'seconds'))
+    for name, seconds in sorted(timings.items(), key=lambda x: -1 if x[1] is None else x[1], reverse=True):
+        print('{:<45}{:>10}'.format(name, 'failed' if seconds is None else '{:.2f}'.format(seconds)))
+    busy = sum(s for s in timings.values() if s is not None)
+    print('{} tasks on {} processes: {:.2f} s ({:.2f} s of work)'.format(len(timings), args.jobs, wall, busy))
+    if None in timings.values():
+        raise SystemExit(1)
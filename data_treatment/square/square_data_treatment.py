@@ -1,77 +1,85 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import sys
 from datetime import datetime
-from pyproj import CRS
-from pyproj import Transformer
+
+# georeferencing is shared by all the data_treatment scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from georeferencing import addLatLon, UTM_32N
 
 #=================
 #    LEVELLING
 #=================
-benchmarks = pd.read_csv('csv_data/levelling_2020.csv', index_col='id')
-
-
-# it's better if the index is strings, not integers,
-# despite the fact that benchmark names are integers
-# (one reason is that parquet doesn't work otherwise)
-benchmarks.index = benchmarks.index.map(str)
-
+def convertLevelling():
+    benchmarks = pd.read_csv('csv_data/levelling_2020.csv', index_col='id')
 
-# Coordinate conversion for compatibility with Scattermapbox
-origin_crs = CRS.from_string('+proj=utm +zone=32 +north')
-origin_epsg = origin_crs.to_epsg()
-destination_epsg = 4326 # required by Scattermapbox
-origin_string = 'EPSG:{}'.format(origin_epsg)
-destination_string = 'EPSG:{}'.format(destination_epsg)
 
-transformer = Transformer.from_crs(
-    origin_string,
-    destination_string,
-    always_xy=True
-)
+    # it's better if the index is strings, not integers,
+    # despite the fact that benchmark names are integers
+    # (one reason is that parquet doesn't work otherwise)
+    benchmarks.index = benchmarks.index.map(str)
 
-utm_longitudes = benchmarks['x_UTM32n'].values
-utm_latitudes = benchmarks['y_UTM32n'].values
 
-latitudes = []
-longitudes = []
+    # Coordinate conversion for compatibility with Scattermapbox
+    addLatLon(benchmarks, 'csv_data/levelling_2020.csv', 'x_UTM32n', 'y_UTM32n', UTM_32N)
 
-for lat, lon in zip(utm_latitudes, utm_longitudes):
-    transformed = transformer.transform(lon, lat)
-    longitudes.append(transformed[0])
-    latitudes.append(transformed[1])
+    # Separation in two DataFrames: one for info regarding the benchmarks
+    # (including position), the other with levelling DataFrames
 
-benchmarks['lat'] = latitudes
-benchmarks['lon'] = longitudes
+    # benchmark_info has ids as index
+    benchmark_info = benchmarks[['lat', 'lon', 'rel']]
 
-# Separation in two DataFrames: one for info regarding the benchmarks
-# (including position), the other with levelling DataFrames
+    # benchmark_data has dates as index
+    datenames = ['mag-93', 'ott-03', 'ott-04', 'lug-05', 'giu-06', 'lug-08', 'lug-10', 'lug-12', 'giu-14', 'giu-16', 'giu-18', 'giu-20']
+    dates = ['1993-05','2003-10','2004-10','2005-07','2006-06','2008-07','2010-07','2012-07','2014-06','2016-06','2018-06','2020-06']
+    dt_dates = [datetime.strptime(t, '%Y-%m') for t in dates]
 
-# benchmark_info has ids as index
-benchmark_info = benchmarks[['lat', 'lon', 'rel']]
+    benchmark_data = benchmarks[datenames]
+    benchmark_data = benchmark_data.transpose()
+    benchmark_data.index = dt_dates
 
-# benchmark_data has dates as index
-datenames = ['mag-93', 'ott-03', 'ott-04', 'lug-05', 'giu-06', 'lug-08', 'lug-10', 'lug-12', 'giu-14', 'giu-16', 'giu-18', 'giu-20']
-dates = ['1993-05','2003-10','2004-10','2005-07','2006-06','2008-07','2010-07','2012-07','2014-06','2016-06','2018-06','2020-06']
-dt_dates = [datetime.strptime(t, '%Y-%m') for t in dates]
-
-benchmark_data = benchmarks[datenames]
-benchmark_data = benchmark_data.transpose()
-benchmark_data.index = dt_dates
-
-benchmark_info.to_parquet('parquet_data/levelling_info')
-benchmark_data.to_parquet('parquet_data/levelling_data')
+    benchmark_info.to_parquet('parquet_data/levelling_info')
+    benchmark_data.to_parquet('parquet_data/levelling_data')
 
 
 
 #=================
 #    SATELLITE
 #=================
-
-def readSatelliteData(path, sat, datatype):
+SATELLITES = ['ers', 'env', 'sen', 'csk']
+
+# csv files of each satellite and datatype
+SAT_FILES = {
+    ('ers', 'asc'): 'csv_data/sat_los/ERS_ASC.csv',
+    ('ers', 'des'): 'csv_data/sat_los/ERS_DESC.csv',
+    ('env', 'asc'): 'csv_data/sat_los/ENV_ASC.csv',
+    ('env', 'des'): 'csv_data/sat_los/ENV_DESC.csv',
+    ('sen', 'asc'): 'csv_data/sat_los/SENT_ASC.csv',
+    ('sen', 'des'): 'csv_data/sat_los/SENT_DESC.csv',
+    ('csk', 'asc'): 'csv_data/sat_los/CSK_ASC.csv',
+    ('csk', 'des'): 'csv_data/sat_los/CSK_DESC.csv',
+    ('ers', 'ver'): 'csv_data/sat_ver/ERS_up.csv',
+    ('env', 'ver'): 'csv_data/sat_ver/ENV_up.csv',
+    ('sen', 'ver'): 'csv_data/sat_ver/SEN_up.csv',
+    ('csk', 'ver'): 'csv_data/sat_ver/CSK_up.csv',
+}
+
+# scatterers read at a time, so that memory
+# doesn't depend on the size of the file
+CHUNK_SIZE = 20000
+# scatterers in each row group of the files: the app reads
+# only the row groups of the scatterers it plots
+ROW_GROUP_SIZE = 2000
+
+def readSatelliteData(path, sat, datatype, chunksize=CHUNK_SIZE):
     """
-    Reads satellite data from a file and returns
-    two DataFrames, one containing metadata and
-    one containing measurements.
+    Reads satellite data from a file, *chunksize* scatterers
+    at a time, and yields for each chunk two DataFrames,
+    one containing metadata and one containing measurements
+    (one row per scatterer: ID and a column per date, 'YYYY-MM-DD').
     *sat* can be:
         - ers
         - env
@@ -83,131 +91,127 @@ def readSatelliteData(path, sat, datatype):
         - ver
         - hor
     """
-    df = pd.read_csv(path)
-    if datatype == 'asc' or datatype == 'des':
-        df = df.set_index('ID')
-    # rename index entries prepending satellite and datatype
-    df = df.rename((sat + '-' + datatype + '-{}').format)
-    if datatype == 'asc' or datatype == 'des':
-        df_info = df[['LAT', 'LON', 'HEIGHT', 'COHER', 'VEL']].copy()
-    elif datatype == 'ver':
-        df_info = df[['LAT', 'LON', 'VEL']].copy()
-    df_info.loc[:,'TYPE'] = datatype
-
     if datatype == 'ver':
         cols_to_skip = 3
     else:
         cols_to_skip = 16
 
-    df_data = df.iloc[:, cols_to_skip:].copy().transpose()
-    dates = df_data.index
-    dt_dates = [datetime.strptime(d, 'D%Y%m%d') for d in dates]
-    df_data.index = dt_dates
-
-    return df_info, df_data
-
-#---------------
-#    ERS LOS
-#---------------
-ers_asc_info, ers_asc_data = readSatelliteData('csv_data/sat_los/ERS_ASC.csv', 'ers', 'asc')
-ers_des_info, ers_des_data = readSatelliteData('csv_data/sat_los/ERS_DESC.csv', 'ers', 'des')
-
-ers_info = pd.concat([ers_asc_info, ers_des_info], axis=0)
-
-ers_info.to_parquet('parquet_data/sat_los/ers_info')
-ers_asc_data.to_parquet('parquet_data/sat_los/ers_asc')
-ers_des_data.to_parquet('parquet_data/sat_los/ers_des')
-
-
-#-------------------
-#    ENVISAT LOS
-#-------------------
-env_asc_info, env_asc_data = readSatelliteData('csv_data/sat_los/ENV_ASC.csv', 'env', 'asc')
-env_des_info, env_des_data = readSatelliteData('csv_data/sat_los/ENV_DESC.csv', 'env', 'des')
-
-env_info = pd.concat([env_asc_info, env_des_info], axis=0)
-
-env_info.to_parquet('parquet_data/sat_los/env_info')
-env_asc_data.to_parquet('parquet_data/sat_los/env_asc')
-env_des_data.to_parquet('parquet_data/sat_los/env_des')
-
-
-
-#--------------------
-#    SENTINEL LOS
-#--------------------
-sen_asc_info, sen_asc_data = readSatelliteData('csv_data/sat_los/SENT_ASC.csv', 'sen', 'asc')
-sen_des_info, sen_des_data = readSatelliteData('csv_data/sat_los/SENT_DESC.csv', 'sen', 'des')
-
-sen_info = pd.concat([sen_asc_info, sen_des_info], axis=0)
-
-sen_info.to_parquet('parquet_data/sat_los/sen_info')
-sen_asc_data.to_parquet('parquet_data/sat_los/sen_asc')
-sen_des_data.to_parquet('parquet_data/sat_los/sen_des')
-
-
-#------------------------
-#    COSMO-SKYMED LOS
-#------------------------
-csk_asc_info, csk_asc_data = readSatelliteData('csv_data/sat_los/CSK_ASC.csv', 'csk', 'asc')
-csk_des_info, csk_des_data = readSatelliteData('csv_data/sat_los/CSK_DESC.csv', 'csk', 'des')
-
-csk_info = pd.concat([csk_asc_info, csk_des_info], axis=0)
-
-csk_info.to_parquet('parquet_data/sat_los/csk_info')
-csk_asc_data.to_parquet('parquet_data/sat_los/csk_asc')
-csk_des_data.to_parquet('parquet_data/sat_los/csk_des')
-
-
-
-#---------------------------------------------------
-
-#---------------
-#    ERS VER
-#---------------
-ers_ver_info, ers_ver_data = readSatelliteData('csv_data/sat_ver/ERS_up.csv', 'ers', 'ver')
-
-ers_ver_info.to_parquet('parquet_data/sat_ver/ers_ver_info')
-ers_ver_data.to_parquet('parquet_data/sat_ver/ers_ver')
-
-
-#-------------------
-#    ENVISAT VER
-#-------------------
-env_ver_info, env_ver_data = readSatelliteData('csv_data/sat_ver/ENV_up.csv', 'env', 'ver')
-
-env_ver_info.to_parquet('parquet_data/sat_ver/env_ver_info')
-env_ver_data.to_parquet('parquet_data/sat_ver/env_ver')
-
-
-#--------------------
-#    SENTINEL VER
-#--------------------
-sen_ver_info, sen_ver_data = readSatelliteData('csv_data/sat_ver/SEN_up.csv', 'sen', 'ver')
-
-sen_ver_info.to_parquet('parquet_data/sat_ver/sen_ver_info')
-sen_ver_data.to_parquet('parquet_data/sat_ver/sen_ver')
-
-
-#------------------------
-#    COSMO-SKYMED VER
-#------------------------
-csk_ver_info, csk_ver_data = readSatelliteData('csv_data/sat_ver/CSK_up.csv', 'csk', 'ver')
-
-csk_ver_info.to_parquet('parquet_data/sat_ver/csk_ver_info')
-csk_ver_data.to_parquet('parquet_data/sat_ver/csk_ver')
-
-
-
-
-
-
+    for df in pd.read_csv(path, chunksize=chunksize):
+        # a file with the header only gives an empty chunk
+        if df.empty:
+            continue
+        if datatype == 'asc' or datatype == 'des':
+            df = df.set_index('ID')
+        # rename index entries prepending satellite and datatype
+        df = df.rename((sat + '-' + datatype + '-{}').format)
+        if datatype == 'asc' or datatype == 'des':
+            df_info = df[['LAT', 'LON', 'HEIGHT', 'COHER', 'VEL']].copy()
+        elif datatype == 'ver':
+            df_info = df[['LAT', 'LON', 'VEL']].copy()
+        df_info.loc[:,'TYPE'] = datatype
+
+        df_data = df.iloc[:, cols_to_skip:].astype('float64')
+        dates = pd.to_datetime(df_data.columns, format='D%Y%m%d')
+        df_data.columns = dates.strftime('%Y-%m-%d')
+        df_data.index.name = 'ID'
+
+        yield df_info, df_data.reset_index()
+
+
+def writeSatelliteData(path, sat, datatype, parquet_path):
+    """
+    Converts the measurements in *path* to *parquet_path*,
+    one chunk of scatterers at a time.
+    Returns the metadata of all the scatterers.
+    Raises ValueError if *path* has no scatterers.
+    """
+    infos = []
+    writer = None
+    for df_info, df_data in readSatelliteData(path, sat, datatype):
+        table = pa.Table.from_pandas(df_data, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(parquet_path, table.schema)
+        writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        infos.append(df_info)
+    if writer is None:
+        raise ValueError('{} contains no scatterers: nothing to convert'.format(path))
+    writer.close()
+    return pd.concat(infos)
+
+
+def convertSatelliteLos(sat, datatype):
+    """
+    Saves the LOS measurements of *sat* for *datatype*
+    ('asc' or 'des') and returns their metadata, which
+    is saved together for both datatypes by writeSatelliteLosInfo.
+    """
+    return writeSatelliteData(
+        SAT_FILES[(sat, datatype)], sat, datatype,
+        'parquet_data/sat_los/{}_{}'.format(sat, datatype)
+    )
 
 
+def writeSatelliteLosInfo(sat, asc_info, des_info):
+    info = pd.concat([asc_info, des_info], axis=0)
+    info.to_parquet('parquet_data/sat_los/{}_info'.format(sat))
 
 
+def convertSatelliteVer(sat):
+    """
+    Saves the vertical measurements of *sat* and their metadata.
+    """
+    info = writeSatelliteData(
+        SAT_FILES[(sat, 'ver')], sat, 'ver',
+        'parquet_data/sat_ver/{}_ver'.format(sat)
+    )
+    info.to_parquet('parquet_data/sat_ver/{}_ver_info'.format(sat))
 
 
+# resampled versions of the measurements, saved next to them
+# (e.g. sat_los/sen_asc_M), so that the app doesn't resample
+RESAMPLINGS = ['M', '6M', 'Y']
 
+def stackPath(sat, datatype):
+    if datatype == 'ver':
+        return 'parquet_data/sat_ver/{}_ver'.format(sat)
+    return 'parquet_data/sat_los/{}_{}'.format(sat, datatype)
 
 
+def writeSatellitePyramid(sat, datatype, *conversion):
+    """
+    Saves the measurements of *sat* for *datatype* resampled
+    (with the mean) at each of RESAMPLINGS, in the same layout
+    as the measurements, one row group of scatterers at a time.
+    (The results of the conversion, passed by run_etl, are not used.)
+    """
+    path = stackPath(sat, datatype)
+    source = pq.ParquetFile(path)
+    writers = {}
+    for i in range(source.num_row_groups):
+        df = source.read_row_group(i).to_pandas().set_index('ID').transpose()
+        df.index = pd.to_datetime(df.index)
+        for resample in RESAMPLINGS:
+            # all the row groups have the same dates,
+            # so they are resampled to the same columns
+            df_resampled = df.resample(resample).mean().transpose()
+            df_resampled.columns = df_resampled.columns.strftime('%Y-%m-%d')
+            table = pa.Table.from_pandas(df_resampled.reset_index(), preserve_index=False)
+            if resample not in writers:
+                writers[resample] = pq.ParquetWriter('{}_{}'.format(path, resample), table.schema)
+            writers[resample].write_table(table)
+    for writer in writers.values():
+        writer.close()
+
+
+# each file can also be converted in parallel by data_treatment/run_etl.py
+if __name__ == '__main__':
+    convertLevelling()
+    for sat in SATELLITES:
+        asc_info = convertSatelliteLos(sat, 'asc')
+        des_info = convertSatelliteLos(sat, 'des')
+        writeSatelliteLosInfo(sat, asc_info, des_info)
+    for sat in SATELLITES:
+        convertSatelliteVer(sat)
+    for sat in SATELLITES:
+        for datatype in ['asc', 'des', 'ver']:
+            writeSatellitePyramid(sat, datatype)
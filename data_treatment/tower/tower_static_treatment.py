@@ -1,40 +1,358 @@
 import pandas as pd
+import argparse
+import hashlib
 import glob
+import json
+import io
+import os
+import shutil
+import sys
+
+# sensor families are defined in the dashboard
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+from data.tower.static_sensor_list import t_sensor_family
 
 #============================
 #    TOWER STATIC SENSORS
 #============================
+# Static data is saved in long format (datetime, TAG, UI), in one file
+# per resampling, sensor family (see t_sensor_dict) and year:
+#     parquet_data/static/<resampling>/<family>/<year>
+# Each file is sorted by TAG and datetime and TAG is dictionary-encoded,
+# so that reading a few sensors over a few months only touches the
+# row groups that contain them. Sensors without a family go in 'other'.
+#
+# The _csvreg files only grow, so the archive is updated incrementally:
+# parquet_data/static/manifest.json records, for each file, how many
+# bytes have been ingested and a hash of the first and last 64 KB of
+# them (see prefixHash). On each run only the rows after that offset
+# are parsed, they are merged into the hourly files of their years and
+# only the daily, weekly and monthly buckets that contain them are
+# recomputed.
+# If an ingested file has been truncated or modified at its start or
+# end, or with --full, the whole archive is rebuilt. Edits in the middle
+# of an ingested file are not detected: run with --full after them.
+#
+# parquet_data/static/intervals lists, for each sensor, the intervals
+# (sensor, start, end) in which it has valid records, at hourly
+# resolution (end excluded): the dashboard draws the Gantt chart of
+# the sensors from it without reading the archive.
+
+STATIC_DIR = 'parquet_data/static'
+MANIFEST = os.path.join(STATIC_DIR, 'manifest.json')
+SENSOR_LIST = os.path.join(STATIC_DIR, 'all_sensors.txt')
+INTERVALS = os.path.join(STATIC_DIR, 'intervals')
+
+resamplings = {'daily': '1D', 'weekly': '1W', 'monthly': '1M'}
+
+# bytes hashed at the start and at the end of the ingested part of a file
+HASH_BLOCK = 2**16
 
-filelist = glob.glob('csv_data/static/*_csvreg')
 
-time_map = {'Yyyy':'year','Mm':'month','Dd':'day', 'Hh':'hour','Mn':'minute'}
+def readStaticRecords(f, offset=0):
+    """
+    Reads the complete lines of a _csvreg file after byte *offset*.
+    Returns:
+    - the records in long format: datetime, TAG, UI
+    - the offset of the end of the last line read
+    """
+    with open(f, 'rb') as fh:
+        header = fh.readline()
+        start = max(offset, len(header))
+        fh.seek(start)
+        data = fh.read()
+    # the last line may still be being written: it will be read next time
+    data = data[:data.rfind(b'\n') + 1]
+    if not data:
+        return pd.DataFrame(columns=['datetime', 'TAG', 'UI']), start
 
-for f in filelist:
     df = pd.read_csv(
-    f,
-    delimiter=';',
-    index_col=False,
-    usecols=['Yyyy', 'Mm', 'Dd', 'Hh', 'Mn', 'UI', 'TAG'],
-)
-    df = df.rename(columns=time_map)
-    df['datetime'] = pd.to_datetime(df[list(time_map.values())])
-
-    years = df['year'].unique()
-    sensors = df['TAG'].unique()
-
-    for y in years:
-        yearly_df = pd.DataFrame()
-        tmp_df = df[df['year'] == y]
-        for s in sensors:
-            tmp_df_s = tmp_df[tmp_df['TAG'] == s]
-            tmp_df_s = tmp_df_s.set_index('datetime')
-            tmp_df_s = tmp_df_s[~tmp_df_s.index.duplicated(keep='first')]
-            sensor_df = pd.DataFrame({s: tmp_df_s['UI'].values}, index=tmp_df_s.index)
-            yearly_df = yearly_df.join(sensor_df, how='outer')
-        yearly_df.to_parquet('parquet_data/static/h_'+str(y))
-        yearly_df.resample('1D').mean().to_parquet('parquet_data/static/d_'+str(y))
-        yearly_df.resample('1W').mean().to_parquet('parquet_data/static/w_'+str(y))
-        yearly_df.resample('1M').mean().to_parquet('parquet_data/static/m_'+str(y))
-
-with open('parquet_data/static/all_sensors.txt', 'w') as sensors_file:
-    sensors_file.write(','.join(list(sensors)))
+        io.BytesIO(header + data),
+        delimiter=';',
+        index_col=False,
+        usecols=['Yyyy', 'Mm', 'Dd', 'Hh', 'Mn', 'UI', 'TAG'],
+        dtype={'TAG': 'category'},
+    )
+    df['datetime'] = assembleDatetimes(df)
+    return df[['datetime', 'TAG', 'UI']], start + len(data)
+
+
+def assembleDatetimes(df):
+    """
+    Builds the datetimes of the records from their Yyyy, Mm, Dd, Hh, Mn
+    columns with numpy arithmetic on the whole columns
+    (several times faster than pd.to_datetime on a DataFrame).
+    """
+    month, day = df['Mm'].to_numpy(), df['Dd'].to_numpy()
+    hour, minute = df['Hh'].to_numpy(), df['Mn'].to_numpy()
+    # numpy doesn't complain about e.g. month 13, 25:00 or 01:75
+    # (it carries them over), check each field here
+    invalid = (month < 1) | (month > 12) | (day < 1) | (hour < 0) | (hour > 23) | (minute < 0) | (minute > 59)
+    if invalid.any():
+        raise ValueError('Invalid dates in the records')
+    months = (df['Yyyy'].to_numpy() - 1970) * 12 + month - 1
+    months = months.astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    minutes = hour * 60 + minute
+    # and days past the end of the month, e.g. Feb 30th
+    if (days.astype('datetime64[M]') != months).any():
+        raise ValueError('Invalid dates in the records')
+    return (days + minutes.astype('timedelta64[m]')).astype('datetime64[ns]')
+
+
+def prefixHash(f, offset):
+    """
+    Returns a hash of the first and last HASH_BLOCK bytes of the
+    first *offset* bytes of file *f* (all of them if shorter), so
+    that checking a file doesn't get slower as it grows.
+    Bytes in between are not hashed: an edit in the middle of
+    the file doesn't change the hash.
+    """
+    h = hashlib.sha256()
+    with open(f, 'rb') as fh:
+        h.update(fh.read(min(offset, HASH_BLOCK)))
+        fh.seek(max(offset - HASH_BLOCK, 0))
+        h.update(fh.read(offset - fh.tell()))
+    return h.hexdigest()
+
+
+def writeStaticPartitions(df, resampling, keep=None, static_dir=STATIC_DIR):
+    """
+    Writes the long-format DataFrame *df* in one file
+    per sensor family and year, under *static_dir*.
+    If *keep* is given, *df* is merged into the existing files and,
+    for records already archived (same TAG and datetime), 'first'
+    keeps the archived one and 'last' the one in *df*.
+    """
+    families = df['TAG'].map(lambda s: t_sensor_family.get(s, 'other'))
+    years = df['datetime'].dt.year
+    for (family, year), part in df.groupby([families, years], observed=True):
+        path = os.path.join(static_dir, resampling, family, str(year))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if keep is not None and os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+            part['TAG'] = part['TAG'].astype(str)
+            part = part.drop_duplicates(['TAG', 'datetime'], keep=keep)
+        part = part.sort_values(['TAG', 'datetime'])
+        part['TAG'] = part['TAG'].astype('category')
+        # write next to the file and swap, so that the dashboard
+        # never reads a half-written partition
+        # (about one month of hourly data of a sensor per row group)
+        part.to_parquet(path + '.tmp', index=False, row_group_size=24*31)
+        os.replace(path + '.tmp', path)
+
+
+def readHourlyRecords(sensors, start, end):
+    """
+    Reads the archived hourly records of *sensors*
+    between *start* and *end* (both included).
+    """
+    families = set(t_sensor_family.get(s, 'other') for s in sensors)
+    dfs = []
+    for family in families:
+        for year in range(start.year, end.year + 1):
+            path = os.path.join(STATIC_DIR, 'hourly', family, str(year))
+            if os.path.exists(path):
+                dfs.append(pd.read_parquet(path, filters=[
+                    ('TAG', 'in', list(sensors)),
+                    ('datetime', '>=', start),
+                    ('datetime', '<=', end)
+                ]))
+    df = pd.concat(dfs, ignore_index=True)
+    df['TAG'] = df['TAG'].astype(str)
+    return df
+
+
+def resampleRecords(records, freq):
+    return records.groupby(['TAG', pd.Grouper(key='datetime', freq=freq)], observed=True)['UI'].mean()
+
+
+def recomputeBuckets(new_records, freq):
+    """
+    Recomputes, from the hourly archive, the means of the *freq*
+    buckets that contain at least one of *new_records*.
+    """
+    affected = resampleRecords(new_records, freq).index
+    # buckets are at most one month long, so this window
+    # contains all the hourly records of the affected buckets
+    margin = pd.Timedelta(days=32)
+    hourly = readHourlyRecords(
+        new_records['TAG'].unique(),
+        new_records['datetime'].min() - margin,
+        new_records['datetime'].max() + margin
+    )
+    resampled = resampleRecords(hourly, freq)
+    resampled = resampled[resampled.index.isin(affected)]
+    return resampled.dropna().reset_index()
+
+
+def mergeIntervals(intervals):
+    """
+    Merges the intervals (sensor, start, end) of the same
+    sensor that overlap or touch each other.
+    """
+    df = intervals.sort_values(['sensor', 'start'], ignore_index=True)
+    # end of the intervals seen so far, for each sensor
+    reach = df.groupby('sensor')['end'].cummax()
+    same_sensor = df['sensor'].eq(df['sensor'].shift())
+    new = ~same_sensor | (df['start'] > reach.shift())
+    merged = df.groupby(new.cumsum()).agg(sensor=('sensor', 'first'), start=('start', 'min'), end=('end', 'max'))
+    return merged.reset_index(drop=True)
+
+
+def availabilityIntervals(records):
+    """
+    Returns the hourly intervals (sensor, start, end) in
+    which *records* (long format) have valid values.
+    """
+    valid = records[records['UI'].notna()]
+    hours = pd.DataFrame({
+        'sensor': valid['TAG'].astype(str),
+        'start': valid['datetime'].dt.floor('h'),
+    }).drop_duplicates()
+    hours['end'] = hours['start'] + pd.Timedelta(hours=1)
+    return mergeIntervals(hours)
+
+
+def readIntervals():
+    if os.path.exists(INTERVALS):
+        return pd.read_parquet(INTERVALS)
+    # archive built before the intervals were added: read them from it
+    paths = glob.glob(os.path.join(STATIC_DIR, 'hourly', '*', '[0-9][0-9][0-9][0-9]'))
+    return mergeIntervals(pd.concat(
+        [availabilityIntervals(pd.read_parquet(path)) for path in paths], ignore_index=True
+    ))
+
+
+def writeIntervals(intervals):
+    intervals.to_parquet(INTERVALS + '.tmp', index=False)
+    os.replace(INTERVALS + '.tmp', INTERVALS)
+
+
+def readManifest():
+    if not os.path.exists(MANIFEST):
+        return None
+    with open(MANIFEST) as manifest_file:
+        return json.load(manifest_file)
+
+
+def writeManifest(manifest):
+    with open(MANIFEST + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(MANIFEST + '.tmp', MANIFEST)
+
+
+def writeSensorList(sensors):
+    with open(SENSOR_LIST, 'w') as sensors_file:
+        sensors_file.write(','.join(list(sensors)))
+
+
+def replaceDir(new, old):
+    """
+    Replaces directory *old* with directory *new*.
+    """
+    shutil.rmtree(old + '.old', ignore_errors=True)
+    os.makedirs(os.path.dirname(old), exist_ok=True)
+    if os.path.exists(old):
+        os.replace(old, old + '.old')
+    if os.path.exists(new):
+        os.replace(new, old)
+    shutil.rmtree(old + '.old', ignore_errors=True)
+
+
+def fullRebuild(filelist, *parsed):
+    """
+    Rebuilds the whole archive from the _csvreg files in *filelist*.
+    If given, *parsed* are the results of readStaticRecords for each
+    file (data_treatment/run_etl.py reads the files in parallel).
+    """
+    if not parsed:
+        parsed = [readStaticRecords(f) for f in filelist]
+
+    manifest = {}
+    dfs = []
+    for f, (df, offset) in zip(filelist, parsed):
+        dfs.append(df)
+        manifest[os.path.basename(f)] = dict(offset=offset, hash=prefixHash(f, offset), rows=len(df))
+
+    # files with different sensors give an object column, back to categories
+    records = pd.concat(dfs, ignore_index=True).astype({'TAG': 'category'})
+    # if a sensor has more than one record at the same time, keep the first one
+    records = records.drop_duplicates(['TAG', 'datetime'], keep='first')
+
+    # the partitions are written in a new directory and swapped in,
+    # so that no file of the old archive survives (e.g. a year or a
+    # family that is no longer in the records)
+    new_dir = STATIC_DIR + '.new'
+    shutil.rmtree(new_dir, ignore_errors=True)
+    writeStaticPartitions(records, 'hourly', static_dir=new_dir)
+    for resampling, freq in resamplings.items():
+        writeStaticPartitions(resampleRecords(records, freq).dropna().reset_index(), resampling, static_dir=new_dir)
+    for resampling in ['hourly', *resamplings]:
+        replaceDir(os.path.join(new_dir, resampling), os.path.join(STATIC_DIR, resampling))
+    shutil.rmtree(new_dir, ignore_errors=True)
+
+    writeSensorList(records['TAG'].unique())
+    writeIntervals(availabilityIntervals(records))
+    writeManifest(manifest)
+    print('Archive rebuilt from {} files ({} records)'.format(len(filelist), len(records)))
+
+
+def incrementalIngest(filelist):
+    """
+    Adds to the archive the records appended to the _csvreg files
+    in *filelist* since the last run.
+    """
+    manifest = readManifest()
+    if manifest is None:
+        return fullRebuild(filelist)
+
+    dfs = []
+    for f in filelist:
+        name = os.path.basename(f)
+        entry = manifest.get(name, dict(offset=0, rows=0))
+        offset = entry['offset']
+        if offset > 0 and (os.path.getsize(f) < offset or prefixHash(f, offset) != entry['hash']):
+            print('{} has been modified since it was ingested: rebuilding the archive'.format(name))
+            return fullRebuild(filelist)
+
+        df, end = readStaticRecords(f, offset)
+        if end == offset:
+            continue
+        dfs.append(df)
+        manifest[name] = dict(offset=end, hash=prefixHash(f, end), rows=entry['rows'] + len(df))
+
+    if not dfs:
+        print('No new records')
+        return
+
+    records = pd.concat(dfs, ignore_index=True).astype({'TAG': 'category'})
+    records = records.drop_duplicates(['TAG', 'datetime'], keep='first')
+
+    # records already in the archive are kept, as in a full rebuild
+    writeStaticPartitions(records, 'hourly', keep='first')
+    for resampling, freq in resamplings.items():
+        writeStaticPartitions(recomputeBuckets(records, freq), resampling, keep='last')
+
+    with open(SENSOR_LIST) as sensors_file:
+        sensors = sensors_file.read().split(',')
+    writeSensorList(dict.fromkeys(sensors + list(records['TAG'].unique())))
+    writeIntervals(mergeIntervals(pd.concat(
+        [readIntervals(), availabilityIntervals(records)], ignore_index=True
+    )))
+    # the manifest is written last: if the run stops before,
+    # the same records are ingested again next time
+    writeManifest(manifest)
+    print('Ingested {} new records'.format(len(records)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Updates the Tower static sensors archive.')
+    parser.add_argument('--full', action='store_true', help='rebuild the whole archive')
+    args = parser.parse_args()
+
+    filelist = sorted(glob.glob('csv_data/static/*_csvreg'))
+    if args.full:
+        fullRebuild(filelist)
+    else:
+        incrementalIngest(filelist)
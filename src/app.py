@@ -1,7 +1,12 @@
+import os
+import threading
 import dash
 from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
 
+from data.registry import warmupPage, loadReport, watchDatasets
+from utils.export import registerExport
+
 app = Dash(__name__,
     use_pages=True,
     external_stylesheets=[dbc.themes.SANDSTONE, dbc.icons.FONT_AWESOME]
@@ -36,5 +41,35 @@ app.layout = dbc.Row([
     dbc.Col(width=1)
 ])
 
+# WSGI entry point, e.g. gunicorn --workers 4 app:server
+server = app.server
+
+# streaming download of time series, see utils.export
+registerExport(server)
+
+# Datasets are loaded on first use. To load the data of some pages
+# in advance, list them in the MOMIR_WARMUP environment variable,
+# e.g. MOMIR_WARMUP=baptistery,tower
+def warmup(pages):
+    for page in pages:
+        warmupPage(page)
+    print(loadReport())
+
+if (warmup_pages := os.environ.get('MOMIR_WARMUP')):
+    threading.Thread(
+        target=warmup,
+        args=([p.strip() for p in warmup_pages.split(',')],),
+        daemon=True
+    ).start()
+
+# Datasets that change on disk are reloaded without restarting the app:
+# set MOMIR_REFRESH to the number of seconds between two checks
+if (refresh_interval := os.environ.get('MOMIR_REFRESH')):
+    threading.Thread(
+        target=watchDatasets,
+        args=(float(refresh_interval),),
+        daemon=True
+    ).start()
+
 if __name__ == '__main__':
     app.run(debug=True, port=8051)
@@ -0,0 +1,183 @@
+# package imports
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+
+# local imports
+from data.shared_store import writeShared, readShared
+
+#===================
+#    ARROW CACHE
+#===================
+# Parquet files are compressed, so reading them means decoding all
+# the data at every start of the app. The build step
+#     python -m data.arrow_cache        (from src/)
+# converts every registered dataset and every file of the Tower static
+# archive to uncompressed Arrow IPC in CACHE_DIR, with the same relative
+# path. The app then memory-maps those files instead of reading the
+# Parquet ones: loading a dataset costs (almost) nothing.
+# Each entry records modification time, size and hash of its source.
+# An entry whose source has changed is not used (the Parquet file is
+# read instead) until the build step is run again, which only converts
+# the files that have changed.
+
+CACHE_DIR = os.environ.get('MOMIR_ARROW_CACHE', os.path.join('data', '.cache', 'arrow'))
+STAMP = 'source.json'
+
+_STALE = set()   # sources whose entry was found out of date
+
+
+def entryPath(source):
+    return os.path.join(CACHE_DIR, os.path.normpath(source))
+
+
+def sourceHash(source):
+    """
+    Returns the hash of the file *source*
+    (of all its files, if it is a directory).
+    """
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(root, f) for root, _, files in os.walk(source) for f in files)
+    else:
+        paths = [source]
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def sourceStamp(source, with_hash=True):
+    stat = os.stat(source)
+    stamp = dict(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    if with_hash:
+        stamp['sha256'] = sourceHash(source)
+    return stamp
+
+
+def isFresh(source):
+    """
+    Returns True if the cache entry of *source* exists and was built
+    from its current content. The hash is only computed if the
+    modification time or size have changed (e.g. the file was copied):
+    if it hasn't changed, the entry is still used.
+    """
+    stamp_path = os.path.join(entryPath(source), STAMP)
+    try:
+        with open(stamp_path) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    current = sourceStamp(source, with_hash=False)
+    if current['mtime_ns'] == stamp['mtime_ns'] and current['size'] == stamp['size']:
+        return True
+    if current['size'] != stamp['size'] or sourceHash(source) != stamp['sha256']:
+        return False
+    # same content: record the new modification time, written under
+    # a name unique to the process and then renamed, as several
+    # workers can do it at the same time
+    stamp.update(current)
+    tmp = '{}.{}.tmp'.format(stamp_path, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(stamp, f)
+        os.replace(tmp, stamp_path)
+    except OSError:
+        # the content is the same anyway: the entry can be used
+        pass
+    return True
+
+
+def cachedFrame(source):
+    """
+    Returns the DataFrame of *source* mapped from the cache,
+    None if the cache has no up-to-date entry for it.
+    """
+    entry = entryPath(source)
+    if not os.path.isdir(entry):
+        return None
+    if not isFresh(source):
+        if source not in _STALE:
+            _STALE.add(source)
+            print("Arrow cache of {} is out of date: reading the Parquet file".format(source))
+        return None
+    return readShared(entry)
+
+
+def cachedRead(source, reader):
+    """
+    Returns the DataFrame of *source*, from the cache if possible,
+    read with *reader* otherwise.
+    """
+    df = cachedFrame(source)
+    if df is None:
+        df = reader(source)
+    return df
+
+
+def buildEntry(source, reader):
+    """
+    Converts *source* (read with *reader*) to its cache entry,
+    unless the entry is up to date. Returns True if it was converted.
+    """
+    if isFresh(source):
+        return False
+    entry = entryPath(source)
+    stamp = sourceStamp(source)
+    df = reader(source)
+    # processes that have mapped the old entry keep their copy
+    shutil.rmtree(entry, ignore_errors=True)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    writeShared(df, entry)
+    # the stamp is written last: an entry without it is never used
+    with open(os.path.join(entry, STAMP), 'w') as f:
+        json.dump(stamp, f)
+    return True
+
+
+def cacheSources():
+    """
+    Returns the sources to cache, as a dict path -> reader:
+    all the registered datasets and the Tower static archive.
+    """
+    # importing the data modules registers all the datasets
+    from data import baptistery_data, square_data, tower_data
+    from data.registry import DATASETS
+    from data.tower.static_archive import STATIC_DIR, RESAMPLINGS
+
+    sources = {info['path']: info['reader'] for info in DATASETS.values()}
+    for resample in RESAMPLINGS:
+        for root, _, files in os.walk(os.path.join(STATIC_DIR, resample)):
+            for f in files:
+                if not f.endswith('.tmp'):
+                    sources[os.path.join(root, f)] = pd.read_parquet
+    return sources
+
+
+def buildCache():
+    """
+    Brings the cache up to date and removes the entries
+    of files that don't exist anymore.
+    """
+    sources = cacheSources()
+    built = 0
+    for source, reader in sources.items():
+        if os.path.exists(source) and buildEntry(source, reader):
+            print("Cached {}".format(source))
+            built += 1
+
+    entries = {entryPath(s) for s in sources if os.path.exists(s)}
+    for root, dirs, files in os.walk(CACHE_DIR, topdown=True):
+        if STAMP in files:
+            if root not in entries:
+                shutil.rmtree(root, ignore_errors=True)
+                print("Removed {}".format(root))
+            dirs[:] = []
+    print("{} of {} files converted".format(built, len(sources)))
+
+
+if __name__ == '__main__':
+    buildCache()
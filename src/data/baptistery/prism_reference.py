@@ -0,0 +1,12 @@
+#=========================
+#    PRISM REFERENCE
+#=========================
+# Reference frame of the prisms, shared by the dashboard and by
+# data_treatment/baptistery (which precomputes B_PRISM_COMPONENTS):
+# the centre of the Baptistery in the (x, y) system of the prism
+# survey, in metres, and the rotation (in degrees) that brings the
+# x axis towards East.
+
+PRISM_CENTRE_X = 15.184322095298622
+PRISM_CENTRE_Y = -0.01676310147012092
+PRISM_ROTATION = 37.1
@@ -1,22 +1,30 @@
-# package imports
-import pandas as pd
+# local imports
+from data.registry import registerDataset, datasetGetattr
+
+# Datasets are only registered here: they are read from disk
+# the first time they are used (see data.registry).
 
 #===================
 #    SENSOR DATA
 #===================
-B_PRISMS = pd.read_parquet('data/baptistery/parquet_data/prisms')
-B_LEVELLING = pd.read_parquet('data/baptistery/parquet_data/levelling')
-B_EXTENSIMETERS = pd.read_parquet('data/baptistery/parquet_data/extensimeters')
+registerDataset('B_PRISMS', 'data/baptistery/parquet_data/prisms', 'baptistery')
+registerDataset('B_LEVELLING', 'data/baptistery/parquet_data/levelling', 'baptistery')
+registerDataset('B_EXTENSIMETERS', 'data/baptistery/parquet_data/extensimeters', 'baptistery')
+# E/N/z and displacement components of the prisms, computed by
+# data_treatment/baptistery (columns: prism, reference, component)
+registerDataset('B_PRISM_COMPONENTS', 'data/baptistery/parquet_data/prism_components', 'baptistery')
 
 #=====================
 #    POSITION DATA
 #=====================
-B_PRISM_POS = pd.read_parquet('data/baptistery/parquet_data/positions/prism_angles')
-B_LEVELLING_POS = pd.read_parquet('data/baptistery/parquet_data/positions/levelling_angles')
-B_EXTENSIMETER_POS = pd.read_parquet('data/baptistery/parquet_data/positions/extensimeter_angles')
-B_POSITIONS = pd.read_parquet('data/baptistery/parquet_data/positions/positions')
+registerDataset('B_PRISM_POS', 'data/baptistery/parquet_data/positions/prism_angles', 'baptistery')
+registerDataset('B_LEVELLING_POS', 'data/baptistery/parquet_data/positions/levelling_angles', 'baptistery')
+registerDataset('B_EXTENSIMETER_POS', 'data/baptistery/parquet_data/positions/extensimeter_angles', 'baptistery')
+registerDataset('B_POSITIONS', 'data/baptistery/parquet_data/positions/positions', 'baptistery')
 
 #=====================
 #  3D DATA
 #=====================
-CONNMAT = pd.read_parquet('data/baptistery/parquet_data/connmat')
+registerDataset('CONNMAT', 'data/baptistery/parquet_data/connmat', 'baptistery')
+
+__getattr__ = datasetGetattr(__name__, 'baptistery')
@@ -0,0 +1,253 @@
+# package imports
+import functools
+import threading
+import time
+import os
+import pandas as pd
+
+# local imports
+from data import shared_store
+from data.arrow_cache import cachedRead
+
+#========================
+#    DATASET REGISTRY
+#========================
+# Every dataset used by the dashboard is registered here, together
+# with the page that needs it. Nothing is read from disk at import
+# time: a dataset is loaded the first time it is requested, so a
+# worker only pays (in time and memory) for the pages it serves.
+#
+# Data modules (data/*_data.py) register their datasets and expose
+# them as lazy module attributes, e.g.:
+#     from data import baptistery_data as b_data
+#     b_data.B_PRISMS    # read from disk on first access only
+#
+# Loaded datasets can be refreshed while the app is running (see
+# refreshDatasets): a new version replaces the old one at once, and
+# requests that are using the old one keep it until they end.
+
+DATASETS = {}     # name -> dict(path=..., page=..., reader=...)
+LOAD_TIMES = {}   # name -> dict(seconds=..., mb=...)
+_LOADED = {}      # name -> (version, loaded DataFrame)
+_LOCK = threading.Lock()
+_NAME_LOCKS = {}
+_REFRESH_HOOKS = []
+_WATCHED = {}     # path -> version, of other files that trigger a refresh
+
+
+def registerDataset(name, path, page, reader=pd.read_parquet):
+    """
+    Registers a dataset without loading it.
+    Expects:
+    - name: the name used to retrieve the dataset (e.g. 'B_PRISMS')
+    - path: path of the file on disk
+    - page: the page that uses the dataset (e.g. 'baptistery')
+    - reader: function taking *path* and returning the DataFrame
+    """
+    DATASETS[name] = dict(path=path, page=page, reader=reader)
+
+
+def _nameLock(name):
+    with _LOCK:
+        return _NAME_LOCKS.setdefault(name, threading.Lock())
+
+
+def _readDataset(name):
+    """
+    Reads the dataset *name* from disk.
+    Returns its version and the DataFrame.
+    """
+    info = DATASETS[name]
+    # the version is read first: if the file changes while
+    # it is read, the next refresh reads it again
+    version = datasetVersion(name)
+    start = time.perf_counter()
+    if shared_store.SHARED_DIR:
+        # one copy of the data for all the worker processes
+        df = shared_store.sharedDataset(
+            name, version,
+            lambda: cachedRead(info['path'], info['reader'])
+        )
+    else:
+        df = cachedRead(info['path'], info['reader'])
+    seconds = time.perf_counter() - start
+    mb = df.memory_usage(deep=True).sum() / 2**20
+    LOAD_TIMES[name] = dict(page=info['page'], seconds=seconds, mb=mb)
+    print("Loaded {} in {:.3f} s ({:.1f} MB)".format(name, seconds, mb))
+    return version, df
+
+
+def _loaded(name):
+    try:
+        return _LOADED[name]
+    except KeyError:
+        pass
+
+    # one lock per dataset, so that concurrent requests don't
+    # read the same file twice, but different datasets can be
+    # loaded in parallel
+    with _nameLock(name):
+        if name not in _LOADED:
+            _LOADED[name] = _readDataset(name)
+    return _LOADED[name]
+
+
+def getDataset(name):
+    """
+    Returns the dataset called *name*, reading it from disk
+    the first time it is requested.
+    """
+    return _loaded(name)[1]
+
+
+def loadedVersion(name):
+    """
+    Returns the version (see datasetVersion) of the dataset *name*
+    that is in memory, loading it if needed.
+    """
+    return _loaded(name)[0]
+
+
+def datasetVersion(name):
+    """
+    Returns a stamp that changes whenever the file of the dataset
+    *name* is rewritten (modification time and size), the same in
+    all the worker processes. Used to key the figure cache.
+    """
+    return fileVersion(DATASETS[name]['path'])
+
+
+def fileVersion(path):
+    stat = os.stat(path)
+    return '{}-{}'.format(stat.st_mtime_ns, stat.st_size)
+
+
+def watchFile(path):
+    """
+    Makes refreshDatasets clear the caches when *path* changes,
+    for data that is read from disk without the registry
+    (e.g. the manifest of the Tower static archive).
+    """
+    try:
+        _WATCHED[path] = fileVersion(path)
+    except OSError:
+        _WATCHED[path] = None
+
+
+def refreshDatasets():
+    """
+    Reads again the loaded datasets whose file has changed, and
+    replaces them. The caches registered with refreshCache are
+    cleared afterwards. Returns the names of the refreshed datasets.
+    """
+    refreshed = []
+    try:
+        for name, (version, _) in list(_LOADED.items()):
+            try:
+                if datasetVersion(name) == version:
+                    continue
+                with _nameLock(name):
+                    _LOADED[name] = _readDataset(name)
+            except Exception as e:
+                # e.g. the file is being written: the old version
+                # is kept, and read again next time
+                print("Could not refresh {}: {!r}".format(name, e))
+                continue
+            refreshed.append(name)
+
+        for path, version in list(_WATCHED.items()):
+            watchFile(path)
+            if _WATCHED[path] != version:
+                refreshed.append(path)
+    finally:
+        # the caches are cleared for what has been replaced,
+        # even if something else failed
+        if refreshed:
+            for hook in _REFRESH_HOOKS:
+                hook()
+    return refreshed
+
+
+def watchDatasets(interval):
+    """
+    Calls refreshDatasets every *interval* seconds (forever:
+    to be run in a daemon thread).
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            refreshed = refreshDatasets()
+        except Exception as e:
+            print("Dataset refresh failed: {!r}".format(e))
+            continue
+        if refreshed:
+            print("Refreshed {}".format(', '.join(refreshed)))
+
+
+def onRefresh(hook):
+    """
+    Registers *hook* (a function with no arguments) to be
+    called after datasets have been refreshed.
+    """
+    _REFRESH_HOOKS.append(hook)
+
+
+def refreshCache(function):
+    """
+    Like functools.cache, for functions that depend on the
+    datasets: the cache is cleared when datasets are refreshed.
+    """
+    cached = functools.cache(function)
+    onRefresh(cached.cache_clear)
+    return cached
+
+
+def isLoaded(name):
+    return name in _LOADED
+
+
+def datasetExists(name):
+    """
+    Returns True if the file of the dataset *name* exists
+    (files written by optional ETL steps may not).
+    """
+    return os.path.exists(DATASETS[name]['path'])
+
+
+def pageDatasets(page):
+    """
+    Returns the names of the datasets registered for *page*.
+    """
+    return [n for n, info in DATASETS.items() if info['page'] == page]
+
+
+def warmupPage(page):
+    """
+    Loads all the datasets of *page*, so that the first
+    visitor of the page doesn't have to wait for them.
+    """
+    for name in pageDatasets(page):
+        if datasetExists(name):
+            getDataset(name)
+
+
+def loadReport():
+    """
+    Returns a DataFrame with loading time and memory
+    of the datasets loaded so far.
+    """
+    report = pd.DataFrame.from_dict(LOAD_TIMES, orient='index', columns=['page', 'seconds', 'mb'])
+    return report.sort_values('seconds', ascending=False)
+
+
+def datasetGetattr(module_name, page):
+    """
+    Builds the module-level __getattr__ of a data module,
+    so that the datasets registered for *page* can be accessed
+    as attributes and are loaded only when used.
+    """
+    def __getattr__(name):
+        if name not in DATASETS or DATASETS[name]['page'] != page:
+            raise AttributeError("module '{}' has no attribute '{}'".format(module_name, name))
+        return getDataset(name)
+    return __getattr__
@@ -0,0 +1,139 @@
+# package imports
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+#====================
+#    SHARED STORE
+#====================
+# When the app runs with several worker processes (e.g. gunicorn),
+# each worker would read its own copy of every dataset. If the
+# MOMIR_SHARED_DATA environment variable is set (to a directory,
+# preferably in memory, e.g. /dev/shm/momir), each dataset is instead
+# written there once, as uncompressed Arrow IPC files, and all the
+# workers memory-map the same files: the data is in RAM only once.
+# - Entries are named after the dataset and its version
+#   (see data.registry.datasetVersion): when a data file changes, a
+#   new entry is written and the old ones are removed; workers that
+#   still use them keep their mapping until they reload.
+# - Non-empty DataFrames with one numeric dtype (sensor data, PS stacks) are
+#   stored as a single 2D block, the others column by column.
+# - Mapped DataFrames are read-only: code must not modify them in place.
+# The entries can be written before starting the workers with
+#     MOMIR_SHARED_DATA=/dev/shm/momir python -m data.shared_store
+
+SHARED_DIR = os.environ.get('MOMIR_SHARED_DATA')
+
+
+def _writeIpc(table, path):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _readIpc(path):
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def _labelsTable(labels):
+    # stored as the index of an empty DataFrame, so that
+    # names, levels and dtypes are restored by pyarrow
+    return pa.Table.from_pandas(pd.DataFrame(index=labels))
+
+
+def _labels(table):
+    return table.to_pandas().index
+
+
+def writeShared(df, path):
+    """
+    Writes *df* to the directory *path* (which must not exist),
+    in a form that readShared can map without copying.
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    os.makedirs(tmp)
+    dtypes = set(df.dtypes)
+    if len(dtypes) == 1 and np.issubdtype(dtypes.pop(), np.number) and df.size > 0:
+        # pandas keeps a single block as (columns, rows):
+        # store it that way, so that it is mapped back as it is
+        values = np.ascontiguousarray(df.to_numpy().T)
+        _writeIpc(pa.table({'values': values.ravel()}), os.path.join(tmp, 'values.arrow'))
+        _writeIpc(_labelsTable(df.index), os.path.join(tmp, 'index.arrow'))
+        _writeIpc(_labelsTable(df.columns), os.path.join(tmp, 'columns.arrow'))
+    else:
+        table = pa.Table.from_pandas(df)
+        # NaN are converted to nulls, which would be copied back
+        # to NaN when reading: store them as NaN instead
+        for i, field in enumerate(table.schema):
+            column = table.column(i)
+            if pa.types.is_floating(field.type) and column.null_count:
+                table = table.set_column(i, field, pc.fill_null(column, float('nan')))
+        _writeIpc(table, os.path.join(tmp, 'table.arrow'))
+    os.replace(tmp, path)
+
+
+def readShared(path):
+    """
+    Returns the DataFrame written by writeShared in *path*,
+    memory-mapped (without copying the data where possible).
+    """
+    table_path = os.path.join(path, 'table.arrow')
+    if os.path.exists(table_path):
+        return _readIpc(table_path).to_pandas(split_blocks=True)
+
+    index = _labels(_readIpc(os.path.join(path, 'index.arrow')))
+    columns = _labels(_readIpc(os.path.join(path, 'columns.arrow')))
+    values = _readIpc(os.path.join(path, 'values.arrow')).column('values')
+    # an empty block (written before empty frames were stored as
+    # tables) has no chunks
+    if values.num_chunks == 0:
+        values = np.empty(len(columns) * len(index))
+    else:
+        values = values.chunk(0).to_numpy(zero_copy_only=True)
+    values = values.reshape(len(columns), len(index))
+    return pd.DataFrame(values.T, index=index, columns=columns, copy=False)
+
+
+def sharedDataset(name, version, load):
+    """
+    Returns the dataset *name* at *version* from SHARED_DIR.
+    If it is not there yet, it is loaded with *load* (a function
+    with no arguments) by one worker only, while the others wait.
+    """
+    import fcntl
+
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    path = os.path.join(SHARED_DIR, '{}-{}'.format(name, version))
+    if not os.path.isdir(path):
+        with open(os.path.join(SHARED_DIR, name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(path):
+                writeShared(load(), path)
+                removeOldVersions(name, version)
+    return readShared(path)
+
+
+def removeOldVersions(name, version):
+    """
+    Removes the entries of *name* with a version other than *version*.
+    """
+    current = '{}-{}'.format(name, version)
+    for entry in os.listdir(SHARED_DIR):
+        if entry.startswith(name + '-') and entry != current and entry[len(name) + 1:][:1].isdigit():
+            shutil.rmtree(os.path.join(SHARED_DIR, entry), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    # importing the data modules registers all the datasets
+    from data import baptistery_data, square_data, tower_data
+    from data.registry import DATASETS, datasetExists, getDataset, loadReport
+
+    if not SHARED_DIR:
+        raise SystemExit('Set MOMIR_SHARED_DATA to the directory of the shared datasets.')
+    for name in DATASETS:
+        if datasetExists(name):
+            getDataset(name)
+    print(loadReport())
@@ -1,36 +1,192 @@
+# package imports
+import collections
+import functools
+import threading
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# local imports
+from data.registry import (
+    registerDataset, datasetGetattr, DATASETS,
+    isLoaded, getDataset, datasetVersion, onRefresh, watchFile
+)
+from data.arrow_cache import cachedFrame
+
+# Datasets are only registered here: they are read from disk
+# the first time they are used (see data.registry).
 
 #======================
 #    LEVELLING DATA
 #======================
-S_LEVELLING_INFO = pd.read_parquet('data/square/parquet_data/levelling_info')
-S_LEVELLING_DATA = pd.read_parquet('data/square/parquet_data/levelling_data')
+registerDataset('S_LEVELLING_INFO', 'data/square/parquet_data/levelling_info', 'square')
+registerDataset('S_LEVELLING_DATA', 'data/square/parquet_data/levelling_data', 'square')
 
 
 #======================
 #    SATELLITE DATA
 #======================
-ERS_LOS_INFO = pd.read_parquet('data/square/parquet_data/sat_los/ers_info')
-ERS_ASC = pd.read_parquet('data/square/parquet_data/sat_los/ers_asc')
-ERS_DES = pd.read_parquet('data/square/parquet_data/sat_los/ers_des')
-ERS_VER_INFO = pd.read_parquet('data/square/parquet_data/sat_ver/ers_ver_info')
-ERS_VER = pd.read_parquet('data/square/parquet_data/sat_ver/ers_ver')
-
-ENV_LOS_INFO = pd.read_parquet('data/square/parquet_data/sat_los/env_info')
-ENV_ASC = pd.read_parquet('data/square/parquet_data/sat_los/env_asc')
-ENV_DES = pd.read_parquet('data/square/parquet_data/sat_los/env_des')
-ENV_VER_INFO = pd.read_parquet('data/square/parquet_data/sat_ver/env_ver_info')
-ENV_VER = pd.read_parquet('data/square/parquet_data/sat_ver/env_ver')
-
-SEN_LOS_INFO = pd.read_parquet('data/square/parquet_data/sat_los/sen_info')
-SEN_ASC = pd.read_parquet('data/square/parquet_data/sat_los/sen_asc')
-SEN_DES = pd.read_parquet('data/square/parquet_data/sat_los/sen_des')
-SEN_VER_INFO = pd.read_parquet('data/square/parquet_data/sat_ver/sen_ver_info')
-SEN_VER = pd.read_parquet('data/square/parquet_data/sat_ver/sen_ver')
-
-CSK_LOS_INFO = pd.read_parquet('data/square/parquet_data/sat_los/csk_info')
-CSK_ASC = pd.read_parquet('data/square/parquet_data/sat_los/csk_asc')
-CSK_DES = pd.read_parquet('data/square/parquet_data/sat_los/csk_des')
-CSK_VER_INFO = pd.read_parquet('data/square/parquet_data/sat_ver/csk_ver_info')
-CSK_VER = pd.read_parquet('data/square/parquet_data/sat_ver/csk_ver')
+def readPsStack(path):
+    """
+    Reads the measurements of a satellite dataset, saved with
+    one row per scatterer (ID and one column per date),
+    and returns them with one row per date and one column per scatterer.
+    """
+    return psFrame(pd.read_parquet(path))
+
+
+def psFrame(df):
+    """
+    Returns the measurements *df*, as saved (one row per scatterer),
+    with one row per date and one column per scatterer.
+    """
+    df = df.set_index('ID').transpose()
+    df.index = pd.to_datetime(df.index)
+    df.columns.name = None
+    return df
+
+# measurements resampled by the ETL (with the mean), e.g. SEN_ASC_M
+# for SEN_ASC: see psStackName
+RESAMPLINGS = ['M', '6M', 'Y']
+
+for sat in ['ers', 'env', 'sen', 'csk']:
+    SAT = sat.upper()
+    registerDataset(SAT+'_LOS_INFO', 'data/square/parquet_data/sat_los/'+sat+'_info', 'square')
+    registerDataset(SAT+'_ASC', 'data/square/parquet_data/sat_los/'+sat+'_asc', 'square', readPsStack)
+    registerDataset(SAT+'_DES', 'data/square/parquet_data/sat_los/'+sat+'_des', 'square', readPsStack)
+    registerDataset(SAT+'_VER_INFO', 'data/square/parquet_data/sat_ver/'+sat+'_ver_info', 'square')
+    registerDataset(SAT+'_VER', 'data/square/parquet_data/sat_ver/'+sat+'_ver', 'square', readPsStack)
+    for resample in RESAMPLINGS:
+        registerDataset(SAT+'_ASC_'+resample, 'data/square/parquet_data/sat_los/'+sat+'_asc_'+resample, 'square', readPsStack)
+        registerDataset(SAT+'_DES_'+resample, 'data/square/parquet_data/sat_los/'+sat+'_des_'+resample, 'square', readPsStack)
+        registerDataset(SAT+'_VER_'+resample, 'data/square/parquet_data/sat_ver/'+sat+'_ver_'+resample, 'square', readPsStack)
+
+
+# stacks of the satellite points, by prefix of the point names
+PS_STACKS = {
+    'ers-a': 'ERS_ASC', 'ers-d': 'ERS_DES', 'ers-v': 'ERS_VER',
+    'env-a': 'ENV_ASC', 'env-d': 'ENV_DES', 'env-v': 'ENV_VER',
+    'sen-a': 'SEN_ASC', 'sen-d': 'SEN_DES', 'sen-v': 'SEN_VER',
+    'csk-a': 'CSK_ASC', 'csk-d': 'CSK_DES', 'csk-v': 'CSK_VER',
+}
+
+
+def psStackName(name, resample=None):
+    """
+    Returns the name of the dataset with the measurements
+    of *name* (e.g. 'SEN_ASC') resampled at *resample*.
+    """
+    if resample is None:
+        return name
+    return name + '_' + resample
+
+__getattr__ = datasetGetattr(__name__, 'square')
+
+
+#=========================
+#    SCATTERER COLUMNS
+#=========================
+# The satellite stacks are wide (one column per scatterer), while
+# plots only need a few scatterers: psColumns returns the columns of
+# the selected ones without loading the whole stack, from
+# - the stack itself, if it is already loaded;
+# - the Arrow cache (see data.arrow_cache), memory-mapped: only the
+#   pages of the selected scatterers are read;
+# - the Parquet file otherwise, reading only the row groups that
+#   contain the selected scatterers.
+# The last columns read are kept in a small LRU cache.
+# Stacks read this way are not loaded, so their files are watched
+# (see data.registry.watchFile): when one changes, the caches built
+# on them are cleared as for the loaded datasets.
+
+# number of columns (scatterers) kept in the cache
+HOT_COLUMNS = 1024
+
+_HOT = collections.OrderedDict()   # (name, version, ID) -> Series
+_HOT_LOCK = threading.Lock()
+_WATCHED_STACKS = set()
+
+
+@functools.lru_cache(maxsize=64)
+def _mappedStack(path, version):
+    # mapped once per version of the file: building the
+    # index of the scatterers is the only cost
+    return cachedFrame(path)
+
+
+@functools.lru_cache(maxsize=64)
+def _rowGroups(path, version):
+    """
+    Returns the dates of the stack in *path* and a Series
+    ID -> row group, read from the ID column only.
+    """
+    f = pq.ParquetFile(path)
+    dates = pd.to_datetime([n for n in f.schema_arrow.names if n != 'ID'])
+    groups = [
+        pd.Series(i, index=f.read_row_group(i, columns=['ID']).column('ID').to_pandas())
+        for i in range(f.num_row_groups)
+    ]
+    return dates, pd.concat(groups) if groups else pd.Series(dtype='int64')
+
+
+def _clearColumnCaches():
+    with _HOT_LOCK:
+        _HOT.clear()
+    _mappedStack.cache_clear()
+    _rowGroups.cache_clear()
+
+onRefresh(_clearColumnCaches)
+
+
+def _readColumns(name, version, ids):
+    """
+    Reads the columns *ids* of the stack *name* from disk.
+    """
+    path = DATASETS[name]['path']
+    mapped = _mappedStack(path, version)
+    if mapped is not None:
+        return mapped[mapped.columns.intersection(ids, sort=False)]
+
+    dates, groups = _rowGroups(path, version)
+    groups = groups[groups.index.isin(ids)]
+    if groups.empty:
+        return pd.DataFrame(index=dates, columns=pd.Index([], dtype=object), dtype='float64')
+    table = pq.ParquetFile(path).read_row_groups(sorted(set(groups)))
+    table = table.filter(pc.is_in(table.column('ID'), value_set=pa.array(groups.index)))
+    return psFrame(table.to_pandas())
+
+
+def psColumns(name, ids, cache=True):
+    """
+    Returns the measurements of the scatterers *ids* (those that
+    exist) in the stack *name* (e.g. 'SEN_ASC', 'SEN_ASC_M'), with
+    one row per date (all the dates, even without any *ids*).
+    With *cache* = False the columns read are not kept
+    (e.g. for exports, which read each column once).
+    """
+    if isLoaded(name):
+        df = getDataset(name)
+        return df[df.columns.intersection(ids, sort=False)]
 
+    path = DATASETS[name]['path']
+    if path not in _WATCHED_STACKS:
+        watchFile(path)
+        _WATCHED_STACKS.add(path)
+    version = datasetVersion(name)
+    with _HOT_LOCK:
+        hot = {i: _HOT[(name, version, i)] for i in ids if (name, version, i) in _HOT}
+        for i in hot:
+            _HOT.move_to_end((name, version, i))
+    missing = [i for i in ids if i not in hot]
+    # dates are also read when all the columns are cached,
+    # so that the index is the one of the stack
+    df = _readColumns(name, version, missing)
+    if cache:
+        with _HOT_LOCK:
+            for i in df.columns:
+                _HOT[(name, version, i)] = df[i]
+            while len(_HOT) > HOT_COLUMNS:
+                _HOT.popitem(last=False)
+    hot.update({i: df[i] for i in df.columns})
+    return pd.DataFrame({i: hot[i] for i in ids if i in hot}, index=df.index)
@@ -0,0 +1,91 @@
+# package imports
+import os
+import pandas as pd
+
+# local imports
+from data.tower.static_sensor_list import t_sensor_family
+from data.arrow_cache import cachedFrame
+from data.registry import watchFile
+
+#============================
+#    TOWER STATIC ARCHIVE
+#============================
+# Static monitoring data is stored in long format (datetime, TAG, UI),
+# in one file per resampling, sensor family and year:
+#     data/tower/parquet_data/static/<resampling>/<family>/<year>
+# (see data_treatment/tower/tower_static_treatment.py).
+# To answer a request only the files of the families of the requested
+# sensors and of the requested years are opened, and the sensor and
+# date filters are pushed down to the row groups of each file
+# (or applied to the memory-mapped file, if it is in the Arrow cache).
+
+STATIC_DIR = 'data/tower/parquet_data/static'
+RESAMPLINGS = ['hourly', 'daily', 'weekly', 'monthly']
+
+# the manifest is rewritten each time new records are added
+watchFile(os.path.join(STATIC_DIR, 'manifest.json'))
+
+
+def staticPartitions(resample, families, start_year, end_year):
+    """
+    Returns the paths of the existing files for *resample*
+    and *families* between *start_year* and *end_year* (both included).
+    """
+    if resample not in RESAMPLINGS:
+        raise ValueError("Invalid resample type. Choose from 'daily', 'hourly', 'weekly', 'monthly'.")
+
+    paths = []
+    for family in families:
+        for year in range(start_year, end_year + 1):
+            path = os.path.join(STATIC_DIR, resample, family, str(year))
+            if os.path.exists(path):
+                paths.append(path)
+    return paths
+
+
+def readStaticArchive(resample, sensor_names, start_date, end_date):
+    """
+    Reads static monitoring data.
+    Expects:
+    - resample: one of 'hourly', 'daily', 'weekly', 'monthly'
+    - sensor_names: list of sensor names (TAGs)
+    - start_date, end_date: dates (strings like '2023-02-03'), both included
+    Returns:
+    - a DataFrame indexed by datetime, with one column per sensor found
+    """
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+    # the whole end day is included, as in .loc[start:end]
+    end_excluded = end.normalize() + pd.Timedelta(days=1)
+    sensors = list(dict.fromkeys(sensor_names))
+    families = list(dict.fromkeys(t_sensor_family.get(s, 'other') for s in sensors))
+
+    dfs = []
+    for path in staticPartitions(resample, families, start.year, end.year):
+        cached = cachedFrame(path)
+        if cached is not None:
+            selected = (
+                cached['TAG'].isin(sensors)
+                & (cached['datetime'] >= start)
+                & (cached['datetime'] < end_excluded)
+            )
+            dfs.append(cached.loc[selected.to_numpy(), ['datetime', 'TAG', 'UI']])
+            continue
+        dfs.append(pd.read_parquet(
+            path,
+            columns=['datetime', 'TAG', 'UI'],
+            filters=[
+                ('TAG', 'in', sensors),
+                ('datetime', '>=', start),
+                ('datetime', '<', end_excluded)
+            ]
+        ))
+
+    if not dfs:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='datetime'))
+
+    df = pd.concat(dfs, ignore_index=True)
+    df['TAG'] = df['TAG'].astype(str)
+    df = df.pivot(index='datetime', columns='TAG', values='UI')
+    df.columns.name = None
+    return df[[s for s in sensors if s in df.columns]]
@@ -23,4 +23,7 @@ levellometers_temp=['°C'],
 extensometers=['mm'],
 weather_station=['m/s','°','°C','W/m^2','hPA','m/s','m/s','m/s','°','°','-'],
 piezometers=['m asl'],
-piezometers_temp=['°C'])
\ No newline at end of file
+piezometers_temp=['°C'])
+
+# family of each sensor, e.g. t_sensor_family['GB-NS'] == 'GB_pendulum'
+t_sensor_family = {s: family for family, sensors in t_sensor_dict.items() for s in sensors}
@@ -1,35 +1,29 @@
-import pandas as pd
-import glob
+# local imports
+from data.registry import registerDataset, datasetGetattr
+
+# Datasets are only registered here: they are read from disk
+# the first time they are used (see data.registry).
 
 #=================================
 #    LEVELLING BY CAPRARO DATA
 #=================================
-T_CAPRARO_DATA = pd.read_parquet('data/tower/parquet_data/capraro/tower_levelling')
-T_CAPRARO_BENCHMARKS = pd.read_parquet('data/tower/parquet_data/capraro/tower_benchmark_positions')
+registerDataset('T_CAPRARO_DATA', 'data/tower/parquet_data/capraro/tower_levelling', 'tower')
+registerDataset('T_CAPRARO_BENCHMARKS', 'data/tower/parquet_data/capraro/tower_benchmark_positions', 'tower')
 
 #=====================================
 #    STABILIZATION BENCHMARKS DATA
 #=====================================
-T_STABIL_COORDS = pd.read_parquet('data/tower/parquet_data/stabil_bench_coords')
-T_STABIL_DISP = pd.read_parquet('data/tower/parquet_data/stabil_bench_disp')
+registerDataset('T_STABIL_COORDS', 'data/tower/parquet_data/stabil_bench_coords', 'tower')
+registerDataset('T_STABIL_DISP', 'data/tower/parquet_data/stabil_bench_disp', 'tower')
 
 
 #=====================================
 #    STATIC DATA
 #====================================
-file_pattern ='data/tower/parquet_data/static/*'
+# Static monitoring data is not registered here: it is read by
+# data.tower.static_archive, only for the sensors and dates requested.
+# Only the intervals in which each sensor has data (sensor, start, end),
+# computed by data_treatment/tower/tower_static_treatment.py, are.
+registerDataset('T_STATIC_INTERVALS', 'data/tower/parquet_data/static/intervals', 'tower')
 
-# List all Parquet files in the directory using glob
-for filepath in glob.glob(file_pattern):
-    # Extract filename from the full path
-    filename = filepath.split('\\')[-1]
-    
-    # Generate the name for the DataFrame
-    if not filename.endswith('.txt'):
-        df_name = filename.replace('.parquet', '').upper()
-    
-    # Create the DataFrame by reading the Parquet file
-        dataframe = pd.read_parquet(filepath)
-    
-    # Assign the DataFrame to a variable name in the global namespace
-        globals()[df_name] = dataframe
\ No newline at end of file
+__getattr__ = datasetGetattr(__name__, 'tower')
@@ -1,12 +1,19 @@
 # package imports
 import dash
-from dash import html, dcc, callback, Input, Output
+from dash import html, dcc, callback, Input, Output, State, MATCH
 import dash_bootstrap_components as dbc
 
 # local imports
 from utils.utils import id_factory
+from utils.figure_cache import cachedFigure
+from utils.export import exportControls, exportUrl
 id = id_factory('baptistery')
 from .functions import *
+from data import baptistery_data as b_data
+
+# type of the pattern-matching ids of the crack plots,
+# used to re-fetch the data of a plot when it is zoomed
+CRACK_GRAPH_TYPE = id('crack_graph')
 
 # page registration
 dash.register_page(
@@ -97,8 +104,9 @@ b_tab_checks = dbc.Tab([
         dcc.Markdown('## Levelling data *vs* vertical component of prisms'),
         dcc.Markdown("""
         Each levelling rod has been paired with the closest prism. Prisms, however, have an average elevation of 7 m, while levelling rods are placed at about 1.6 m above the pavement.
-        """)
-    ] + b_divchildren_levelling_checks)
+        """),
+        html.Div(id=id('div_levelling_checks'))
+    ])
 ], label='CHECKS')
 
 
@@ -120,8 +128,8 @@ b_tab_plan = dbc.Tab([
             dbc.Col([
                 dcc.Markdown("**Date range**"),
                 dcc.RangeSlider(id=id('slider_prism_plan_daterange'),
-                               min=0, max=(x:=len(B_PRISMS)-1), step=1,
-                               value=[0, x],
+                               min=0, max=1, step=1,
+                               value=[0, 1],
                                marks=None,
                                allowCross=False,
                                pushable=True,
@@ -185,8 +193,8 @@ b_tab_section = dbc.Tab([
                 html.Br(),
                 dcc.Markdown("**Date range**"),
                 dcc.RangeSlider(id=id('slider_prism_section_daterange'),
-                               min=0, max=(x:=len(B_PRISMS)-1), step=1,
-                               value=[0, x],
+                               min=0, max=1, step=1,
+                               value=[0, 1],
                                marks=None,
                                allowCross=False,
                                pushable=True,
@@ -252,8 +260,7 @@ b_tab_prisms = dbc.Tab([
         """),
         dbc.Row([
             dbc.Col([
-                dcc.Graph(id=id('fig_prism_displacement_selection'),
-                  figure=b_fig_prism_selection),
+                dcc.Graph(id=id('fig_prism_displacement_selection')),
             ]),
             dbc.Col([
                 dbc.Checklist(
@@ -270,6 +277,7 @@ b_tab_prisms = dbc.Tab([
     html.Br(),
     html.Br(),
     html.Div(id=id('div_prism_displacement_plots')),
+    exportControls(id('link_prism_export'), id('radioitems_prism_export')),
 ], label='PRISMS')
 
 
@@ -305,7 +313,8 @@ b_tab_cracks = dbc.Tab([
         ], align='center')
     ]),
     html.Br(),
-    html.Div(id=id('div_crack_plots'))
+    html.Div(id=id('div_crack_plots')),
+    exportControls(id('link_crack_export'), id('radioitems_crack_export')),
 ], label='CRACKS')
 
 # 3D Tab
@@ -326,8 +335,8 @@ b_tab_3D = dbc.Tab([
             dbc.Col([
                 dcc.Markdown("**Date range**"),
                 dcc.RangeSlider(id=id('slider_prism_3d_daterange'),
-                               min=0, max=(x:=len(B_PRISMS)-1), step=1,
-                               value=[0, x],
+                               min=0, max=1, step=1,
+                               value=[0, 1],
                                marks=None,
                                allowCross=False,
                                pushable=True,
@@ -400,7 +409,38 @@ layout = dbc.Row([
     Input(id('checklist_gantt'), 'value')
 )
 def callFigureGantt(which):
-    return figureGantt(which)
+    return figureGantt(which, ganttIntervals())
+
+
+#---------------------
+#    PAGE LOADING
+#---------------------
+# Data is loaded on the first visit to the page (see data.registry),
+# so the components which depend on it are filled in here
+# instead of in the layout.
+#---Date range sliders
+@callback(Output(id('slider_prism_plan_daterange'), 'max'),
+             Output(id('slider_prism_plan_daterange'), 'value'),
+             Output(id('slider_prism_section_daterange'), 'max'),
+             Output(id('slider_prism_section_daterange'), 'value'),
+             Output(id('slider_prism_3d_daterange'), 'max'),
+             Output(id('slider_prism_3d_daterange'), 'value'),
+             Input(id('slider_prism_plan_daterange'), 'id'))
+def callSliderPrismDaterange(_):
+    x = len(b_data.B_PRISMS)-1
+    return x, [0, x], x, [0, x], x, [0, x]
+
+#---Levelling checks
+@callback(Output(id('div_levelling_checks'), 'children'),
+             Input(id('div_levelling_checks'), 'id'))
+def callDivLevellingChecks(_):
+    return levellingChecksChildren()
+
+#---Prism selection figure
+@callback(Output(id('fig_prism_displacement_selection'), 'figure'),
+             Input(id('fig_prism_displacement_selection'), 'id'))
+def callFigurePrismSelection(_):
+    return prismSelectionFigure()
 
 
 
@@ -411,8 +451,8 @@ def callFigureGantt(which):
 @callback(Output(id('text_prism_plan_daterange'), 'children'),
              Input(id('slider_prism_plan_daterange'), 'value'))
 def callTextPrismPlanDaterange(daterange):
-    start = str(B_PRISMS.index[daterange[0]])
-    end = str(B_PRISMS.index[daterange[1]])
+    start = str(b_data.B_PRISMS.index[daterange[0]])
+    end = str(b_data.B_PRISMS.index[daterange[1]])
     text = "From  " + start[:10] + "  to  " + end[:10]
     return text
 
@@ -430,9 +470,10 @@ def callTextPrismPlanScalefactor(exp, factor):
              Input(id('slider_prism_plan_scalefactor_log'), 'value'),
              Input(id('slider_prism_plan_scalefactor_dec'), 'value'),
              Input(id('checklist_prism_plan_floor'), 'value'))
+@cachedFigure('B_PRISM_COMPONENTS', 'B_PRISM_POS')
 def callFigurePrismPlan(daterange, scale_log, scale_dec, floor):
     scalefactor = scaleFactorCalc(scale_log, scale_dec)
-    return figurePrismPlan(daterange, scalefactor, floor, B_PRISMS, B_PRISM_POS)
+    return figurePrismPlan(daterange, scalefactor, floor, b_data.B_PRISM_COMPONENTS, b_data.B_PRISM_POS)
 
 
 #---------------------
@@ -442,8 +483,8 @@ def callFigurePrismPlan(daterange, scale_log, scale_dec, floor):
 @callback(Output(id('text_prism_section_daterange'), 'children'),
              Input(id('slider_prism_section_daterange'), 'value'))
 def callTextPrismSectionDaterange(daterange):
-    start = str(B_PRISMS.index[daterange[0]])
-    end = str(B_PRISMS.index[daterange[1]])
+    start = str(b_data.B_PRISMS.index[daterange[0]])
+    end = str(b_data.B_PRISMS.index[daterange[1]])
     text = "From  " + start[:10] + "  to  " + end[:10]
     return text
 
@@ -463,7 +504,7 @@ def callFigurePrismSectionSelection(selection):
     if len(p) == 1:
         p = '0' + p
     selected_prisms = selectPrismSection(p)
-    return figureSectionSelection(selected_prisms, B_PRISM_POS)
+    return figureSectionSelection(selected_prisms, b_data.B_PRISM_POS)
 
 #---Update prism section plot
 @callback(Output(id('fig_prism_section'), 'figure'),
@@ -472,6 +513,7 @@ def callFigurePrismSectionSelection(selection):
              Input(id('slider_prism_section_scalefactor_log'), 'value'),
              Input(id('slider_prism_section_scalefactor_dec'), 'value'),
              Input(id('checklist_prism_section_fixedbase'), 'value'))
+@cachedFigure('B_PRISMS')
 def callFigurePrismSection(selection, daterange, scale_log, scale_dec, fixedbase):
     s = scaleFactorCalc(scale_log, scale_dec)
     if len(fixedbase) == 1:
@@ -482,7 +524,7 @@ def callFigurePrismSection(selection, daterange, scale_log, scale_dec, fixedbase
     if len(p) == 1:
         p = '0' + p
     selected_prisms = selectPrismSection(p)
-    return figurePrismSection(selected_prisms, daterange, s, f, B_PRISMS)
+    return figurePrismSection(selected_prisms, daterange, s, f, sectionGeometry())
 
 #---Plot relative displacements
 @callback(Output(id('div_relative_displacement_plots'), 'children'),
@@ -502,8 +544,8 @@ def callFigureRelativeDisplacements(selection):
     children = []
     for c in couples:
         row = dbc.Row([
-            dbc.Col([dcc.Graph(figure=figureSectionRelativeDisplacements(c, B_PRISMS, B_EXTENSIMETERS))], width=9),
-            dbc.Col([dcc.Graph(figure=figurePrismCoupleSelection(c, B_PRISM_POS))], width=3)
+            dbc.Col([dcc.Graph(figure=figureSectionRelativeDisplacements(c, b_data.B_PRISMS, b_data.B_EXTENSIMETERS))], width=9),
+            dbc.Col([dcc.Graph(figure=figurePrismCoupleSelection(c, b_data.B_PRISM_POS))], width=3)
         ], align='center')
         children.append(row)
 
@@ -521,18 +563,29 @@ def callDivPrismDisplacement(selectedData, together_switch):
     try:
         if sum(together_switch) == 1:
             prisms = [el['customdata'] for el in selectedData['points']]
-            children = [dcc.Graph(figure=figurePrismDisplacementTogether(prisms, c, B_PRISMS, B_EXTENSIMETERS)) for c in ['Total', 'Radial', 'Vertical', 'Tangential']]
+            children = [dcc.Graph(figure=figurePrismDisplacementTogether(prisms, c, b_data.B_PRISM_COMPONENTS, b_data.B_EXTENSIMETERS)) for c in ['Total', 'Radial', 'Vertical', 'Tangential']]
         else:
             prisms = [el['customdata'] for el in selectedData['points']]
             children = [dcc.Markdown('''
                 In each plot, you can select which traces to exclude or include by clicking on their legend entries. You can isolate a trace by double-clicking it.
             ''')]
-            children += [dcc.Graph(figure=figurePrismDisplacement(p, B_PRISMS, B_EXTENSIMETERS)) for p in prisms]
+            children += [dcc.Graph(figure=figurePrismDisplacement(p, b_data.B_PRISM_COMPONENTS, b_data.B_EXTENSIMETERS)) for p in prisms]
     except:
         children = dcc.Markdown('Select at least one prism.')
     return children
 
 
+#---Link to download the data of the selected prisms
+@callback(Output(id('link_prism_export'), 'href'),
+             Input(id('fig_prism_displacement_selection'), 'selectedData'),
+             Input(id('radioitems_prism_export'), 'value'))
+def callLinkPrismExport(selectedData, export_format):
+    if not selectedData:
+        return None
+    prisms = [el['customdata'] for el in selectedData['points']]
+    return exportUrl({'prisms': prisms}, export_format=export_format)
+
+
 #---------------------
 #    CRACKS tab
 #---------------------
@@ -546,10 +599,11 @@ def callDivCrackPlots(res_val):
     for i,e in enumerate(['F3CE', 'F3CF', 'F3D1', 'F3D2', 'F46C', 'F46D', 'F3D0', 'F46B']):
         row = dbc.Row([
             dbc.Col([
-                    dcc.Graph(figure=figureExtensimeter(e, B_EXTENSIMETERS, resampling=freq))
+                    dcc.Graph(id={'type': CRACK_GRAPH_TYPE, 'index': e},
+                              figure=figureExtensimeter(e, b_data.B_EXTENSIMETERS, resampling=freq))
                         ], width={"size": 9}),
             dbc.Col([
-                dcc.Graph(figure=b_extensimeter_positions[i], config=dict(
+                dcc.Graph(figure=extensimeterPositionFigures()[i], config=dict(
                          displayModeBar=False,
                      ))
             ], width={"size": 3})
@@ -557,6 +611,28 @@ def callDivCrackPlots(res_val):
         children.append(row)
     return children
 
+#---Link to download the data of the cracks
+@callback(Output(id('link_crack_export'), 'href'),
+             Input(id('radioitems_crack_export'), 'value'))
+def callLinkCrackExport(export_format):
+    cracks = list(b_data.B_EXTENSIMETERS.columns.get_level_values(0).unique())
+    return exportUrl({'cracks': cracks}, export_format=export_format)
+
+#---Re-fetch the data of a plot when it is zoomed
+@callback(Output({'type': CRACK_GRAPH_TYPE, 'index': MATCH}, 'figure'),
+             Input({'type': CRACK_GRAPH_TYPE, 'index': MATCH}, 'relayoutData'),
+             State({'type': CRACK_GRAPH_TYPE, 'index': MATCH}, 'id'),
+             State(id('slider_crack_plots_resampling'), 'value'),
+             prevent_initial_call=True)
+def callFigureCrackZoom(relayout_data, graph_id, res_val):
+    x_range = relayoutRange(relayout_data)
+    if x_range is None:
+        return dash.no_update
+    if x_range == 'reset':
+        x_range = None
+    freq = ['H', 'D', 'W', 'M'][res_val]
+    return figureExtensimeter(graph_id['index'], b_data.B_EXTENSIMETERS, resampling=freq, x_range=x_range)
+
 #------------
 # 3D tab
 #------------
@@ -564,8 +640,8 @@ def callDivCrackPlots(res_val):
 @callback(Output(id('text_prism_3d_daterange'), 'children'),
              Input(id('slider_prism_3d_daterange'), 'value'))
 def callTextPrism3dDaterange(daterange):
-    start = str(B_PRISMS.index[daterange[0]])
-    end = str(B_PRISMS.index[daterange[1]])
+    start = str(b_data.B_PRISMS.index[daterange[0]])
+    end = str(b_data.B_PRISMS.index[daterange[1]])
     text = "From  " + start[:10] + "  to  " + end[:10] 
     return text
 
@@ -583,9 +659,10 @@ def callTextPrism3dScalefactor(exp, factor):
              Input(id('slider_prism_3d_scalefactor_log'), 'value'),
              Input(id('slider_prism_3d_scalefactor_dec'), 'value'),
              Input(id('checklist_prism_3d_floor'), 'value'))
+@cachedFigure('B_PRISMS', 'CONNMAT')
 def callFigurePrism3d(daterange, scale_log, scale_dec, zero_floor):
     scalefactor = scaleFactorCalc(scale_log, scale_dec)
-    return figurePrism3d(B_PRISMS,daterange, scalefactor, zero_floor,CONNMAT)
+    return figurePrism3d(b_data.B_PRISMS,daterange, scalefactor, zero_floor,b_data.CONNMAT)
     
     
     
@@ -7,10 +7,13 @@ from dash import html, dcc
 
 
 # local imports
-from data.baptistery_data import B_PRISMS, B_LEVELLING, B_EXTENSIMETERS, CONNMAT
-from data.baptistery_data import B_PRISM_POS, B_LEVELLING_POS, B_EXTENSIMETER_POS, B_POSITIONS
+from data import baptistery_data as b_data
+from data.registry import refreshCache
+from data.baptistery.prism_reference import PRISM_CENTRE_X, PRISM_CENTRE_Y
 from utils.styles import *
 from utils.utils import *
+from utils.downsampling import downsample, relayoutRange
+from utils.gantt import coverageIntervals, ganttTrace
 
 #======================
 #    MISC FUNCTIONS
@@ -19,21 +22,6 @@ def scaleFactorCalc(exp, factor):
     return factor*10**exp
 
 
-def xyToEN(x, y):
-    """
-    Converts (x, y) coordinates of prisms to (E, N) ones.
-    It takes either single or array-like coordinates.
-    """
-    ref_x, ref_y = 15.184322095298622, -0.01676310147012092
-    rot = np.deg2rad(37.1)
-    e = x - ref_x
-    n = y - ref_y
-    eR = e*np.cos(rot) - n*np.sin(rot)
-    nR = e*np.sin(rot) + n*np.cos(rot)
-
-    return eR, nR
-
-
 def interpolateRGB(start, end, n):
     """
     Returns *n* RGB color tuples interpolating
@@ -69,25 +57,28 @@ def selectPrismSection(n):
     }
     n = full_section[n]
 
-    selected_sensors = [p for p in B_PRISM_POS.index if p.endswith(n[0]) and not (p.startswith('1'))]
-    selected_sensors += [p for p in B_PRISM_POS.index if p.endswith(n[1]) and not (p.startswith('1'))]
+    prism_pos = b_data.B_PRISM_POS
+    selected_sensors = [p for p in prism_pos.index if p.endswith(n[0]) and not (p.startswith('1'))]
+    selected_sensors += [p for p in prism_pos.index if p.endswith(n[1]) and not (p.startswith('1'))]
 
     return selected_sensors
 
 
-def rotTraslPrism(df, date):
+def rotTraslPrism(prism_data):
     """
-    Returns east and z coordinates of prisms
-    in the DataFrame *df* for the date *date*.
+    Returns east and z coordinates of all the prisms in
+    *prism_data*, each one in the vertical plane of its section,
+    for all the dates at once.
+    Returns:
+    - two DataFrames (dates on rows, prisms on columns)
     """
-    x = df.loc[date, (slice(None), 'x')].values
-    y = df.loc[date, (slice(None), 'y')].values
-    z = df.loc[date, (slice(None), 'z')].values
+    x = prism_data.xs('x', axis=1, level=1)
+    y = prism_data.xs('y', axis=1, level=1)
+    z = prism_data.xs('z', axis=1, level=1)
 
     # Traslation
-    ref_x, ref_y = 15.184322095298622, -0.01676310147012092
-    x1 = x - ref_x
-    y1 = y - ref_y
+    x1 = x.to_numpy(dtype='float64') - PRISM_CENTRE_X
+    y1 = y.to_numpy(dtype='float64') - PRISM_CENTRE_Y
 
     # Rotation
     a = -np.arctan(y1/x1)
@@ -96,9 +87,18 @@ def rotTraslPrism(df, date):
 
     if (north > 10**(-6)).any():
         print("ERROR: north coordinate is not zero")
-        return 1
 
-    return east, z
+    return pd.DataFrame(east, index=x.index, columns=x.columns), z
+
+
+@refreshCache
+def sectionGeometry():
+    """
+    The section coordinates of the prisms only depend on the data:
+    they are computed once, for all the sections and dates, so that
+    moving the section slider only selects them.
+    """
+    return rotTraslPrism(b_data.B_PRISMS)
 
 
 
@@ -109,29 +109,43 @@ def rotTraslPrism(df, date):
 #----------------
 #    INFO TAB
 #----------------
-def figureGantt(which):
+# measurements further apart than this are shown as an interruption
+GANTT_MAX_GAPS = {
+    'Prisms': pd.Timedelta(days=366),
+    'Levelling': pd.Timedelta(days=366),
+    'Cracks': pd.Timedelta(days=2),
+}
+
+@refreshCache
+def ganttIntervals():
+    """
+    Returns the intervals (sensor, start, end) in which
+    each instrumentation has data, computed once.
+    """
+    which_df = {'Prisms': b_data.B_PRISMS,
+               'Levelling': b_data.B_LEVELLING,
+               'Cracks': b_data.B_EXTENSIMETERS}
+    return pd.concat(
+        [coverageIntervals(df.index, w, GANTT_MAX_GAPS[w]) for w, df in which_df.items()],
+        ignore_index=True
+    )
+
+
+def figureGantt(which, intervals):
     """
     Plots a Gantt chart with the temporal availability of data.
     Expects:
     - which = list of instrumentation to plot.
+    - intervals = DataFrame with sensor, start, end (see ganttIntervals)
     Returns:
     - figure object
     """
-    which_df = {'Prisms': B_PRISMS,
-               'Levelling': B_LEVELLING,
-               'Cracks': B_EXTENSIMETERS}
-
     fig = go.Figure(layout_template=None)
 
     for i, w in enumerate(which):
-        df = which_df[w]
-        my_index = df[~df.index.duplicated()].resample('D').ffill().index
         fig.add_trace(
-            go.Scatter(x=my_index, y=[w]*len(my_index),
-                   mode='markers', name=w,
-                      marker_color=colors[i],
-                      marker_size = 10,
-                      marker_symbol='square')
+            ganttTrace(intervals[intervals['sensor'] == w],
+                       name=w, line_color=colors[i])
         )
 
     fig = reformatPlot(fig, [750,400])
@@ -169,7 +183,7 @@ def figureLevellingChecks(levelling_data, prism_data, extensimeter_data):
         fig = reformatPlot(fig, size=[1200, 350], secondary=True)
 
         fig.add_trace(
-            go.Scatter(
+            scatterTrace(
                 x=levelling_data.index,
                 y=l,
                 mode='markers+lines',
@@ -181,7 +195,7 @@ def figureLevellingChecks(levelling_data, prism_data, extensimeter_data):
         )
 
         fig.add_trace(
-            go.Scatter(
+            scatterTrace(
                 x=prism_data.index,
                 y=p[:,0],
                 mode='markers+lines',
@@ -193,7 +207,7 @@ def figureLevellingChecks(levelling_data, prism_data, extensimeter_data):
         )
 
         fig.add_trace(
-            go.Scatter(
+            scatterTrace(
                 x=extensimeter_data.index,
                 y=extensimeter_data['F4F8', 'temp'].rolling(24).mean(),
                 line_dash='dot',
@@ -230,18 +244,24 @@ def figureLevellingChecks(levelling_data, prism_data, extensimeter_data):
 
     return children
 
-b_divchildren_levelling_checks = figureLevellingChecks(B_LEVELLING, B_PRISMS, B_EXTENSIMETERS)
+@refreshCache
+def levellingChecksChildren():
+    """
+    The levelling checks are the same for every visitor:
+    they are built on the first visit to the tab.
+    """
+    return figureLevellingChecks(b_data.B_LEVELLING, b_data.B_PRISMS, b_data.B_EXTENSIMETERS)
 
 
 #----------------
 #    PLAN TAB
 #----------------
-def figurePrismPlan(daterange, scalefactor, floor, prism_data, prism_pos):
+def figurePrismPlan(daterange, scalefactor, floor, prism_components, prism_pos):
     """
     Produces a plot showing the displacement of prisms
     in plan.
     Expects:
-    - daterange: a list of two integers within len(prism_data.index)
+    - daterange: a list of two integers within len(prism_components.index)
     - scalefactor: a number
     - floor: a list of strings, either/or "First" and "Second"
     Returns:
@@ -259,21 +279,15 @@ def figurePrismPlan(daterange, scalefactor, floor, prism_data, prism_pos):
             selected_prisms += [i for i in prism_pos.index if (x:=i[0]) == '4' or x=='5']
     else:
         selected_prisms = [i for i in prism_pos.index if (x:=i[0]) == '4' or x=='5']
-    df = prism_data.loc[:, (selected_prisms, slice(None))]
-
-    # Get prism coordinates
-    start_date = df.index[daterange[0]]
-    end_date = df.index[daterange[1]]
-    x_0 = df.loc[start_date, (slice(None), 'x')].values
-    y_0 = df.loc[start_date, (slice(None), 'y')].values
-    x_1 = df.loc[end_date, (slice(None), 'x')].values
-    y_1 = df.loc[end_date, (slice(None), 'y')].values
-
-    # Rotate prisms so that x is in the East direction
-    # and translate them so that the origin is in the center
-    # of the Baptistery
-    eR_0, nR_0 = xyToEN(x_0, y_0)
-    eR_1, nR_1 = xyToEN(x_1, y_1)
+
+    # Get prism coordinates (x is in the East direction
+    # and the origin is in the center of the Baptistery)
+    start_date = prism_components.index[daterange[0]]
+    end_date = prism_components.index[daterange[1]]
+    e = prism_components.loc[[start_date, end_date], (selected_prisms, 'position', 'E')].to_numpy()
+    n = prism_components.loc[[start_date, end_date], (selected_prisms, 'position', 'N')].to_numpy()
+    eR_0, eR_1 = e
+    nR_0, nR_1 = n
     east_diff = (eR_1 - eR_0) * scalefactor
     north_diff = (nR_1 - nR_0) * scalefactor
     eR_1 = eR_0 + east_diff
@@ -467,12 +481,13 @@ def figureSectionSelection(selected_prisms, prism_pos):
     return fig
 
 
-def figurePrismSection(selected_prisms, daterange, scalefactor, fixedbase, prism_data):
+def figurePrismSection(selected_prisms, daterange, scalefactor, fixedbase, section_geometry):
     """
     Produces a plot showing the displacement of prisms in a given section.
     Expects:
     - selected_prisms: a list of prism names
-    - daterange: a list of two integers within len(prism_data.index)
+    - daterange: a list of two integers within the number of dates
+    - section_geometry: east and z coordinates, as returned by rotTraslPrism
     - scalefactor: a number
     - fixedbase: boolean
     Returns:
@@ -495,15 +510,17 @@ def figurePrismSection(selected_prisms, daterange, scalefactor, fixedbase, prism
         margin=dict(t=40)
     )
 
-    # Prune dataframe
-    df = prism_data.loc[:, (selected_prisms, slice(None))]
+    # Prune dataframes
+    east, vertical = section_geometry
+    columns = east.columns[east.columns.isin(selected_prisms)]
+    east = east[columns]
+    vertical = vertical[columns]
     # Selection dates
-    numdate = daterange[1] - daterange[0] + 1
-    dates = [df.index[daterange[0]], df.index[daterange[1]]]
+    dates = [east.index[daterange[0]], east.index[daterange[1]]]
     # Colors
     colors = ['rgb(255, 198, 196)', 'rgb(103, 32, 68)']
 
-    e0, z0 = rotTraslPrism(df, dates[0])
+    e0, z0 = east.loc[dates[0]].values, vertical.loc[dates[0]].values
     fig.add_trace(
         go.Scatter(
             x=e0, y=z0,
@@ -535,7 +552,7 @@ def figurePrismSection(selected_prisms, daterange, scalefactor, fixedbase, prism
                      ))
 
     for i, d in enumerate(dates[1:]):
-        e, z  = rotTraslPrism(df, d)
+        e, z = east.loc[d].values, vertical.loc[d].values
         diff_e = e-e0
         diff_z = z-z0
         e = e0 + diff_e * scalefactor
@@ -587,7 +604,7 @@ def figureSectionRelativeDisplacements(prisms, prism_data, extensimeter_data):
     rel_disp = dists - dists[0]
 
     fig.add_trace(
-        go.Scatter(
+        scatterTrace(
             x=prism_data.index,
             y=rel_disp,
             mode='markers+lines',
@@ -599,7 +616,7 @@ def figureSectionRelativeDisplacements(prisms, prism_data, extensimeter_data):
     )
 
     fig.add_trace(
-        go.Scatter(
+        scatterTrace(
             x=extensimeter_data.index,
             y=extensimeter_data['F4F8', 'temp'].rolling(24).mean(),
             line_dash='dot',
@@ -821,13 +838,15 @@ def figurePrismSelection(prism_pos):
 
     return fig
 
-b_fig_prism_selection = figurePrismSelection(B_PRISM_POS)
+@refreshCache
+def prismSelectionFigure():
+    return figurePrismSelection(b_data.B_PRISM_POS)
 
 
-def figurePrismDisplacementTogether(p_list, component, prism_data, extensimeter_data):
+def figurePrismDisplacementTogether(p_list, component, prism_components, extensimeter_data):
     """
     Produces a figure with the displacement of the prisms contained in
-    *p_list*. You can choose which component to plot.
+    *p_list*, from their mean position. You can choose which component to plot.
     """
 
     fig = go.Figure(layout_template=None)
@@ -842,41 +861,10 @@ def figurePrismDisplacementTogether(p_list, component, prism_data, extensimeter_
     fig = reformatPlot(fig, size=[1200, 350], secondary=True)
 
     for p in p_list:
-        x = prism_data[p, 'x'].values
-        y = prism_data[p, 'y'].values
-        z = prism_data[p, 'z'].values*1000.
-        e, n = xyToEN(x, y)
-        e = e*1000.
-        n = n*1000.
-
-        de = e - np.array(e).mean()
-        dn = n - np.array(n).mean()
-        dz = z - np.array(z).mean()
-
-
-        dtot = np.sqrt(de**2 + dn**2 + dz**2)
-
-        r = np.sqrt(e**2 + n**2)
-        dr = r - np.array(r).mean()
-
-
-        alpha = np.arctan(n/e)
-        dalpha = alpha - alpha[0]
-        dtan = r*np.sin(dalpha)
-
-        # Dictionary with components and colors [now unused]
-        components_dict = {
-            'Total': [dtot, colors4[0]],
-            'Radial': [dr, colors4[1]],
-            'Tangential': [dtan, colors4[2]],
-            'Vertical': [dz, colors4[3]]
-        }
-
-
         fig.add_trace(
-            go.Scatter(
-                x=prism_data.index,
-                y=components_dict[component][0],
+            scatterTrace(
+                x=prism_components.index,
+                y=prism_components[p, 'mean', component].values,
                 mode='markers+lines',
                 name=p,
             ),
@@ -885,7 +873,7 @@ def figurePrismDisplacementTogether(p_list, component, prism_data, extensimeter_
 
     # Temperature
     fig.add_trace(
-        go.Scatter(
+        scatterTrace(
             x=extensimeter_data.index,
             y=extensimeter_data['F4F8', 'temp'].rolling(24).mean(),
             line_dash='dot',
@@ -916,10 +904,10 @@ def figurePrismDisplacementTogether(p_list, component, prism_data, extensimeter_
     return fig
 
 
-def figurePrismDisplacement(p, prism_data, extensimeter_data):
+def figurePrismDisplacement(p, prism_components, extensimeter_data):
     """
     Produces a figure with the displacement of the *p*
-    prism. Both the total one and single components.
+    prism from the first date. Both the total one and single components.
     """
 
     fig = go.Figure(layout_template=None)
@@ -933,34 +921,13 @@ def figurePrismDisplacement(p, prism_data, extensimeter_data):
                         figure=fig)
     fig = reformatPlot(fig, size=[1200, 350], secondary=True)
 
-    x = prism_data[p, 'x'].values
-    y = prism_data[p, 'y'].values
-    z = prism_data[p, 'z'].values*1000.
-    e, n = xyToEN(x, y)
-    e = e*1000.
-    n = n*1000.
-
-    de = e - e[0]
-    dn = n - n[0]
-    dz = z - z[0]
-
-    dtot = np.sqrt(de**2 + dn**2 + dz**2)
-
-    r = np.sqrt(e**2 + n**2)
-    dr = r - r[0]
-
-    alpha = np.arctan(n/e)
-    dalpha = alpha - alpha[0]
-    dtan = r*np.sin(dalpha)
-
-    traces = [dtot, dr, dtan, dz]
     names = ['Total', 'Radial', 'Tangential', 'Vertical']
 
-    for t,n,c in zip(traces, names, colors4):
+    for n,c in zip(names, colors4):
         fig.add_trace(
-            go.Scatter(
-                x=prism_data.index,
-                y=t,
+            scatterTrace(
+                x=prism_components.index,
+                y=prism_components[p, 'first', n].values,
                 mode='markers+lines',
                 name=n,
                 marker_color = c,
@@ -970,7 +937,7 @@ def figurePrismDisplacement(p, prism_data, extensimeter_data):
         )
 
     fig.add_trace(
-        go.Scatter(
+        scatterTrace(
             x=extensimeter_data.index,
             y=extensimeter_data['F4F8', 'temp'].rolling(24).mean(),
             line_dash='dot',
@@ -1004,19 +971,26 @@ def figurePrismDisplacement(p, prism_data, extensimeter_data):
 #------------------
 #    CRACKS TAB
 #------------------
-def figureExtensimeter(e, extensimeter_data, resampling='W'):
+# size of the crack plots, in pixels; the series are
+# downsampled to CRACK_PLOT_SIZE[0] points
+CRACK_PLOT_SIZE = [950, 350]
+
+def figureExtensimeter(e, extensimeter_data, resampling='W', x_range=None):
     """
-    Plots extensimeter data with the corresponding temperature.
+    Plots extensimeter data with the corresponding temperature,
+    between the dates in *x_range* if given (whole series otherwise).
+    Both series are downsampled to the width of the plot.
     """
-    crack = extensimeter_data.loc[:, (e, 'pos')].resample(resampling).mean()
-    temp = extensimeter_data.loc[:, (e, 'temp')].resample(resampling).mean()
-    index = extensimeter_data.resample(resampling).mean().index
+    if x_range is not None:
+        extensimeter_data = extensimeter_data.loc[x_range[0]:x_range[1]]
+    crack = downsample(extensimeter_data.loc[:, (e, 'pos')].resample(resampling).mean(), width=CRACK_PLOT_SIZE[0])
+    temp = downsample(extensimeter_data.loc[:, (e, 'temp')].resample(resampling).mean(), width=CRACK_PLOT_SIZE[0])
 
     fig = go.Figure(layout_template=None)
     fig.update_layout(margin = dict(t=40, b=40))
     fig = make_subplots(specs=[[{"secondary_y": True}]],
                         figure=fig)
-    fig = reformatPlot(fig, size=[950, 350], secondary=True)
+    fig = reformatPlot(fig, size=CRACK_PLOT_SIZE, secondary=True)
 
     if (resampling == 'W' or resampling == 'M'):
         mode = 'markers+lines'
@@ -1024,9 +998,9 @@ def figureExtensimeter(e, extensimeter_data, resampling='W'):
         mode = 'lines'
 
     fig.add_trace(
-        go.Scatter(
-            x=index,
-            y=crack,
+        scatterTrace(
+            x=crack.index,
+            y=crack.values,
             mode=mode,
             name='Crack width',
             marker_color='#DDCC77',
@@ -1036,9 +1010,9 @@ def figureExtensimeter(e, extensimeter_data, resampling='W'):
     )
 
     fig.add_trace(
-        go.Scatter(
-            x=index,
-            y=temp,
+        scatterTrace(
+            x=temp.index,
+            y=temp.values,
             line_dash='dot',
             line_color='gray',
             name='Temperature'
@@ -1067,8 +1041,12 @@ def figureExtensimeter(e, extensimeter_data, resampling='W'):
     fig.update_layout(
         legend=dict(
             x=0.78, y=0.05
-        )
+        ),
+        # keep zoom and hidden traces when the data is re-fetched
+        uirevision=True
     )
+    if x_range is not None:
+        fig.update_xaxes(range=list(x_range))
 
     return fig
 
@@ -1152,7 +1130,9 @@ def figureExtensimeterSelection(e, extensimeter_pos):
     return fig
 
 
-b_extensimeter_positions = [figureExtensimeterSelection(e, B_EXTENSIMETER_POS) for e in ['F3CE', 'F3CF', 'F3D1', 'F3D2', 'F46C', 'F46D', 'F3D0', 'F46B']]
+@refreshCache
+def extensimeterPositionFigures():
+    return [figureExtensimeterSelection(e, b_data.B_EXTENSIMETER_POS) for e in ['F3CE', 'F3CF', 'F3D1', 'F3D2', 'F46C', 'F46D', 'F3D0', 'F46B']]
 
 #------------------
 #    3D TAB
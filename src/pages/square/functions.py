@@ -6,6 +6,9 @@ from dash import dcc
 
 # local imports
 from utils.styles import *
+from utils.utils import scatterTrace
+from utils.gantt import coverageIntervals, ganttTrace
+from utils.ps_index import queryPsIndex, aggregatePs, viewportCell
 
 
 #==============================
@@ -14,8 +17,16 @@ from utils.styles import *
 #--------------------------
 #    SQUARE HISTORY TAB
 #--------------------------
-def figureGantt(
-    which,
+# acquisitions further apart than this are shown as an interruption
+GANTT_MAX_GAPS = {
+    'Square levelling': pd.Timedelta(days=3*366),
+    'ERS': pd.Timedelta(days=120),
+    'ENVISAT': pd.Timedelta(days=120),
+    'Sentinel-1': pd.Timedelta(days=120),
+    'COSMO-SkyMed': pd.Timedelta(days=120),
+}
+
+def ganttIntervals(
     disp_square,
     ERS_asc_disp,
     ERS_desc_disp,
@@ -23,35 +34,39 @@ def figureGantt(
     S_asc_disp,
     C_asc_disp,
     ):
+    """
+    Returns the intervals (sensor, start, end) in which
+    each instrumentation has data.
+    Expects:
+    - dataframes with monitoring data
+    """
+    which_dates = {
+        'Square levelling': disp_square.index,
+        'ERS': ERS_asc_disp.index.append(ERS_desc_disp.index),
+        'ENVISAT': ENV_asc_disp.index,
+        'Sentinel-1': S_asc_disp.index,
+        'COSMO-SkyMed': C_asc_disp.index,
+    }
+    return pd.concat(
+        [coverageIntervals(d, w, GANTT_MAX_GAPS[w]) for w, d in which_dates.items()],
+        ignore_index=True
+    )
+
+
+def figureGantt(which, intervals):
     """
     Plots a Gantt chart with the temporal availability of data.
     Expects:
     - which = list of instrumentation to plot.
-    - dataframes with monitoring data
+    - intervals = DataFrame with sensor, start, end (see ganttIntervals)
     Returns:
     - figure object
     """
-    ERS_disp=pd.concat([ERS_asc_disp,ERS_desc_disp])
-    #lev_tot=pd.concat([lev_tower,DF_disp],axis=1)
-    which_df = {
-        'Square levelling': disp_square,
-        'ERS': ERS_disp,
-        'ENVISAT': ENV_asc_disp,
-        'Sentinel-1': S_asc_disp,
-        'COSMO-SkyMed': C_asc_disp,
-    }
-
     fig = go.Figure(layout_template=None)
     for i, w in enumerate(which):
-        df = which_df[w]
-        ind=df.sort_index().index
-        my_index = ind
         fig.add_trace(
-            go.Scatter(x=my_index, y=[w]*len(my_index),
-                   mode='markers', name=w,
-                      marker_color=colors[i],
-                      marker_size = 10,
-                      marker_symbol='square')
+            ganttTrace(intervals[intervals['sensor'] == w],
+                       name=w, line_color=colors[i])
         )
 
     fig.update_layout(dict(yaxis_range=(-0.5, len(which)-0.5)),
@@ -65,14 +80,69 @@ def figureGantt(
 #-----------------------
 #    SQUARE PLAN TAB
 #-----------------------
+# initial zoom of the maps
+MAP_ZOOM = 16.3
+# satellite points in view beyond this number (in a trace)
+# are drawn as aggregates by grid cell
+MAX_MAP_POINTS = 5000
+
+def psMapTrace(coord, index, positions, viewport, name, color):
+    '''
+    A map trace with the satellite points of *coord* at *positions*
+    (see utils.ps_index), or, if they are more than MAX_MAP_POINTS,
+    with one marker per grid cell (size of the cells depending on
+    the zoom of *viewport*, at most MAX_MAP_POINTS cells) showing
+    number and mean velocity of its points. Aggregated markers have no customdata: they can't be
+    selected for the displacement plots.
+    '''
+    if len(positions) <= MAX_MAP_POINTS:
+        d = coord.iloc[positions]
+        return go.Scattermapbox(
+            lat=d['LAT'],
+            lon=d['LON'],
+            marker=go.scattermapbox.Marker(
+                size=7,
+                color=color,
+                opacity=1),
+            text=[n for n in d.index],
+            hoverinfo='text',
+            customdata=[n for n in d.index],
+            name=name
+        )
+
+    zoom = viewport['zoom'] if viewport else MAP_ZOOM
+    cell = viewportCell(zoom)
+    cells = aggregatePs(index, positions, cell, coord['VEL'])
+    # points spread over a large area (e.g. before the first
+    # zoom, when the bounds are not known): coarser cells
+    while len(cells['COUNT']) > MAX_MAP_POINTS:
+        cell *= 2
+        cells = aggregatePs(index, positions, cell, coord['VEL'])
+    return go.Scattermapbox(
+        lat=cells['LAT'],
+        lon=cells['LON'],
+        marker=go.scattermapbox.Marker(
+            size=np.clip(3 * np.sqrt(cells['COUNT']), 7, 20),
+            color=color,
+            opacity=0.7),
+        text=['{} points, mean VEL = {:.2f}'.format(c, v) for c, v in zip(cells['COUNT'], cells['VALUE'])],
+        hoverinfo='text',
+        name=name + ' (aggregated)'
+    )
+
+
 def map_square_vertical(
     benchplot, pos_square,
     ERS_vcoord, ENV_vcoord,
-    S_vcoord, C_vcoord):
+    S_vcoord, C_vcoord,
+    ps_indexes, viewport=None):
     '''
     An open-street-map figure with reliable
     (and unreliable) benchmarks and satellite
     points (VERTICAL DISPLACEMENTS ONLY)
+    *ps_indexes* are the indexes of the satellite points
+    (see utils.ps_index), by satellite name; only the points
+    in the bounds of *viewport* (see relayoutViewport) are drawn.
     '''
     ## FIX: colors
     fig=go.Figure()
@@ -115,71 +185,17 @@ def map_square_vertical(
             )
         )
 
-    if 'ERS' in benchplot:
-        fig.add_trace(
-            go.Scattermapbox(
-                lat=ERS_vcoord["LAT"],
-                lon=ERS_vcoord["LON"],
-                marker=go.scattermapbox.Marker(
-                    size=7,
-                    color='#117733',
-                    opacity=1,),
-                text=[n for n in ERS_vcoord.index],
-                hoverinfo='text',
-                customdata=[n for n in ERS_vcoord.index],
-                name='ERS'
-            )
-        )
-
-    if 'ENVISAT' in benchplot:
-        fig.add_trace(
-            go.Scattermapbox(
-                lat=ENV_vcoord["LAT"],
-                lon=ENV_vcoord["LON"],
-                marker=go.scattermapbox.Marker(
-                    size=7,
-                    color='#44AA99',
-                    opacity=1,),
-                text=[n for n in ENV_vcoord.index],
-                hoverinfo='text',
-                customdata=[n for n in ENV_vcoord.index],
-                name='ENVISAT'
-            )
-        )
-
-
-    if 'COSMO-SkyMed' in benchplot:
-        fig.add_trace(
-            go.Scattermapbox(
-                lat=C_vcoord["LAT"],
-                lon=C_vcoord["LON"],
-                marker=go.scattermapbox.Marker(
-                    size=7,
-                    color='#CC6677',
-                    opacity=1,),
-                text=[n for n in C_vcoord.index],
-                hoverinfo='text',
-                customdata=[n for n in C_vcoord.index],
-                name='COSMO-SkyMed'
-            )
-        )
-
-
-    if 'Sentinel-1' in benchplot:
-        fig.add_trace(
-            go.Scattermapbox(
-                lat=S_vcoord["LAT"],
-                lon=S_vcoord["LON"],
-                marker=go.scattermapbox.Marker(
-                    size=7,
-                    color='#CC3311',
-                    opacity=1,),
-                text=[n for n in S_vcoord.index],
-                hoverinfo='text',
-                customdata=[n for n in S_vcoord.index],
-                name='Sentinel-1'
-            )
-        )
+    datasets = {
+        'ERS': [ERS_vcoord, '#117733'],
+        'ENVISAT': [ENV_vcoord, '#44AA99'],
+        'COSMO-SkyMed': [C_vcoord, '#CC6677'],
+        'Sentinel-1': [S_vcoord, '#CC3311']
+    }
+    bounds = viewport['bounds'] if viewport else None
+    for b, (d, color) in datasets.items():
+        if b in benchplot:
+            positions = queryPsIndex(ps_indexes[b], bounds=bounds)
+            fig.add_trace(psMapTrace(d, ps_indexes[b], positions, viewport, b, color))
 
     # legend
     fig.update_layout(showlegend=True)
@@ -203,9 +219,11 @@ def map_square_vertical(
                 lon=10.396
             ),
             pitch=0,
-            zoom=16.3,
+            zoom=MAP_ZOOM,
         ),
-        clickmode='event+select'
+        clickmode='event+select',
+        # the view is kept when the points are updated
+        uirevision='map_square'
     )
 
     return fig
@@ -217,11 +235,16 @@ def map_square(
     ERS_coord,
     ENV_coord,
     S_coord,
-    C_coord
+    C_coord,
+    ps_indexes,
+    viewport=None
     ):
     '''
     An open-street-map figure with reliable (and unreliable)
     benchmarks and satellite points.
+    *ps_indexes* are the indexes of the satellite points
+    (see utils.ps_index), by satellite name; only the points
+    in the bounds of *viewport* (see relayoutViewport) are drawn.
     '''
 
     fig=go.Figure()
@@ -275,40 +298,12 @@ def map_square(
 
         else:
             d = datasets[b][0]
-            d = d[d['COHER'] >= crange[0]]
-            d = d[d['COHER'] <= crange[1]]
-            d = d[d['HEIGHT'] >= hrange[0]]
-            d = d[d['HEIGHT'] <= hrange[1]]
             cols = datasets[b][1]
-
-            fig.add_trace(
-                go.Scattermapbox(
-                    lat=d[d['TYPE']=='asc']['LAT'],
-                    lon=d[d['TYPE']=='asc']['LON'],
-                    marker=go.scattermapbox.Marker(
-                        size=7,
-                        color=cols[0],
-                        opacity=1),
-                    text=[n for n in d[d['TYPE']=='asc'].index],
-                    hoverinfo='text',
-                    customdata=[n for n in d[d['TYPE'] == 'asc'].index],
-                    name=b+' ascending'
-                )
-            )
-            fig.add_trace(
-                go.Scattermapbox(
-                    lat=d[d['TYPE']=='des']['LAT'],
-                    lon=d[d['TYPE']=='des']['LON'],
-                    marker=go.scattermapbox.Marker(
-                        size=7,
-                        color=cols[1],
-                        opacity=1),
-                    text=[n for n in d[d['TYPE']=='des'].index],
-                    hoverinfo='text',
-                    customdata=[n for n in d[d['TYPE'] == 'des'].index],
-                    name=b+' descending'
-                )
-            )
+            bounds = viewport['bounds'] if viewport else None
+            positions = queryPsIndex(ps_indexes[b], {'COHER': crange, 'HEIGHT': hrange}, bounds)
+            types = d['TYPE'].to_numpy()[positions]
+            fig.add_trace(psMapTrace(d, ps_indexes[b], positions[types == 'asc'], viewport, b+' ascending', cols[0]))
+            fig.add_trace(psMapTrace(d, ps_indexes[b], positions[types == 'des'], viewport, b+' descending', cols[1]))
 
     fig.update_layout(showlegend=True)
     fig.update_layout(
@@ -330,14 +325,39 @@ def map_square(
                 lon=10.396
             ),
             pitch=0,
-            zoom=16.3,
+            zoom=MAP_ZOOM,
         ),
-        clickmode='event+select'
+        clickmode='event+select',
+        # the view is kept when the points are updated
+        uirevision='map_square'
     )
 
     return fig
 
 
+def levellingDisplacement(disp_square):
+    '''
+    Returns the displacements of the benchmarks (in mm)
+    with respect to their first measurement.
+    Expects:
+    - disp_square = levelling data in m, benchmarks on columns
+    '''
+    disp_square = disp_square*1000 #mm
+    # first valid value of each column
+    return disp_square - disp_square.bfill().iloc[0]
+
+
+def resampleDisplacement(disp, resample=None):
+    '''
+    Returns *disp* resampled with the mean
+    (a new DataFrame: *disp* is not modified).
+    *resample* = None returns *disp* as it is.
+    '''
+    if resample is None:
+        return disp
+    return disp.resample(resample).mean()
+
+
 def MapPointsDisplacement(p_list, together, daterange,
                           disp_square,
                           ERS_coord,
@@ -359,30 +379,31 @@ def MapPointsDisplacement(p_list, together, daterange,
                           C_asc_disp,
                           C_desc_disp,
                           C_vcoord,
-                          C_vdisp,
-                          resample=None):
+                          C_vdisp):
+    '''
+    Displacement plots of the points in *p_list*.
+    Expects:
+    - disp_square = levelling displacements in mm (see levellingDisplacement)
+    - the displacements of the satellites, already resampled
+      as needed (see resampleDisplacement): only the columns of
+      the points in *p_list* are used, and they are not modified.
+    '''
     ## FIX: colors
-    # Levelling dataset
-    disp_square=disp_square*1000 #mm
-    for col in disp_square.columns:
-        disp_square[col] = (disp_square[col] - disp_square.loc[disp_square[col].first_valid_index(), col])
-    levelling = disp_square
-
     # Satellite datasets
-    # [dataset, color, resamplable, h+coher, coordinate dataset]
+    # [dataset, color, h+coher, coordinate dataset]
     datasets = {
-        'ers-a': [ERS_asc_disp, '#117733', False, True, ERS_coord],
-        'ers-d': [ERS_desc_disp, '#999933', False, True, ERS_coord],
-        'ers-v': [ERS_vdisp, '#117733', False, False, ERS_vcoord],
-        'env-a': [ENV_asc_disp, '#44AA99', False, True, ENV_coord],
-        'env-d': [ENV_desc_disp, '#88CCEE', False, True, ENV_coord],
-        'env-v': [ENV_vdisp, '#44AA99', False, False, ENV_vcoord],
-        'sen-a': [S_asc_disp, '#CC3311', True, True, S_coord],
-        'sen-d': [S_desc_disp, '#EE7733', True, True, S_coord],
-        'sen-v': [S_vdisp, '#CC3311', True, False, S_vcoord],
-        'csk-a': [C_asc_disp, '#CC6677', True, True, C_coord],
-        'csk-d': [C_desc_disp, '#DDCC77', True, True, C_coord],
-        'csk-v': [C_vdisp, '#CC6677', True, False, C_vcoord],
+        'ers-a': [ERS_asc_disp, '#117733', True, ERS_coord],
+        'ers-d': [ERS_desc_disp, '#999933', True, ERS_coord],
+        'ers-v': [ERS_vdisp, '#117733', False, ERS_vcoord],
+        'env-a': [ENV_asc_disp, '#44AA99', True, ENV_coord],
+        'env-d': [ENV_desc_disp, '#88CCEE', True, ENV_coord],
+        'env-v': [ENV_vdisp, '#44AA99', False, ENV_vcoord],
+        'sen-a': [S_asc_disp, '#CC3311', True, S_coord],
+        'sen-d': [S_desc_disp, '#EE7733', True, S_coord],
+        'sen-v': [S_vdisp, '#CC3311', False, S_vcoord],
+        'csk-a': [C_asc_disp, '#CC6677', True, C_coord],
+        'csk-d': [C_desc_disp, '#DDCC77', True, C_coord],
+        'csk-v': [C_vdisp, '#CC6677', False, C_vcoord],
 
     }
 
@@ -409,18 +430,14 @@ def MapPointsDisplacement(p_list, together, daterange,
         figs_indices = range(len(p_list))
 
     for idx_figure, p in zip(figs_indices, p_list):
-        try:
-            d = datasets[p[:5]] # If the point is a PS
-            if resample != None and d[2]:
-                d[0] = d[0].resample(resample).mean()
-        except:
-            d = [levelling, '#332288', False, False]
-
-        data=d[0].loc[daterange[0]:daterange[1]]
+        # If the point is a PS, otherwise a benchmark
+        d = datasets.get(p[:5], [disp_square, '#332288', False])
+
+        data=d[0][p].loc[daterange[0]:daterange[1]]
         figs[idx_figure].add_trace(
-            go.Scatter(
+            scatterTrace(
                 x=data.index,
-                y=data[p],
+                y=data,
                 mode='markers+lines',
                 marker_color = d[1],
                 line_color = d[1],
@@ -432,10 +449,10 @@ def MapPointsDisplacement(p_list, together, daterange,
         )
 
         # Write name and, if relevant, coherence and height
-        if d[3] and not together:
+        if d[2] and not together:
             figs[idx_figure].update_layout(
                 title={
-                    'text': "<b>{}</b>   Height = {} m, Coherence = {}".format(p, d[4].loc[p]['HEIGHT'], d[4].loc[p]['COHER']),
+                    'text': "<b>{}</b>   Height = {} m, Coherence = {}".format(p, d[3].loc[p]['HEIGHT'], d[3].loc[p]['COHER']),
                     'yref':"container",
                     'x':0.5,
                     'xanchor': 'center',
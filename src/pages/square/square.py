@@ -1,15 +1,19 @@
 # package imports
 import dash
-from dash import html, dcc, callback, Input, Output
+from dash import html, dcc, callback, Input, Output, State
 import dash_bootstrap_components as dbc
 
 
 # local imports
 from utils.utils import id_factory
 from utils.utils import svg_config
+from utils.figure_cache import cachedFigure
+from data.registry import refreshCache, datasetExists
+from utils.ps_index import buildPsIndex, relayoutViewport
+from utils.export import exportControls, exportUrl
 id = id_factory('square')
 from .functions import *
-from data.square_data import *
+from data import square_data as s_data
 
 # page registration
 dash.register_page(
@@ -165,6 +169,8 @@ s_tab_plan = dbc.Tab([
     dbc.Row([
         dbc.Col([
             dcc.Graph(id=id('map_square'), config=svg_config),
+            # bounds and zoom of the map (see relayoutViewport)
+            dcc.Store(id=id('store_map_square_viewport')),
             html.Br()
         ],
             width=10,
@@ -262,7 +268,8 @@ s_tab_plan = dbc.Tab([
             justify='center'
         ),
         html.Br(),
-        html.Div(id=id('div_map_displacement'))
+        html.Div(id=id('div_map_displacement')),
+        exportControls(id('link_map_export'), id('radioitems_map_export')),
 ], label= "PLAN"
 )
 
@@ -297,15 +304,19 @@ layout = dbc.Row([
 @callback(Output(id('gantt'), 'figure'),
              Input(id('checklist_gantt'), 'value'))
 def callFigureGantt(which):
-    return figureGantt(
-        which,
-        S_LEVELLING_DATA,
-        ERS_ASC,
-        ERS_DES,
-        ENV_ASC,
-        SEN_ASC,
-        CSK_ASC,
-        
+    return figureGantt(which, squareGanttIntervals())
+
+# the intervals only depend on the data: they are computed once
+# (from the dates of the stacks only, without their scatterers)
+@refreshCache
+def squareGanttIntervals():
+    return ganttIntervals(
+        s_data.S_LEVELLING_DATA,
+        s_data.psColumns('ERS_ASC', []),
+        s_data.psColumns('ERS_DES', []),
+        s_data.psColumns('ENV_ASC', []),
+        s_data.psColumns('SEN_ASC', []),
+        s_data.psColumns('CSK_ASC', []),
     )
 
 #-----------------------
@@ -316,27 +327,62 @@ def callFigureGantt(which):
              Input(id('checklist_map_square'), 'value'),
              Input(id('radioitems_map_square'), 'value'),
              Input(id('rangeslider_map_square_coherence'), 'value'),
-             Input(id('rangeslider_map_square_height'),'value'))
-
-def callMapSquare(benchplot, vertical_bool, crange, hrange):
+             Input(id('rangeslider_map_square_height'),'value'),
+             Input(id('store_map_square_viewport'), 'data'))
+@cachedFigure('S_LEVELLING_INFO',
+              'ERS_LOS_INFO', 'ENV_LOS_INFO', 'SEN_LOS_INFO', 'CSK_LOS_INFO',
+              'ERS_VER_INFO', 'ENV_VER_INFO', 'SEN_VER_INFO', 'CSK_VER_INFO')
+def callMapSquare(benchplot, vertical_bool, crange, hrange, viewport):
     if vertical_bool:
         return map_square_vertical(
             benchplot,
-            S_LEVELLING_INFO,
-            ERS_VER_INFO,
-            ENV_VER_INFO,
-            SEN_VER_INFO,
-            CSK_VER_INFO
+            s_data.S_LEVELLING_INFO,
+            s_data.ERS_VER_INFO,
+            s_data.ENV_VER_INFO,
+            s_data.SEN_VER_INFO,
+            s_data.CSK_VER_INFO,
+            {
+                'ERS': psIndex('ERS_VER_INFO'),
+                'ENVISAT': psIndex('ENV_VER_INFO'),
+                'Sentinel-1': psIndex('SEN_VER_INFO'),
+                'COSMO-SkyMed': psIndex('CSK_VER_INFO'),
+            },
+            viewport
         )
     return map_square(
         benchplot, crange, hrange,
-        S_LEVELLING_INFO,
-        ERS_LOS_INFO,
-        ENV_LOS_INFO,
-        SEN_LOS_INFO,
-        CSK_LOS_INFO
+        s_data.S_LEVELLING_INFO,
+        s_data.ERS_LOS_INFO,
+        s_data.ENV_LOS_INFO,
+        s_data.SEN_LOS_INFO,
+        s_data.CSK_LOS_INFO,
+        {
+            'ERS': psIndex('ERS_LOS_INFO'),
+            'ENVISAT': psIndex('ENV_LOS_INFO'),
+            'Sentinel-1': psIndex('SEN_LOS_INFO'),
+            'COSMO-SkyMed': psIndex('CSK_LOS_INFO'),
+        },
+        viewport
     )
 
+# the index of the scatterers of each dataset is built once
+@refreshCache
+def psIndex(name):
+    return buildPsIndex(getattr(s_data, name))
+
+#--Viewport of the map, after zooms and pans
+@callback(Output(id('store_map_square_viewport'), 'data'),
+             Input(id('map_square'), 'relayoutData'),
+             State(id('store_map_square_viewport'), 'data'),
+             prevent_initial_call=True)
+def callMapSquareViewport(relayout_data, current):
+    viewport = relayoutViewport(relayout_data)
+    # other events (e.g. selections) and pans within
+    # the same tiles don't redraw the map
+    if viewport is None or viewport == current:
+        return dash.no_update
+    return viewport
+
 #--Return number of points
 ## FIX: it should return the number of points AFTER filtering
 @callback(Output(id('number_points_map_square'), 'children'),
@@ -345,21 +391,21 @@ def callMapSquare(benchplot, vertical_bool, crange, hrange):
 def callMapNumberPoints(benchplot, vertical_bool):
     if vertical_bool:
         datasets = {
-            'Lev. reliable':S_LEVELLING_INFO[S_LEVELLING_INFO['rel']==1].shape[0], # benchmarks on rows
-            'Lev. unreliable':S_LEVELLING_INFO[S_LEVELLING_INFO['rel']==0].shape[0], # benchmarks on rows
-            'ERS':ERS_VER_INFO.shape[0],    # scatterers on rows
-            'ENVISAT':ENV_VER_INFO.shape[0],    # "
-            'Sentinel-1':SEN_VER_INFO.shape[0],   # "
-            'COSMO-SkyMed':CSK_VER_INFO.shape[0]  # "
+            'Lev. reliable':s_data.S_LEVELLING_INFO[s_data.S_LEVELLING_INFO['rel']==1].shape[0], # benchmarks on rows
+            'Lev. unreliable':s_data.S_LEVELLING_INFO[s_data.S_LEVELLING_INFO['rel']==0].shape[0], # benchmarks on rows
+            'ERS':s_data.ERS_VER_INFO.shape[0],    # scatterers on rows
+            'ENVISAT':s_data.ENV_VER_INFO.shape[0],    # "
+            'Sentinel-1':s_data.SEN_VER_INFO.shape[0],   # "
+            'COSMO-SkyMed':s_data.CSK_VER_INFO.shape[0]  # "
         }
     else:
         datasets = {
-            'Lev. reliable':S_LEVELLING_INFO[S_LEVELLING_INFO['rel']==1].shape[0], # benchmarks on rows
-            'Lev. unreliable':S_LEVELLING_INFO[S_LEVELLING_INFO['rel']==0].shape[0], # benchmarks on rows
-            'ERS':ERS_LOS_INFO.shape[0],    # scatterers on rows
-            'ENVISAT':ENV_LOS_INFO.shape[0], # "
-            'Sentinel-1':SEN_LOS_INFO.shape[0],   # "
-            'COSMO-SkyMed':CSK_LOS_INFO.shape[0]  # "
+            'Lev. reliable':s_data.S_LEVELLING_INFO[s_data.S_LEVELLING_INFO['rel']==1].shape[0], # benchmarks on rows
+            'Lev. unreliable':s_data.S_LEVELLING_INFO[s_data.S_LEVELLING_INFO['rel']==0].shape[0], # benchmarks on rows
+            'ERS':s_data.ERS_LOS_INFO.shape[0],    # scatterers on rows
+            'ENVISAT':s_data.ENV_LOS_INFO.shape[0], # "
+            'Sentinel-1':s_data.SEN_LOS_INFO.shape[0],   # "
+            'COSMO-SkyMed':s_data.CSK_LOS_INFO.shape[0]  # "
         }
     if benchplot == []:
         return 'Select at least one source.'
@@ -380,37 +426,79 @@ def callMapNumberPoints(benchplot, vertical_bool):
             Input(id('slider_map_displacement_resample'), 'value'))
 def callDivMapSquare(points_from_map, together, start, end, resample_idx):
     resampler_list = [None, 'M', '6M', 'Y']
+    resample = resampler_list[resample_idx]
     daterange = [start, end]
     together = sum(together)
     together_list = [False, True]
     try:
-        p_list = [el['customdata'] for el in points_from_map['points']]
+        # aggregated markers (without customdata) are not points
+        p_list = [el['customdata'] for el in points_from_map['points'] if 'customdata' in el]
+        # only the selected scatterers are read from each stack
+        disp = {}
+        for prefix, name in s_data.PS_STACKS.items():
+            # only Sentinel-1 and COSMO-SkyMed are resampled
+            disp[name] = psDisplacement(
+                name, [p for p in p_list if p[:5] == prefix],
+                resample if name[:3] in ['SEN', 'CSK'] else None
+            )
         children = MapPointsDisplacement(
             p_list, together_list[together], daterange,
-            S_LEVELLING_DATA,
-            ERS_LOS_INFO,
-            ERS_ASC,
-            ERS_DES,
-            ERS_VER_INFO,
-            ERS_VER,
-            ENV_LOS_INFO,
-            ENV_ASC,
-            ENV_DES,
-            ENV_VER_INFO,
-            ENV_VER,
-            SEN_LOS_INFO,
-            SEN_ASC,
-            SEN_DES,
-            SEN_VER_INFO,
-            SEN_VER,
-            CSK_LOS_INFO,
-            CSK_ASC,
-            CSK_DES,
-            CSK_VER_INFO,
-            CSK_VER,
-            resample=resampler_list[resample_idx]
+            squareLevelling(),
+            s_data.ERS_LOS_INFO,
+            disp['ERS_ASC'],
+            disp['ERS_DES'],
+            s_data.ERS_VER_INFO,
+            disp['ERS_VER'],
+            s_data.ENV_LOS_INFO,
+            disp['ENV_ASC'],
+            disp['ENV_DES'],
+            s_data.ENV_VER_INFO,
+            disp['ENV_VER'],
+            s_data.SEN_LOS_INFO,
+            disp['SEN_ASC'],
+            disp['SEN_DES'],
+            s_data.SEN_VER_INFO,
+            disp['SEN_VER'],
+            s_data.CSK_LOS_INFO,
+            disp['CSK_ASC'],
+            disp['CSK_DES'],
+            s_data.CSK_VER_INFO,
+            disp['CSK_VER']
         )
     except:
         children = dcc.Markdown('Select at least one point.')
     return children
+
+#--Link to download the data of the selected points
+@callback(Output(id('link_map_export'), 'href'),
+            Input(id('map_square'), 'selectedData'),
+            Input(id('datepicker_map_displacement'), 'start_date'),
+            Input(id('datepicker_map_displacement'), 'end_date'),
+            Input(id('radioitems_map_export'), 'value'))
+def callLinkMapExport(points_from_map, start, end, export_format):
+    if not points_from_map:
+        return None
+    # aggregated markers (without customdata) are not points
+    p_list = [el['customdata'] for el in points_from_map['points'] if 'customdata' in el]
+    selection = {
+        'ps': [p for p in p_list if p[:5] in s_data.PS_STACKS],
+        'square_levelling': [p for p in p_list if p[:5] not in s_data.PS_STACKS],
+    }
+    return exportUrl(selection, start, end, export_format=export_format)
+
+# the levelling displacements are normalized once
+@refreshCache
+def squareLevelling():
+    return levellingDisplacement(s_data.S_LEVELLING_DATA)
+
+def psDisplacement(name, ids, resample):
+    '''
+    Returns the measurements of the points *ids* in the stack
+    *name*, resampled at *resample*. Resampled stacks are written
+    by the ETL: they are only resampled here if the files are not there.
+    '''
+    level = s_data.psStackName(name, resample)
+    if datasetExists(level):
+        return s_data.psColumns(level, ids)
+    return resampleDisplacement(s_data.psColumns(name, ids), resample)
     
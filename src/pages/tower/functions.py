@@ -5,11 +5,16 @@ import plotly.graph_objects as go
 from colour import Color
 from datetime import datetime as dt
 from dash import dcc
-import glob
 
 # local imports
 from utils.styles import *
+from utils.utils import scatterTrace
+from utils.gantt import joinIntervals, ganttTrace
 from data.tower.static_sensor_list import t_sensor_dict_unit, t_sensor_dict
+from data import tower_data as t_data
+from data.registry import refreshCache
+from data.tower.static_archive import readStaticArchive
+from utils.downsampling import downsample, pickResolution, relayoutRange, PLOT_WIDTH
 
 
 #==============================
@@ -564,66 +569,6 @@ def rot_tower(lev_tower):
 #    TOWER STATIC MONITORING
 #-------------------------
 
-def merge_and_filter_dataframe(directory, resample, sensor_names, start_date, end_date):
-    '''
-    I need this function because i have these dataframe divided per year and based on their resample (H,D,W,M)
-    '''
-    for filepath in glob.glob(directory):
-    # Extract filename from the full path
-        filename = filepath.split('\\')[-1]
-    
-    # Generate the name for the DataFrame
-        if not filename.endswith('.txt'):
-            df_name = filename.replace('.parquet', '').upper()
-    
-    # Create the DataFrame by reading the Parquet file
-            dataframe = pd.read_parquet(filepath)
-    
-    # Assign the DataFrame to a variable name in the global namespace
-            locals()[df_name] = dataframe
-    
-    start_year=int(start_date[:4])
-    end_year=int(end_date[:4])
-    # Create a list to hold the DataFrames
-    dfs = []
-
-    # Loop through each year in the specified range
-    for year in range(start_year, end_year + 1):
-        # Determine the file prefix based on the resample type
-        if resample == 'daily':
-            prefix = 'D_'
-        elif resample == 'hourly':
-            prefix = 'H_'
-        elif resample == 'weekly':
-            prefix = 'W_'
-        elif resample == 'monthly':
-            prefix = 'M_'
-        else:
-            raise ValueError("Invalid resample type. Choose from 'daily', 'hourly', 'weekly', 'monthly'.")
-
-        # Construct the DataFrame name
-        df_name = f"{prefix}{year}"
-        
-        # Check if the DataFrame exists in the global namespace
- 
-            # Retrieve the DataFrame
-        
-        df = locals()[df_name]
-            
-            # Append the DataFrame to the list
-        dfs.append(df)
-
-    # Concatenate all DataFrames
-    if dfs:
-        combined_df = pd.concat(dfs)
-
-        # Filter columns based on sensor names
-        filtered_df = combined_df.loc[:, combined_df.columns.isin(sensor_names)]
-
-        return filtered_df
-    else:
-        raise ValueError("No DataFrames found for the specified resample and year range.")
- 
 #two funcions that we need for the next function 'figureStaticDisplacement': 
 def get_unit(instrument_name):
     # Find the category of the instrument
@@ -652,7 +597,12 @@ def remove_outliers_iqr(df):
         IQR = Q3 - Q1
         return df[~((df < (Q1 - 1.5 * IQR)) | (df > (Q3 + 1.5 * IQR))).any(axis=1)]
         
-def figureStaticDisplacement(dataframe, start, end, together,y_axis,remove_out):
+def figuresStaticDisplacement(dataframe, start, end, together, y_axis, remove_out, width=PLOT_WIDTH):
+    """
+    Returns the figures of the sensors in *dataframe* between *start*
+    and *end*: one per sensor, or a single one if *together*.
+    Each trace is downsampled to the plot *width* (in pixels).
+    """
     dataframepd=pd.DataFrame(dataframe)
     dataframepd=dataframepd.loc[start:end]
     if remove_out:
@@ -671,19 +621,14 @@ def figureStaticDisplacement(dataframe, start, end, together,y_axis,remove_out):
         figs_indices = range(len(p_list))
         
     if together and y_axis:
-        figs[0].add_trace(go.Scatter(
-                x=dataframepd.index,
-                y=dataframepd[p_list[0]],
-                mode='markers+lines',
-                name=str(p_list[0]),
-                yaxis='y1'))
-         
-        figs[0].add_trace(go.Scatter(
-                x=dataframepd.index,
-                y=dataframepd[p_list[1]],
-                mode='markers+lines',
-                name=str(p_list[1]),
-                yaxis='y2'))
+        for p, yaxis in zip(p_list[:2], ['y1', 'y2']):
+            series = downsample(dataframepd[p], width)
+            figs[0].add_trace(scatterTrace(
+                    x=series.index,
+                    y=series.values,
+                    mode='markers+lines',
+                    name=str(p),
+                    yaxis=yaxis))
         
         figs[0].update_layout(
                 yaxis1=dict(title=f"{get_unit(p_list[0])}"),
@@ -694,10 +639,11 @@ def figureStaticDisplacement(dataframe, start, end, together,y_axis,remove_out):
     else:
 
         for idx_figure, p in zip(figs_indices, p_list):
+            series = downsample(dataframepd[p], width)
             figs[idx_figure].add_trace(
-            go.Scatter(
-                x=dataframepd.index,
-                y=dataframepd[p],
+            scatterTrace(
+                x=series.index,
+                y=series.values,
                 mode='markers+lines',
                 name=str(p)
                 )
@@ -705,81 +651,43 @@ def figureStaticDisplacement(dataframe, start, end, together,y_axis,remove_out):
          # Get the unit of the current instrument
             unit = get_unit(p)
             figs[idx_figure].update_layout(yaxis_title=f"{unit}")
-         
-     
-        
 
-    # Create graph components for each figure
-    children = [dcc.Graph(id=f'temp_graph{idx_f}', figure=f) for idx_f, f in enumerate(figs)]
+    # keep zoom and hidden traces when the data is re-fetched
+    for f in figs:
+        f.update_layout(uirevision=True)
+    return figs
+
+
+def figureStaticDisplacement(dataframe, start, end, together,y_axis,remove_out, graph_type):
+    figs = figuresStaticDisplacement(dataframe, start, end, together, y_axis, remove_out)
+
+    # Create graph components for each figure, with pattern-matching
+    # ids of type *graph_type*
+    children = [dcc.Graph(id={'type': graph_type, 'index': idx_f}, figure=f) for idx_f, f in enumerate(figs)]
     return children
     
 #-------------------------
 #    TOWER STATIC INFO
 #-------------------------
+# interruptions shorter than this are not shown
+# (they wouldn't be visible over the whole period anyway)
+GANTT_MAX_GAP = pd.Timedelta(days=1)
+
+def gantt_chart(intervals, max_gap=GANTT_MAX_GAP):
+    """
+    Produces the Gantt chart of the static sensors, from their
+    availability *intervals* (sensor, start, end), joining the
+    intervals separated by at most *max_gap*.
+    """
+    all_sensors = np.concatenate(list(t_sensor_dict.values())).tolist()
+    intervals = intervals[intervals['sensor'].isin(all_sensors)]
+    # sensors from the bottom up in alphabetical order
+    intervals = intervals.sort_values(['sensor', 'start'], ascending=[False, True])
+    intervals = joinIntervals(intervals, max_gap)
+
+    # all the operational periods in a single trace
+    fig = go.Figure(ganttTrace(intervals, name='Operational', showlegend=False))
 
-def gantt_chart():
-    datafolder=glob.glob('data/tower/parquet_data/static/*')
-    df_list=[]
-    for f in datafolder:
-        filename = f.split('\\')[-1]
-        if filename.startswith('m'):
-            df_temp=pd.read_parquet(f)
-            df_list.append(df_temp)
-    df=pd.concat(df_list,ignore_index=False) 
-    filtered_columns = [col for col in df.columns if col in np.concatenate(list(t_sensor_dict.values())).tolist()]
-    df_filtered = df[filtered_columns]
-    df_filtered = df_filtered[sorted(df_filtered.columns,reverse=True)]
-    gantt_data = []
-
-    for instrument in df_filtered.columns:
-        instrument_data = df_filtered[instrument]
-        operational_periods = instrument_data.notna().astype(int)  # 1 if operational, 0 if not
-        operational_streaks = operational_periods.diff().fillna(0)  # Identify changes in state
-    
-        # Get the start and end of each operational period
-        start_dates=[]
-        start_dates.append(operational_periods.idxmax())
-        start_dates.append(instrument_data.index[operational_streaks == 1])
-        # flat list
-        flat_timestamps = []
-        for item in start_dates:
-            if isinstance(item, pd.Timestamp):
-                flat_timestamps.append(item)
-            elif isinstance(item, pd.DatetimeIndex):
-                flat_timestamps.extend(item.tolist()) 
-        start_dates=flat_timestamps
-        start_dates=list(np.sort(list(set(start_dates))))
-        end_dates=list(instrument_data.index[operational_streaks == -1])
-        if len(end_dates)<len(start_dates):
-            end_dates.append(instrument_data.index[-1])
-        for start in range(len(start_dates)):
-            end=end_dates[start]
-        
-            gantt_data.append({
-                'Instrument': instrument,
-                'Start': start_dates[start],
-                'End': end
-            })
-    
-    # Create a Gantt chart with gaps for non-operational days
-    fig = go.Figure()
-    
-    # Add each operational period as a line in the Gantt chart
-    for instrument in df_filtered.columns:
-        instrument_data = [entry for entry in gantt_data if entry['Instrument'] == instrument]
-    
-        for row in instrument_data:
-            # Only plot if there's a valid operational period
-            if pd.notna(row['Start']) and pd.notna(row['End']):
-                fig.add_trace(go.Scatter(
-                    x=[row['Start'], row['End']],  # Start and end dates
-                    y=[instrument, instrument],
-                    mode='lines',
-                    line=dict(width=10, ),
-                    name=instrument,
-                    showlegend=False  # Avoid duplicate legends
-                ))
-    
     # Update layout
     fig.update_layout(
         yaxis=dict(automargin=True,  tickangle=0 ,tickfont=dict(size=12.5), dtick=1  ), # Ruota le etichette se necessario),
@@ -789,7 +697,30 @@ def gantt_chart():
         width=1500
     )
 
-# Show the figure
     return fig
 
-   
\ No newline at end of file
+
+#=========================
+#    STANDALONE FIGURES
+#=========================
+# These figures are the same for every visitor: they are
+# built on the first visit to the page and then reused
+# (until the data is refreshed).
+@refreshCache
+def benchSelectionFigure():
+    return figureBenchSelection(t_data.T_CAPRARO_BENCHMARKS)
+
+
+@refreshCache
+def benchStabilSelectionFigure():
+    return figureBenchStabilSelection(t_data.T_STABIL_COORDS)
+
+
+@refreshCache
+def rotTowerFigure():
+    return rot_tower(t_data.T_CAPRARO_DATA)
+
+
+@refreshCache
+def ganttFigure():
+    return gantt_chart(t_data.T_STATIC_INTERVALS)
@@ -1,13 +1,19 @@
 # package imports
 import dash
-from dash import html, dcc, callback, Input, Output, State
+from dash import html, dcc, callback, Input, Output, State, MATCH
 import dash_bootstrap_components as dbc
 
 # local imports
 from utils.utils import id_factory
+from utils.figure_cache import cachedFigure
+from utils.export import exportControls, exportUrl, formatChoice, sendFrame
 id = id_factory('tower')
 from .functions import *
-from data.tower_data import *
+from data import tower_data as t_data
+
+# type of the pattern-matching ids of the static plots,
+# used to re-fetch the data of a plot when it is zoomed
+STATIC_GRAPH_TYPE = id('static_graph')
 
 # page registration
 dash.register_page(
@@ -31,11 +37,8 @@ dash.register_page(
 #----In this tab you can plot the displacements of benchmarks
 #----in the Tower and in the Catino, choosing from a plan view
 
-# standalone figures
+# standalone figures (filled in on page load)
 ## FIX: these two functions are practically the same: unify them
-t_fig_bench_sel = figureBenchSelection(T_CAPRARO_BENCHMARKS)
-t_fig_stabil_bench_sel = figureBenchStabilSelection(T_STABIL_COORDS)
-
 # tab itself
 t_tab_plan= dbc.Tab([
     html.Div([
@@ -60,7 +63,7 @@ t_tab_plan= dbc.Tab([
             dbc.Row([
                 dbc.Col([
                     dcc.Markdown('**Levelling during 2002-2022:**',),
-                    dcc.Graph(id=id('fig_bench_displacement_selection'), figure=t_fig_bench_sel),
+                    dcc.Graph(id=id('fig_bench_displacement_selection')),
                     
                 ],
                     width=6, align='left'
@@ -73,8 +76,7 @@ t_tab_plan= dbc.Tab([
                     html.Br(),
                     html.Br(),
                     html.Br(),
-                    dcc.Graph(id=id('fig_stabil_bench_displacement_selection'), 
-                    figure=t_fig_stabil_bench_sel),
+                    dcc.Graph(id=id('fig_stabil_bench_displacement_selection')),
                 ],
                     width=6, align='right'
                 ),
@@ -82,7 +84,12 @@ t_tab_plan= dbc.Tab([
     ]),
     html.Br(),
     html.Div(id=id('div_bench_displacement_plots')),
-    html.Button("Download CSV", id="btn-download"),
+    dbc.Stack([
+        formatChoice(id('radioitems_download_format')),
+        html.Button("Download data", id="btn-download"),
+    ],
+        direction='horizontal', gap=3
+    ),
     dcc.Download(id="download-data"),
     html.Br(),
     html.Div(id=id('div_stabil_bench_displacement_plots')),
@@ -95,9 +102,6 @@ t_tab_plan= dbc.Tab([
 #----In this tab you can plot the displacements of benchmarks
 #----in the Tower and in the Catino, as seen in section view
 
-# standalone figures
-t_rot_tower = rot_tower(T_CAPRARO_DATA)
-
 # the tab itself
 t_tab_section = dbc.Tab([
     html.Div([
@@ -307,12 +311,13 @@ t_tab_static= dbc.Tab([
     dcc.RadioItems(
     id=id('resample_static_radio'),
     options=[
+        {'label': 'Auto', 'value': 'auto'},
         {'label': 'Hourly', 'value': 'hourly'},
         {'label': 'Daily', 'value': 'daily'},
         {'label': 'Weekly', 'value': 'weekly'},
         {'label': 'Monthly', 'value': 'monthly'}
     ],
-    value='weekly',  # Valore di default
+    value='auto',  # Valore di default
     style={'width': '300px'}
 ),
 
@@ -364,6 +369,9 @@ t_tab_static= dbc.Tab([
     html.Br(),
     html.Br(),
     html.Div(id=id('div_static_displacement_plots')),
+    exportControls(id('link_static_export'), id('radioitems_static_export')),
+    # settings of the plots, to re-fetch their data when zoomed
+    dcc.Store(id=id('store_static_selection')),
 ],
     label='STATIC MONITORING'
 )
@@ -381,7 +389,7 @@ t_tab_static_info= dbc.Tab([
         html.H2('GANTT'),
         html.Br(),  
     ]),
-    html.Div([ dcc.Graph(id=id('fig_static_gantt'), figure=gantt_chart()),
+    html.Div([ dcc.Graph(id=id('fig_static_gantt')),
            
             ]),
     
@@ -415,6 +423,28 @@ layout = dbc.Row([
 #=================
 #    CALLBACKS
 #=================
+#---------------------
+#    PAGE LOADING
+#---------------------
+# Data is loaded on the first visit to the page (see data.registry),
+# so the figures which depend on it are filled in here
+# instead of in the layout.
+@callback(Output(id('fig_bench_displacement_selection'), 'figure'),
+             Input(id('fig_bench_displacement_selection'), 'id'))
+def callFigureBenchSelection(_):
+    return benchSelectionFigure()
+
+@callback(Output(id('fig_stabil_bench_displacement_selection'), 'figure'),
+             Input(id('fig_stabil_bench_displacement_selection'), 'id'))
+def callFigureBenchStabilSelection(_):
+    return benchStabilSelectionFigure()
+
+@callback(Output(id('fig_static_gantt'), 'figure'),
+             Input(id('fig_static_gantt'), 'id'))
+def callFigureStaticGantt(_):
+    return ganttFigure()
+
+
 #----------------------
 #    TOWER PLAN tab
 #----------------------
@@ -425,7 +455,7 @@ def callDivBenchDisplacement(selectedData):
     try:
         bench = [el['customdata'] for el in selectedData['points']]
         children=[]
-        children += [dcc.Graph(figure=figureBenchDisplacement(bench, T_CAPRARO_DATA))]
+        children += [dcc.Graph(figure=figureBenchDisplacement(bench, t_data.T_CAPRARO_DATA))]
     except:
         children = dcc.Markdown('Select at least one benchmark.')
         
@@ -438,9 +468,10 @@ def callDivBenchDisplacement(selectedData):
     Output("download-data", "data"),
     Input("btn-download", "n_clicks"),
     State(id('fig_bench_displacement_selection'), 'selectedData'),
+    State(id('radioitems_download_format'), 'value'),
     prevent_initial_call=True
 )
-def download_csv(n_clicks, selectedData):
+def download_data(n_clicks, selectedData, export_format):
     if selectedData is None:
         return dash.no_update
 
@@ -449,17 +480,16 @@ def download_csv(n_clicks, selectedData):
         bench = [el['customdata'] for el in selectedData['points']]
         
         # Verifica che i nomi delle colonne siano nel DataFrame
-        valid_columns = [col for col in bench if col in T_CAPRARO_DATA.columns]
+        valid_columns = [col for col in bench if col in t_data.T_CAPRARO_DATA.columns]
         
         if not valid_columns:
             return dash.no_update
         
         # Estrai i dati delle colonne valide
-        df = T_CAPRARO_DATA[valid_columns]
+        df = t_data.T_CAPRARO_DATA[valid_columns]
         
-        # Converti in CSV
-        csv_string = df.to_csv(index=False)
-        return dict(content=csv_string, filename="data.csv")
+        # dates are kept (as the index)
+        return sendFrame(df, export_format, 'tower_levelling')
     except Exception as e:
         print(f"Errore: {e}")
         return dash.no_update
@@ -471,7 +501,7 @@ def callDivDFBenchDisplacement(selectedData):
     try:
         bench = [el['customdata'] for el in selectedData['points']]
         children=[]
-        children += [dcc.Graph(figure=figureBenchDisplacement(bench, T_STABIL_DISP))]
+        children += [dcc.Graph(figure=figureBenchDisplacement(bench, t_data.T_STABIL_DISP))]
     except:
         children = dcc.Markdown('')
         
@@ -489,7 +519,7 @@ def callFigureBenchSectionSelection(selection):
     if len(b) == 1:
         b = '0' + b    
     selected_bench = selectBenchSection(b)
-    return figureSectionSel(selected_bench, T_CAPRARO_BENCHMARKS)
+    return figureSectionSel(selected_bench, t_data.T_CAPRARO_BENCHMARKS)
 
 #----Update resample text in settings pane
 @callback(Output(id('text_bench_section_resample'), 'children'),
@@ -507,12 +537,13 @@ def callTextBenchSectionresample(resample):
 @callback(Output(id('fig_bench_section'), 'figure'),
              Input(id('slider_bench_section_selection'), 'value'),
              Input(id('slider_bench_section_resample'), 'value'))        
+@cachedFigure('T_CAPRARO_DATA', 'T_CAPRARO_BENCHMARKS')
 def callFigureBenchSection(selection, resample):
     b = str(selection)
     if len(b) == 1:
         b = '0' + b
     selected_bench = selectBenchSection(b)
-    return figureBenchSection(selected_bench, resample, T_CAPRARO_DATA, T_CAPRARO_BENCHMARKS)
+    return figureBenchSection(selected_bench, resample, t_data.T_CAPRARO_DATA, t_data.T_CAPRARO_BENCHMARKS)
 
 #----Plot angle between benchmarks 904-911
 @callback(Output(id('div_rot'), 'children'),
@@ -520,7 +551,7 @@ def callFigureBenchSection(selection, resample):
 def callFigureRot(selection):
     b = str(selection)
     if b=='1' or b=='01':
-        children = dbc.Row(dcc.Graph(figure=t_rot_tower))
+        children = dbc.Row(dcc.Graph(figure=rotTowerFigure()))
         return children
 
 
@@ -529,7 +560,8 @@ def callFigureRot(selection):
 #-----------------------------------
 
 @callback(
-    Output(id('div_static_displacement_plots'), 'children'),
+    [Output(id('div_static_displacement_plots'), 'children'),
+     Output(id('store_static_selection'), 'data')],
     [Input('dropdown-telecoordinometers', 'value'),
      Input('dropdown-GB_pendulum', 'value'),
      Input('dropdown-inclinometers', 'value'),
@@ -589,11 +621,75 @@ def callDivStaticDisp(telecoordinometers, gb, inclinometers, inc_temp,defor,temp
         combined_values.extend(additional_values)
     
     
-    df=merge_and_filter_dataframe('data/tower/parquet_data/static/*',resample, combined_values, start_date, end_date)
-    
+    selection = dict(
+        resample=resample,
+        start=start_date,
+        end=end_date,
+        together=together_list[tog],
+        y_axis=y_list[yax],
+        remove_out=out_list[outliers]
+    )
+    # with 'auto', the finest resolution that still fits the plot width
+    if resample == 'auto':
+        resample = pickResolution(start_date, end_date)
     try:
-        children = figureStaticDisplacement(df, start_date,end_date,together_list[tog],y_list[yax],out_list[outliers])
+        df = readStaticArchive(resample, combined_values, start_date, end_date)
+        children = figureStaticDisplacement(df, start_date,end_date,together_list[tog],y_list[yax],out_list[outliers], STATIC_GRAPH_TYPE)
+        # sensors without data are not plotted
+        selection['sensors'] = list(df.columns)
     except:
         children = dcc.Markdown('Select at least one sensor.')
+        selection = None
 
-    return children
+    return children, selection
+
+
+#---Link to download the data of the plots
+@callback(Output(id('link_static_export'), 'href'),
+             Input(id('store_static_selection'), 'data'),
+             Input(id('radioitems_static_export'), 'value'))
+def callLinkStaticExport(selection, export_format):
+    if selection is None or not selection.get('sensors'):
+        return None
+    resample = selection['resample']
+    if resample == 'auto':
+        resample = pickResolution(selection['start'], selection['end'])
+    return exportUrl(
+        {'static': selection['sensors']},
+        selection['start'], selection['end'], resample, export_format
+    )
+
+
+#---Re-fetch the data of a plot when it is zoomed
+@callback(
+    Output({'type': STATIC_GRAPH_TYPE, 'index': MATCH}, 'figure'),
+    Input({'type': STATIC_GRAPH_TYPE, 'index': MATCH}, 'relayoutData'),
+    State({'type': STATIC_GRAPH_TYPE, 'index': MATCH}, 'id'),
+    State(id('store_static_selection'), 'data'),
+    prevent_initial_call=True
+)
+def callFigureStaticZoom(relayout_data, graph_id, selection):
+    x_range = relayoutRange(relayout_data)
+    if x_range is None or selection is None:
+        return dash.no_update
+
+    if x_range == 'reset':
+        start, end = selection['start'], selection['end']
+    else:
+        start, end = x_range
+    resample = selection['resample']
+    if resample == 'auto':
+        resample = pickResolution(start, end)
+
+    # one plot per sensor, unless they are plotted together
+    sensors = selection['sensors']
+    if not selection['together']:
+        sensors = [sensors[graph_id['index']]]
+    try:
+        df = readStaticArchive(resample, sensors, start, end)
+        fig = figuresStaticDisplacement(df, start, end, selection['together'], selection['y_axis'], selection['remove_out'])[0]
+    except:
+        return dash.no_update
+    if x_range != 'reset':
+        fig.update_xaxes(range=[start, end])
+    return fig
@@ -0,0 +1,95 @@
+# package imports
+import numpy as np
+import pandas as pd
+
+#====================
+#    DOWNSAMPLING
+#====================
+# Long time series are reduced on the server before being sent to the
+# browser: a plot can't show more points than it has pixels, so each
+# trace is cut down to a few points per pixel of the plot width.
+# minMaxIndices keeps the minimum and maximum of each pixel bucket,
+# so that peaks and outliers are still visible.
+# Plots re-request the data of the zoomed range through relayoutData
+# (see relayoutRange), so zooming in shows finer data.
+
+# plot width (in pixels) used when the actual width is not known
+PLOT_WIDTH = 1200
+
+# nominal length of each resolution, finest first
+RESOLUTIONS = {
+    'hourly': pd.Timedelta(hours=1),
+    'daily': pd.Timedelta(days=1),
+    'weekly': pd.Timedelta(weeks=1),
+    'monthly': pd.Timedelta(days=30),
+}
+
+
+def minMaxIndices(x, y, n_buckets):
+    """
+    Splits *x* (sorted numbers) in *n_buckets* buckets of equal width
+    and returns the (sorted) positions of the minimum and maximum of *y*
+    in each bucket. For buckets where *y* is all NaN the first position
+    is returned, so that lines are still broken where data is missing.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    if len(x) <= 2 * n_buckets:
+        return np.arange(len(x))
+
+    span = x[-1] - x[0]
+    buckets = ((x - x[0]) / span * n_buckets).astype('int64') if span > 0 else np.zeros(len(x), dtype='int64')
+    buckets = np.minimum(buckets, n_buckets - 1)
+    starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(x))))
+
+    valid = ~np.isnan(y)
+    lows = np.minimum.reduceat(np.where(valid, y, np.inf), starts)
+    highs = np.maximum.reduceat(np.where(valid, y, -np.inf), starts)
+    # first position of each segment where y equals its minimum / maximum
+    is_low = valid & (y == lows[segment])
+    is_high = valid & (y == highs[segment])
+    low_positions = np.flatnonzero(is_low)[np.unique(segment[is_low], return_index=True)[1]]
+    high_positions = np.flatnonzero(is_high)[np.unique(segment[is_high], return_index=True)[1]]
+    empty_positions = starts[~np.isfinite(lows)]
+
+    return np.unique(np.concatenate([low_positions, high_positions, empty_positions]))
+
+
+def downsample(series, width=PLOT_WIDTH):
+    """
+    Returns *series* (with a DatetimeIndex) reduced to the minimum
+    and maximum of each pixel of a plot *width* pixels wide.
+    """
+    positions = minMaxIndices(series.index.asi8, series.to_numpy(), width)
+    return series.iloc[positions]
+
+
+def pickResolution(start, end, width=PLOT_WIDTH, resolutions=RESOLUTIONS):
+    """
+    Returns the finest of *resolutions* that gives at most
+    two points per pixel between *start* and *end*
+    (the coarsest one if none of them does).
+    """
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for resolution, length in resolutions.items():
+        if span / length <= 2 * width:
+            return resolution
+    return resolution
+
+
+def relayoutRange(relayout_data):
+    """
+    Returns the x range (start, end) selected by a zoom or pan,
+    as read from the relayoutData of a dcc.Graph, 'reset' if the
+    axes have been reset (double click), None for other events.
+    """
+    if not relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    if relayout_data.get('xaxis.autorange'):
+        return 'reset'
+    return None
@@ -0,0 +1,276 @@
+# package imports
+import io
+import urllib.parse
+import flask
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dash import html, dcc
+import dash_bootstrap_components as dbc
+
+# local imports
+from data import baptistery_data as b_data
+from data import square_data as s_data
+from data import tower_data as t_data
+from data.tower.static_archive import readStaticArchive, RESAMPLINGS
+
+#==============
+#    EXPORT
+#==============
+# Time series of any selection of points can be downloaded from
+#     /export?<source>=<id>,<id>,...&start=...&end=...&format=...
+# e.g. /export?ps=sen-asc-3,sen-asc-5&static=INp0M-1A&start=2022-01-01
+# Sources (see EXPORT_SOURCES): ps, square_levelling, tower_levelling,
+# baptistery_levelling, prisms, cracks, static (with resample=hourly,
+# daily, weekly or monthly, default daily).
+# Rows are in long format: datetime, source, id, value (prisms and
+# cracks have an id per component, e.g. '101.x'), with the values as
+# stored in the datasets. The file is written and sent a few columns
+# at a time (EXPORT_CHUNK), so that it is never all in memory.
+# Formats (see EXPORT_FORMATS): csv, parquet, arrow (Arrow IPC file).
+# Pages link to the route with exportControls and exportUrl; frames
+# that are already in memory are downloaded with sendFrame.
+
+# columns (scatterers, sensors...) read at a time
+EXPORT_CHUNK = 200
+# dates used when start or end are not given
+EXPORT_START = '1990-01-01'
+
+EXPORT_SCHEMA = pa.schema([
+    ('datetime', pa.timestamp('ns')),
+    ('source', pa.string()),
+    ('id', pa.string()),
+    ('value', pa.float64()),
+])
+
+
+def longFrame(df, source):
+    """
+    Returns the wide DataFrame *df* (dates on rows, points on
+    columns) in long format, without missing values.
+    """
+    df = df.copy(deep=False)
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = ['.'.join(c) for c in df.columns]
+    df.columns = df.columns.astype(str)
+    df.index.name = 'datetime'
+    long = df.reset_index().melt(id_vars='datetime', var_name='id', value_name='value')
+    long = long.dropna(subset=['value'])
+    long.insert(1, 'source', source)
+    return long
+
+
+def _chunks(ids):
+    for i in range(0, len(ids), EXPORT_CHUNK):
+        yield ids[i:i + EXPORT_CHUNK]
+
+
+def _wideChunks(df, ids, source, start, end):
+    # points are selected on the first level of the columns
+    labels = df.columns.get_level_values(0)
+    for chunk in _chunks([i for i in dict.fromkeys(ids) if i in set(labels)]):
+        yield longFrame(df.loc[start:end, labels.isin(chunk)], source)
+
+
+def _psChunks(ids, start, end):
+    for prefix, name in s_data.PS_STACKS.items():
+        stack_ids = [i for i in dict.fromkeys(ids) if i[:5] == prefix]
+        for chunk in _chunks(stack_ids):
+            df = s_data.psColumns(name, chunk, cache=False)
+            yield longFrame(df.loc[start:end], 'ps')
+
+
+def _staticChunks(ids, start, end, resample):
+    # one year at a time: the archive has one file per year
+    for year in range(start.year, end.year + 1):
+        year_start = max(start, pd.Timestamp(year, 1, 1))
+        year_end = min(end, pd.Timestamp(year, 12, 31))
+        for chunk in _chunks(list(dict.fromkeys(ids))):
+            df = readStaticArchive(resample, chunk, year_start, year_end)
+            yield longFrame(df, 'static')
+
+
+# source -> function(ids, start, end, resample) yielding long DataFrames
+EXPORT_SOURCES = {
+    'ps': lambda ids, start, end, resample: _psChunks(ids, start, end),
+    'square_levelling': lambda ids, start, end, resample: _wideChunks(s_data.S_LEVELLING_DATA, ids, 'square_levelling', start, end),
+    'tower_levelling': lambda ids, start, end, resample: _wideChunks(t_data.T_CAPRARO_DATA, ids, 'tower_levelling', start, end),
+    'baptistery_levelling': lambda ids, start, end, resample: _wideChunks(b_data.B_LEVELLING, ids, 'baptistery_levelling', start, end),
+    'prisms': lambda ids, start, end, resample: _wideChunks(b_data.B_PRISMS, ids, 'prisms', start, end),
+    'cracks': lambda ids, start, end, resample: _wideChunks(b_data.B_EXTENSIMETERS, ids, 'cracks', start, end),
+    'static': _staticChunks,
+}
+
+
+def exportFrames(selection, start, end, resample='daily'):
+    """
+    Yields the data of *selection* (dict source -> list of ids)
+    between *start* and *end* (both included), in long format,
+    a few columns at a time.
+    """
+    start = pd.Timestamp(start or EXPORT_START)
+    end = pd.Timestamp(end) if end else pd.Timestamp.now()
+    # the whole end day is included
+    end = end.normalize() + pd.Timedelta(days=1) - pd.Timedelta(1)
+    for source, ids in selection.items():
+        for df in EXPORT_SOURCES[source](ids, start, end, resample):
+            if not df.empty:
+                yield df
+
+
+#---------------
+#    FORMATS
+#---------------
+class _Sink(io.RawIOBase):
+    # file-like object keeping what is written
+    # until it is taken to be sent
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _table(df):
+    return pa.Table.from_pandas(df, schema=EXPORT_SCHEMA, preserve_index=False)
+
+
+def csvStream(frames):
+    yield ','.join(EXPORT_SCHEMA.names) + '\n'
+    for df in frames:
+        yield df.to_csv(header=False, index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+
+def parquetStream(frames):
+    sink = _Sink()
+    with pq.ParquetWriter(sink, EXPORT_SCHEMA) as writer:
+        for df in frames:
+            writer.write_table(_table(df))
+            yield sink.take()
+    yield sink.take()
+
+
+def arrowStream(frames):
+    sink = _Sink()
+    with pa.ipc.new_file(sink, EXPORT_SCHEMA) as writer:
+        for df in frames:
+            writer.write_table(_table(df))
+            yield sink.take()
+    yield sink.take()
+
+
+# format -> (function writing the frames, mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': (csvStream, 'text/csv', 'csv'),
+    'parquet': (parquetStream, 'application/vnd.apache.parquet', 'parquet'),
+    'arrow': (arrowStream, 'application/vnd.apache.arrow.file', 'arrow'),
+}
+
+
+def sendFrame(df, export_format, name):
+    """
+    Returns the data of a dcc.Download with the DataFrame *df*
+    (index included) in *export_format*, as file *name*.<extension>.
+    Parquet and Arrow files are written from the columns of *df*
+    without converting them (no copy for numeric columns).
+    """
+    filename = '{}.{}'.format(name, EXPORT_FORMATS[export_format][2])
+    if export_format == 'csv':
+        return dcc.send_data_frame(df.to_csv, filename)
+    table = pa.Table.from_pandas(df)
+    sink = io.BytesIO()
+    if export_format == 'parquet':
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return dcc.send_bytes(sink.getvalue(), filename)
+
+
+#----------------
+#    CONTROLS
+#----------------
+def exportUrl(selection, start=None, end=None, resample=None, export_format='csv'):
+    """
+    Returns the URL of the export of *selection*
+    (dict source -> list of ids, see EXPORT_SOURCES).
+    """
+    query = {source: ','.join(map(str, ids)) for source, ids in selection.items() if ids}
+    query.update({k: v for k, v in [('start', start), ('end', end), ('resample', resample)] if v})
+    query['format'] = export_format
+    return '/export?' + urllib.parse.urlencode(query)
+
+
+def formatChoice(format_id):
+    """
+    Radio items to choose one of EXPORT_FORMATS.
+    """
+    return dbc.RadioItems(
+        id=format_id,
+        options=[
+            {'label': 'CSV', 'value': 'csv'},
+            {'label': 'Parquet', 'value': 'parquet'},
+            {'label': 'Arrow', 'value': 'arrow'},
+        ],
+        value='csv',
+        inline=True
+    )
+
+
+def exportControls(link_id, format_id):
+    """
+    A choice of format and a link to the export, whose
+    href is set by a callback of the page with exportUrl.
+    """
+    return dbc.Stack([
+        formatChoice(format_id),
+        html.A('Download data', id=link_id, href=None, target='_blank'),
+    ],
+        direction='horizontal', gap=3
+    )
+
+
+#-------------
+#    ROUTE
+#-------------
+def registerExport(server):
+    """
+    Adds the /export route to the Flask *server* of the app.
+    """
+    @server.route('/export')
+    def export():
+        args = flask.request.args
+        selection = {
+            source: [i for i in args[source].split(',') if i]
+            for source in EXPORT_SOURCES if args.get(source)
+        }
+        export_format = args.get('format', 'csv')
+        resample = args.get('resample', 'daily')
+        if not selection:
+            flask.abort(400, 'Select at least one point, e.g. ?ps=sen-asc-3')
+        if export_format not in EXPORT_FORMATS:
+            flask.abort(400, 'Invalid format. Choose from {}.'.format(', '.join(EXPORT_FORMATS)))
+        if resample not in RESAMPLINGS:
+            flask.abort(400, 'Invalid resample. Choose from {}.'.format(', '.join(RESAMPLINGS)))
+        try:
+            start = pd.Timestamp(args.get('start') or EXPORT_START)
+            end = pd.Timestamp(args['end']) if args.get('end') else None
+        except ValueError:
+            flask.abort(400, 'Invalid start or end date.')
+
+        stream, mimetype, extension = EXPORT_FORMATS[export_format]
+        frames = exportFrames(selection, start, end, resample)
+        return flask.Response(
+            flask.stream_with_context(stream(frames)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': 'attachment; filename=momir_export.{}'.format(extension)}
+        )
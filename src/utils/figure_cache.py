@@ -0,0 +1,221 @@
+# package imports
+import collections
+import functools
+import hashlib
+import json
+import os
+import threading
+import dash
+import plotly
+
+# local imports
+from data.registry import datasetVersion, isLoaded, loadedVersion, onRefresh
+
+#====================
+#    FIGURE CACHE
+#====================
+# Figures that only depend on the inputs of a callback and on some
+# datasets are built once and then served from a cache, as JSON:
+# - a small LRU cache in memory, in each worker process;
+# - a size-bounded cache on disk (CACHE_DIR), shared by all the
+#   workers; least recently used entries are removed first.
+# Keys are made of the module and name of the callback, its inputs,
+# the version of the files of the datasets it reads (see
+# data.registry.datasetVersion, which doesn't load them) and the
+# version of the code (CODE_VERSION), so that figures are rebuilt
+# when the datasets are refreshed or the app is updated.
+# Usage:
+#     @callback(Output(...), Input(...))
+#     @cachedFigure('B_PRISMS', 'B_PRISM_POS')
+#     def callFigure(...):
+
+# directory of the shared cache (relative to src/ as the data paths)
+CACHE_DIR = os.environ.get('MOMIR_FIGURE_CACHE', os.path.join('data', '.cache', 'figures'))
+# maximum size of the shared cache on disk and of each in-memory cache
+MAX_DISK_BYTES = int(os.environ.get('MOMIR_FIGURE_CACHE_MB', 512)) * 2**20
+MAX_MEMORY_BYTES = 64 * 2**20
+# the size of the cache on disk is checked (scanning the directory)
+# when the figures written by this process would exceed MAX_DISK_BYTES,
+# and anyway every DISK_CHECK_EVERY figures, for those of the other workers
+DISK_CHECK_EVERY = 100
+
+
+def codeVersion(src_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))):
+    """
+    Returns a hash of the Python files of the app (in *src_dir*)
+    and of the version of plotly, which both change the figures.
+    """
+    h = hashlib.sha256(plotly.__version__.encode())
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, src_dir).encode())
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+
+# can be set by the deployment instead of hashing the sources
+CODE_VERSION = os.environ.get('MOMIR_CODE_VERSION') or codeVersion()
+
+
+_MEMORY = collections.OrderedDict()   # key -> JSON payload
+_MEMORY_BYTES = 0
+_LOCK = threading.Lock()
+_DISK_BYTES = None   # size of the cache on disk at the last check, plus the figures written since
+_DISK_PUTS = 0
+
+
+def figureKey(name, args, versions):
+    """
+    Returns the cache key of callback *name* (module and name)
+    called with *args* when reading datasets at *versions*
+    (see datasetVersion), with the current CODE_VERSION.
+    """
+    text = json.dumps([CODE_VERSION, name, args, versions], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _memoryGet(key):
+    with _LOCK:
+        payload = _MEMORY.get(key)
+        if payload is not None:
+            _MEMORY.move_to_end(key)
+        return payload
+
+
+def _memoryPut(key, payload):
+    global _MEMORY_BYTES
+    with _LOCK:
+        if key in _MEMORY:
+            return
+        _MEMORY[key] = payload
+        _MEMORY_BYTES += len(payload)
+        while _MEMORY_BYTES > MAX_MEMORY_BYTES and len(_MEMORY) > 1:
+            _, old = _MEMORY.popitem(last=False)
+            _MEMORY_BYTES -= len(old)
+
+
+def _diskGet(key):
+    path = os.path.join(CACHE_DIR, key + '.json')
+    try:
+        with open(path) as f:
+            payload = f.read()
+    except OSError:
+        return None
+    # the modification time marks the last use, for the eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return payload
+
+
+def _diskPut(key, payload):
+    global _DISK_BYTES, _DISK_PUTS
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, key + '.json')
+    # written under a name unique to the process and then renamed,
+    # so that other workers never read a partial file
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    with _LOCK:
+        _DISK_PUTS += 1
+        if _DISK_BYTES is not None:
+            _DISK_BYTES += len(payload)
+        check = (
+            _DISK_BYTES is None or _DISK_BYTES > MAX_DISK_BYTES
+            or _DISK_PUTS % DISK_CHECK_EVERY == 0
+        )
+    if check:
+        remaining = evictDisk()
+        with _LOCK:
+            _DISK_BYTES = remaining
+
+
+def evictDisk(max_bytes=MAX_DISK_BYTES):
+    """
+    Removes the least recently used figures from CACHE_DIR
+    until the cache takes at most *max_bytes*.
+    Returns the size of the cache afterwards.
+    """
+    entries = []
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return total
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            # already removed by another worker
+            pass
+        total -= size
+        if total <= max_bytes:
+            break
+    return total
+
+
+def clearMemoryCache():
+    global _MEMORY_BYTES
+    with _LOCK:
+        _MEMORY.clear()
+        _MEMORY_BYTES = 0
+
+# figures of the old datasets won't be requested anymore (the
+# ones on disk are removed by evictDisk when space is needed)
+onRefresh(clearMemoryCache)
+
+
+def clearFigureCache():
+    """
+    Empties the in-memory cache of this process and the shared one.
+    """
+    clearMemoryCache()
+    if os.path.isdir(CACHE_DIR):
+        evictDisk(0)
+
+
+def cachedFigure(*datasets):
+    """
+    Decorates a callback returning a figure (or anything that can
+    be serialized to JSON) that only depends on its inputs and on
+    *datasets* (names of registered datasets).
+    Returns the figure as a dict: Dash serializes it as it is.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            versions = [datasetVersion(d) for d in datasets]
+            key = figureKey(
+                '{}.{}'.format(function.__module__, function.__qualname__), args, versions
+            )
+            payload = _memoryGet(key)
+            if payload is None:
+                payload = _diskGet(key)
+                if payload is None:
+                    figure = function(*args)
+                    if figure is dash.no_update:
+                        return figure
+                    # the figure shows the datasets in memory: if their version
+                    # is not the one of the key (e.g. a file has changed and
+                    # is not refreshed yet), the figure is not stored
+                    if any(isLoaded(d) and loadedVersion(d) != v for d, v in zip(datasets, versions)):
+                        return figure
+                    payload = json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+                    _diskPut(key, payload)
+                _memoryPut(key, payload)
+            return json.loads(payload)
+        return wrapper
+    return decorator
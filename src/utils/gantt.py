@@ -0,0 +1,68 @@
+# package imports
+import numpy as np
+import pandas as pd
+
+# local imports
+from utils.utils import scatterTrace
+
+#=============
+#    GANTT
+#=============
+# Data availability is drawn as bars, one per interval in which an
+# instrument has data, all in a single trace (bars are separated by
+# gaps in the line): the size of the figure depends on the number of
+# intervals, not on the length of the series.
+# Intervals are DataFrames with columns 'sensor', 'start', 'end'.
+
+
+def joinIntervals(intervals, max_gap=pd.Timedelta(0)):
+    """
+    Joins the consecutive intervals of the same sensor that are
+    separated by at most *max_gap*. *intervals* must be sorted
+    by sensor and start, and not overlap.
+    """
+    if intervals.empty:
+        return intervals
+    sensor = intervals['sensor'].to_numpy()
+    start = intervals['start'].to_numpy()
+    end = intervals['end'].to_numpy()
+    new = np.ones(len(intervals), dtype=bool)
+    new[1:] = (sensor[1:] != sensor[:-1]) | (start[1:] - end[:-1] > np.timedelta64(max_gap))
+    last = np.append(np.flatnonzero(new)[1:] - 1, len(intervals) - 1)
+    return pd.DataFrame({
+        'sensor': sensor[new],
+        'start': start[new],
+        'end': end[last],
+    })
+
+
+def coverageIntervals(dates, sensor, max_gap, min_length=pd.Timedelta(days=1)):
+    """
+    Returns the intervals covered by *dates* (the measurements of
+    *sensor*): dates at most *max_gap* apart are in the same interval.
+    Intervals are at least *min_length* long, so that isolated
+    measurements are still visible.
+    """
+    dates = np.unique(np.asarray(dates, dtype='datetime64[ns]'))
+    dates = dates[~np.isnat(dates)]
+    intervals = joinIntervals(pd.DataFrame({'sensor': sensor, 'start': dates, 'end': dates}), max_gap)
+    intervals['end'] = np.maximum(intervals['end'], intervals['start'] + min_length)
+    return intervals
+
+
+def ganttTrace(intervals, **kwargs):
+    """
+    Returns one trace drawing all the *intervals* as horizontal
+    bars, with the sensors on the y axis (in order of appearance).
+    Other arguments are passed to the trace.
+    """
+    n = len(intervals)
+    x = np.empty(3 * n, dtype=object)
+    x[0::3] = intervals['start'].dt.strftime('%Y-%m-%d %H:%M').to_numpy()
+    x[1::3] = intervals['end'].dt.strftime('%Y-%m-%d %H:%M').to_numpy()
+    x[2::3] = None
+    y = np.empty(3 * n, dtype=object)
+    y[0::3] = y[1::3] = intervals['sensor'].to_numpy()
+    y[2::3] = None
+    kwargs.setdefault('line_width', 10)
+    return scatterTrace(x=x, y=y, mode='lines', **kwargs)
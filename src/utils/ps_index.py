@@ -0,0 +1,195 @@
+# package imports
+import numpy as np
+
+#================
+#    PS INDEX
+#================
+# Index of the PS scatterers of a satellite (info DataFrame with LAT,
+# LON and, for LOS data, COHER and HEIGHT), built once when the data
+# is loaded, so that the map doesn't scan all the scatterers at every
+# change of the filters:
+# - spatial: scatterers are sorted by the cell of a regular lat/lon
+#   grid they fall in, so the ones in a box are a few slices;
+# - attributes: the values of COHER and HEIGHT are sorted, so the
+#   ones in a range are found with a binary search.
+# The index is a dict of numpy arrays; queries return the (sorted)
+# positions of the matching scatterers in the info DataFrame.
+
+# side of the grid cells, in degrees (about 50 m at Pisa)
+GRID_CELL = 0.0005
+# attribute columns that can be filtered by range
+RANGE_COLUMNS = ['COHER', 'HEIGHT']
+
+
+def buildPsIndex(info, cell=GRID_CELL):
+    """
+    Returns the index of the scatterers in *info*.
+    """
+    lat = info['LAT'].to_numpy(dtype='float64')
+    lon = info['LON'].to_numpy(dtype='float64')
+    index = dict(n=len(info), lat=lat, lon=lon, cell=cell, values={}, sorted={})
+    if len(info) == 0:
+        return index
+
+    index['lat0'] = np.nanmin(lat)
+    index['lon0'] = np.nanmin(lon)
+    rows = np.floor((lat - index['lat0']) / cell)
+    cols = np.floor((lon - index['lon0']) / cell)
+    index['nrows'] = int(np.nanmax(rows)) + 1
+    index['ncols'] = int(np.nanmax(cols)) + 1
+    # scatterers without coordinates go in a cell after all the others
+    cells = np.where(np.isnan(rows) | np.isnan(cols), index['nrows'] * index['ncols'], rows * index['ncols'] + cols)
+    cells = cells.astype('int64')
+    index['cell_order'] = np.argsort(cells, kind='stable')
+    index['cell_sorted'] = cells[index['cell_order']]
+
+    for column in RANGE_COLUMNS:
+        if column in info.columns:
+            values = info[column].to_numpy(dtype='float64')
+            order = np.argsort(values, kind='stable')
+            index['values'][column] = values
+            index['sorted'][column] = (values[order], order)
+    return index
+
+
+def _rangeSlice(index, column, low, high):
+    values, _ = index['sorted'][column]
+    return np.searchsorted(values, low, 'left'), np.searchsorted(values, high, 'right')
+
+
+def _boundsSlices(index, bounds):
+    """
+    Returns the slices of cell_order of the grid cells that
+    intersect *bounds*: (lon_min, lat_min, lon_max, lat_max).
+    """
+    lon_min, lat_min, lon_max, lat_max = bounds
+    if index['n'] == 0:
+        return [], []
+    cell = index['cell']
+    r0 = max(int(np.floor((lat_min - index['lat0']) / cell)), 0)
+    r1 = min(int(np.floor((lat_max - index['lat0']) / cell)), index['nrows'] - 1)
+    c0 = max(int(np.floor((lon_min - index['lon0']) / cell)), 0)
+    c1 = min(int(np.floor((lon_max - index['lon0']) / cell)), index['ncols'] - 1)
+    if r0 > r1 or c0 > c1:
+        return [], []
+    # the cells of each grid row inside the box are contiguous
+    rows = np.arange(r0, r1 + 1) * index['ncols']
+    starts = np.searchsorted(index['cell_sorted'], rows + c0, 'left')
+    ends = np.searchsorted(index['cell_sorted'], rows + c1, 'right')
+    return starts, ends
+
+
+def _inside(index, positions, ranges, bounds):
+    """
+    Returns the *positions* that match *ranges* and *bounds*,
+    checking the values of each scatterer.
+    """
+    keep = np.ones(len(positions), dtype=bool)
+    for column, (low, high) in ranges.items():
+        values = index['values'][column][positions]
+        keep &= (values >= low) & (values <= high)
+    if bounds is not None:
+        lon_min, lat_min, lon_max, lat_max = bounds
+        lat = index['lat'][positions]
+        lon = index['lon'][positions]
+        keep &= (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+    return positions[keep]
+
+
+def queryPsIndex(index, ranges=None, bounds=None):
+    """
+    Returns the sorted positions of the scatterers matching all
+    the conditions given.
+    Expects:
+    - ranges: dict column -> (low, high), e.g. {'COHER': (0.6, 1)}
+    - bounds: (lon_min, lat_min, lon_max, lat_max)
+    The scatterers matching the most selective condition are
+    found with the index (their number is known from the index
+    alone), the other conditions are only checked on them.
+    """
+    ranges = ranges or {}
+    options = []
+    for column, (low, high) in ranges.items():
+        start, end = _rangeSlice(index, column, low, high)
+        options.append((max(end - start, 0), column, (start, end)))
+    if bounds is not None:
+        starts, ends = _boundsSlices(index, bounds)
+        options.append((int(np.sum(np.subtract(ends, starts))), 'bounds', (starts, ends)))
+    if not options:
+        return np.arange(index['n'])
+
+    _, best, (start, end) = min(options, key=lambda option: option[0])
+    if best == 'bounds':
+        positions = np.concatenate(
+            [index['cell_order'][s:e] for s, e in zip(start, end)] + [np.array([], dtype='int64')]
+        )
+    else:
+        positions = index['sorted'][best][1][start:end]
+    positions = np.sort(positions)
+    # the chosen range is exact, the cells on the border of
+    # the bounds are only partly inside: check all the rest
+    other_ranges = {c: r for c, r in ranges.items() if c != best}
+    return _inside(index, positions, other_ranges, bounds)
+
+
+#================
+#    VIEWPORT
+#================
+# The map only receives the scatterers inside its current view (read
+# from its relayoutData, see relayoutViewport). The view is enlarged to
+# whole map tiles, so that small pans give the same viewport (and the
+# same cached figure). When too many scatterers are in view they are
+# aggregated by cells of a grid that gets finer as the map is zoomed in.
+
+# size of the aggregation cells, in pixels of the map
+CELL_PIXELS = 12
+
+
+def relayoutViewport(relayout_data):
+    """
+    Returns the viewport of a map after a zoom or pan, as read
+    from the relayoutData of a dcc.Graph with a mapbox:
+    dict(bounds=[lon_min, lat_min, lon_max, lat_max], zoom=...)
+    with the bounds enlarged to whole tiles of the (integer) zoom.
+    Returns None for other events.
+    """
+    if not relayout_data or 'mapbox._derived' not in relayout_data:
+        return None
+    coordinates = np.array(relayout_data['mapbox._derived']['coordinates'], dtype='float64')
+    zoom = int(np.floor(relayout_data.get('mapbox.zoom', 0)))
+    tile = 360 / 2**zoom
+    lon_min, lat_min = np.floor(coordinates.min(axis=0) / tile) * tile
+    lon_max, lat_max = np.ceil(coordinates.max(axis=0) / tile) * tile
+    return dict(bounds=[float(lon_min), float(lat_min), float(lon_max), float(lat_max)], zoom=zoom)
+
+
+def viewportCell(zoom):
+    """
+    Returns the side (in degrees) of the aggregation
+    cells of a map at *zoom*.
+    """
+    return CELL_PIXELS * 360 / (256 * 2**int(zoom))
+
+
+def aggregatePs(index, positions, cell, values):
+    """
+    Groups the scatterers at *positions* by cells of side *cell*
+    (in degrees). Returns a dict of arrays, one element per cell:
+    LAT, LON (mean position), COUNT and the mean of *values*
+    (array with the value of every scatterer, e.g. the velocity).
+    """
+    lat = index['lat'][positions]
+    lon = index['lon'][positions]
+    cells = np.floor(lat / cell) * 2**32 + np.floor(lon / cell)
+    _, groups = np.unique(cells, return_inverse=True)
+    count = np.bincount(groups)
+    values = np.asarray(values, dtype='float64')[positions]
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(groups, np.where(valid, values, 0)) / np.bincount(groups, valid)
+    return dict(
+        LAT=np.bincount(groups, lat) / count,
+        LON=np.bincount(groups, lon) / count,
+        COUNT=count,
+        VALUE=mean,
+    )
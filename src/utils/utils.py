@@ -1,3 +1,6 @@
+import plotly.graph_objects as go
+
+
 def id_factory(page: str):
     def func(_id: str):
         """
@@ -87,3 +90,27 @@ svg_config = {
     'displaylogo': False,
     'editable': True,
 }
+
+
+# traces with more points than this are drawn with WebGL (go.Scattergl)
+# instead of SVG, which gets slow with tens of thousands of points
+GL_THRESHOLD = 5000
+
+
+def scatterClass(n_points):
+    """
+    Returns the trace class to draw *n_points* points:
+    go.Scattergl above GL_THRESHOLD, go.Scatter otherwise.
+    """
+    if n_points > GL_THRESHOLD:
+        return go.Scattergl
+    return go.Scatter
+
+
+def scatterTrace(**kwargs):
+    """
+    Returns a go.Scatter, or a go.Scattergl if it has more
+    than GL_THRESHOLD points. Accepts the arguments of go.Scatter.
+    """
+    x = kwargs.get('x')
+    return scatterClass(0 if x is None else len(x))(**kwargs)